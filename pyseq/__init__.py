@@ -33,6 +33,8 @@ Examples:
     hs.move_ex(1, l1_filter)
     hs.move_ex(2, l2_filter)
     hs.take_picture(32, image_name='FirstHiSeqImage')
+    #Wait for the images to be written in the background
+    hs.writer.flush()
     #Move stage to the initial image scan position and scan image
     hs.x.move(xi)
     10000
@@ -54,16 +56,22 @@ Kunal Pandit 9/19
 
 
 #import instruments
+from . import catalog
 from . import fpga
 from . import laser
+from . import motion
 from . import objstage
 from . import optics
 from . import pump
+from . import store
+from . import transport
 from . import valve
+from . import writer
 from . import xstage
 from . import ystage
 from . import zstage
 
+import functools
 import time
 from os.path import getsize
 from os.path import join
@@ -99,6 +107,8 @@ class HiSeq():
        optics (optics): Illumina HiSeq 2500 :: Optics.
        cam1 (camera): Camera for 558 nm and 687 nm emissions.
        cam2 (camera): Camera for 610 nm and 740 nm emissions.
+       cam_config (CameraConfig): Settings of the cameras, only settings
+            that changed are sent to the cameras before imaging.
        logger (logger): Logger object to log communication with HiSeq.
        image_path (path): Directory to store images in.
        log_path (path): Directory to write log files in.
@@ -107,6 +117,26 @@ class HiSeq():
        resolution (float): Scale of pixels in microns per pixel.
        bundle_height: Line scan bundle height for TDI imaging.
        nyquist_obj: Nyquist sampling distance of z plane in objective steps.
+       stream_frames (bool): True to copy frames from the cameras while the
+            stage is scanning, False to copy them after the scan.
+       stream_timeout (float): Seconds to wait for the last frames after the
+            stage stops scanning.
+       rescan_attempts (int): Number of times take_picture rescans the part
+            of the tile with dropped frames before giving up.
+       parallel_cameras (bool): True to copy the last frames from and save
+            the images of both cameras at the same time in worker threads.
+       map_images (bool): True to copy the frames straight to memory mapped
+            image files instead of holding the images in memory, see
+            writer.MappedImage.
+       writer (ImageWriter): Writes images in the background, call
+            writer.flush() before reading images that were just taken.
+            Set writer.write to a writer.Pyramid to also write downsampled
+            previews of the images.
+       store (ExperimentStore): Chunked store that scan writes the images
+            to instead of TIFFs, None to write TIFFs.
+       catalog (Catalog): Database with a row for every image, None to
+            write a metadata text file for every picture instead.
+       backend (str): 'hardware' or 'sim' for simulated instruments.
     """
 
 
@@ -121,19 +151,44 @@ class HiSeq():
                        valveB10COM = 'COM19',
                        fpgaCOM = ['COM12','COM15'],
                        laser1COM = 'COM13',
-                       laser2COM = 'COM14'):
-        """Constructor for the HiSeq."""
+                       laser2COM = 'COM14',
+                       backend = 'hardware'):
+        """Constructor for the HiSeq.
+
+           Parameters:
+           backend (str, optional): 'hardware' to connect to the instruments
+                on the COM ports, or 'sim' to connect to the simulated
+                instruments in pyseq.sim instead.
+        """
+
+        if backend == 'sim':
+            from . import sim
+            yCOM = 'sim://ystage'
+            xCOM = 'sim://xstage'
+            pumpACOM = 'sim://pumpA'
+            pumpBCOM = 'sim://pumpB'
+            valveA24COM = 'sim://valveA24'
+            valveB24COM = 'sim://valveB24'
+            valveA10COM = 'sim://valveA10'
+            valveB10COM = 'sim://valveB10'
+            fpgaCOM = ['sim://fpga','sim://fpga']
+            laser1COM = 'sim://laser1'
+            laser2COM = 'sim://laser2'
+        elif backend != 'hardware':
+            raise ValueError('backend must be hardware or sim')
+        self.backend = backend
 
         self.y = ystage.Ystage(yCOM, logger = Logger)
         self.f = fpga.FPGA(fpgaCOM[0], fpgaCOM[1], logger = Logger)
         self.x = xstage.Xstage(xCOM, logger = Logger)
         self.l1 = laser.Laser(laser1COM, color = 'green', logger = Logger)
         self.l2 = laser.Laser(laser2COM, color = 'red', logger = Logger)
-        self.z = zstage.Zstage(self.f.serial_port, logger = Logger)
-        self.obj = objstage.OBJstage(self.f.serial_port, logger = Logger)
-        self.optics = optics.Optics(self.f.serial_port, logger = Logger)
+        self.z = zstage.Zstage(self.f, logger = Logger)
+        self.obj = objstage.OBJstage(self.f, logger = Logger)
+        self.optics = optics.Optics(self.f, logger = Logger)
         self.cam1 = None
         self.cam2 = None
+        self.cam_config = None                                                  # camera settings applied before imaging
         self.p = {'A': pump.Pump(pumpACOM, 'pumpA', logger = Logger),
                   'B': pump.Pump(pumpBCOM, 'pumpB', logger = Logger)
                   }
@@ -152,17 +207,39 @@ class HiSeq():
         self.resolution = 0.375                                                 #um/px
         self.bundle_height = 128.0
         self.nyquist_obj = 235                                                  # 0.9 um (235 obj steps) is nyquist sampling distance in z plane
+        self.stream_frames = True                                               # copy frames to host during the scan
+        self.stream_timeout = 2.0                                               # s to wait for the last frames after the scan
+        self.rescan_attempts = 2                                                # times to rescan dropped frames of a picture
+        self.parallel_cameras = True                                            # drain and save both cameras at the same time
+        self.map_images = False                                                 # copy frames straight to memory mapped files
+        self.writer = writer.ImageWriter(logger = Logger)                       # writes images in the background
+        self.store = None                                                       # chunked store of the experiment images
+        self.catalog = None                                                     # database of the experiment images
         self.logger = Logger
 
 
 
-    def initializeCams(self, Logger=None):
-        """Initialize all cameras."""
+    def initializeCams(self, Logger=None, user_memory=False):
+        """Initialize all cameras.
+
+           Parameters:
+           user_memory (bool, optional): True for the cameras to write frames
+                straight into host memory (HamamatsuCameraMR), False to copy
+                frames out of the DCAM buffers.
+        """
 
         from . import dcam
 
-        self.cam1 = dcam.HamamatsuCamera(0, logger = Logger)
-        self.cam2 = dcam.HamamatsuCamera(1, logger = Logger)
+        if self.backend == 'sim':
+            from .sim import dcam as simdcam
+            dcam.setLibrary(simdcam.DCAMAPI())
+
+        if user_memory:
+            self.cam1 = dcam.HamamatsuCameraMR(0, logger = Logger)
+            self.cam2 = dcam.HamamatsuCameraMR(1, logger = Logger)
+        else:
+            self.cam1 = dcam.HamamatsuCamera(0, logger = Logger)
+            self.cam2 = dcam.HamamatsuCamera(1, logger = Logger)
 
         #Set emission labels, wavelengths in  nm
         self.cam1.left_emission = 687
@@ -170,32 +247,26 @@ class HiSeq():
         self.cam2.left_emission = 610
         self.cam2.right_emission = 740
 
+        # Camera settings
+        self.cam_config = dcam.CameraConfig(
+                exposure_time = 40.0,
+                binning = 1,
+                sensor_mode = 4,                                                #1=AREA, 2=LINE, 4=TDI, 6=PARTIAL AREA
+                trigger_mode = 1,                                               #Normal
+                trigger_polarity = 1,                                           #Negative
+                trigger_connector = 1,                                          #Interface
+                trigger_source = 2,                                             #1 = internal, 2=external
+                contrast_gain = 0)                                              # subarray_mode is set from the ROI by captureSetup
+
         # Initialize camera 1
         print('Initializing camera 1...')
-        self.cam1.setPropertyValue("exposure_time", 40.0)
-        self.cam1.setPropertyValue("binning", 1)
-        self.cam1.setPropertyValue("sensor_mode", 4)                            #1=AREA, 2=LINE, 4=TDI, 6=PARTIAL AREA
-        self.cam1.setPropertyValue("trigger_mode", 1)                           #Normal
-        self.cam1.setPropertyValue("trigger_polarity", 1)                       #Negative
-        self.cam1.setPropertyValue("trigger_connector", 1)                      #Interface
-        self.cam1.setPropertyValue("trigger_source", 2)                         #1 = internal, 2=external
-        self.cam1.setPropertyValue("contrast_gain", 0)
-        self.cam1.setPropertyValue("subarray_mode", 1)                          #1 = OFF, 2 = ON
-
+        self.cam1.configure(self.cam_config)
         self.cam1.captureSetup()
         self.cam1.get_status()
 
         # Initialize Camera 2
         print('Initializing camera 2...')
-        self.cam2.setPropertyValue("exposure_time", 40.0)
-        self.cam2.setPropertyValue("binning", 1)
-        self.cam2.setPropertyValue("sensor_mode", 4)                            #1=AREA, 2=LINE, 4=TDI, 6=PARTIAL AREA
-        self.cam2.setPropertyValue("trigger_mode", 1)                           #Normal
-        self.cam2.setPropertyValue("trigger_polarity", 1)                       #Negative
-        self.cam2.setPropertyValue("trigger_connector", 1)                      #Interface
-        self.cam2.setPropertyValue("trigger_source", 2)                         #1 = internal, 2=external
-        self.cam2.setPropertyValue("contrast_gain", 0)
-
+        self.cam2.configure(self.cam_config)
         self.cam2.captureSetup()
         self.cam2.get_status()
 
@@ -252,7 +323,7 @@ class HiSeq():
 
         date = time.strftime('%Y%m%d_%H%M%S')
         meta_path = join(self.image_path, 'meta_'+image_name+'.txt')
-        meta_f = open(image_path, 'w+')
+        meta_f = open(meta_path, 'w+')
         meta_f.write('time ' + date + '\n' +
                      'y ' + str(self.y.position) + '\n' +
                      'x ' + str(self.x.position) + '\n' +
@@ -271,15 +342,19 @@ class HiSeq():
         return meta_f
 
 
-    def take_picture(self, n_frames, bundle = 128, image_name = None):
+    def take_picture(self, n_frames, bundle = 128, image_name = None,
+                     store_index = None, section = None, cycle = None):
         """Take a picture using all the cameras and save as a tiff.
 
            The section to be imaged should already be in position and
            optical settings should already be set.
            The final size of the image is 2048 x n_frames*bundle px in size,
            because the total number of pixels in the y dimension =
-           n_frames*bundle. The images and metadata are stored in the
-           self.image_path directory.
+           n_frames*bundle. The images are stored in the self.image_path
+           directory. The metadata of each image is added to self.catalog, or
+           written to a text file in self.image_path if there is no catalog.
+           The images are written in the background by self.writer, call
+           self.writer.flush() to wait for them.
 
            Parameters:
            n_frames (int): Number of frames in the images.
@@ -287,6 +362,11 @@ class HiSeq():
                 default is 128.
            image_name (str, optional): Common name of the images, the default
                 is a time stamp.
+           store_index (dict, optional): Section, cycle, z, and optionally y
+                and x position of the images in self.store. If given, the
+                images are written to the store instead of TIFFs.
+           section (str, optional): Section of the images in self.catalog.
+           cycle (int, optional): Cycle of the images in self.catalog.
 
            Returns:
            bool: True if all of the frames of the image were taken, False if
@@ -309,7 +389,8 @@ class HiSeq():
 
         #Make sure TDI is synced with Ystage
         y_pos = y.position
-        if abs(y_pos - f.read_position()) > 10:
+        tdi_y = f.read_position()
+        if abs(y_pos - tdi_y) > 10:
             self.message('Attempting to sync TDI and stage')
             f.write_position(y.position)
         else:
@@ -317,93 +398,270 @@ class HiSeq():
 
         #TO DO, double check gains and velocity are set
         #Set gains and velocity of image scanning for ystage
-        response = y.command('GAINS(5,10,5,2,0)')
-        response = y.command('V0.15400')
-
-
-        # Make sure cameras are ready (status = 3)
-        while cam1.get_status() != 3:
-            cam1.stopAcquisition()
-            cam1.freeFrames()
-        while cam2.get_status() != 3:
-            cam2.stopAcquisition()
-            cam2.freeFrames()
-        # Set bundle height
-        cam1.setPropertyValue("sensor_mode_line_bundle_height", bundle)
-        cam2.setPropertyValue("sensor_mode_line_bundle_height", bundle)
-        cam1.captureSetup()
-        cam2.captureSetup()
-        # Allocate memory for image data
-        cam1.allocFrame(n_frames)
-        cam2.allocFrame(n_frames)
-
-
-        #
-        #Arm stage triggers
-        #
+        y.set_gains(y.imaging_gains)
+        y.set_velocity(0.154)
+
+
+        # Set bundle height, only changed settings are sent to the cameras
+        self.cam_config.set(sensor_mode_line_bundle_height = bundle)
+
+        # Record the metadata of the picture before the stage scans
+        meta_f = None
+        meta = None
+        if self.catalog is None:
+            meta_f = self.write_metadata(n_frames, bundle, image_name)
+        else:
+            meta = {'time': time.strftime('%Y%m%d_%H%M%S'), 'name': image_name,
+                    'section': section, 'cycle': cycle, 'x': x.position,
+                    'y': y_pos, 'z': str(self.z.position), 'obj': obj.position,
+                    'tdi_y': tdi_y, 'ex_filter1': str(op.ex[0]),
+                    'ex_filter2': str(op.ex[1]), 'em_in': op.em_in,
+                    'laser1': l1.power, 'laser2': l2.power,
+                    'n_frames': n_frames, 'bundle': bundle}
+
+        # Memory map the channel images to their files, the frames are
+        # copied straight to the files as they are drained
+        maps = [None, None]
+        if self.map_images and store_index is None:
+            maps = [writer.MappedImage(cam.imagePaths(image_name, self.image_path),
+                                       (n_frames*bundle, int(cam.frame_x/2)),
+                                       logger = self.logger)
+                    for cam in [cam1, cam2]]
+
+        # Scan the tile, then remove the files of incomplete mapped images,
+        # or of all of them if the scan fails
+        t0 = time.perf_counter()
+        taken = [0, 0]
+        try:
+            images, taken, rescans = self.scan_tile(y_pos, n_frames, bundle,
+                                                    maps)
+        finally:
+            for mapped, n in zip(maps, taken):
+                if mapped is not None and n < n_frames:
+                    mapped.close(keep = False)
+        scan_time = time.perf_counter() - t0
+        if rescans and meta_f is not None:
+            meta_f.write('\nrescans ' + str(rescans))
+
+        # Check if all frames were taken from each camera then save images
+        image_complete = True
+        saves = []
+        for cam, image, n, mapped in zip([cam1, cam2], images, taken, maps):
+            if n < n_frames:
+                self.message('Cam' + str(cam.camera_id) + ' image not taken')
+                image_complete = False
+            elif mapped is not None:
+                cam.stats['bytes_saved'] += mapped.nbytes
+                if isinstance(self.writer.write, writer.Pyramid):
+                    for path, channel in zip(cam.imagePaths(image_name,
+                                                            self.image_path),
+                                             mapped.channels):
+                        self.writer.submit(path, channel,
+                                           self.writer.write.previews)
+                saves.append(mapped.close)
+            elif store_index is not None:
+                saves.append(functools.partial(cam.storeImage,
+                                               image[0:n_frames*bundle],
+                                               self.store, self.writer,
+                                               **store_index))
+            else:
+                saves.append(functools.partial(cam.writeImage,
+                                               image[0:n_frames*bundle],
+                                               image_name, self.image_path,
+                                               self.writer))
+        if self.parallel_cameras:
+            motion.run_threads(*saves)
+        else:
+            for save in saves:
+                save()
+        # Log transfer counters of the picture
+        cam1.message(cam1.getStats())
+        cam2.message(cam2.getStats())
+        # Add a row for each channel image to the catalog
+        if self.catalog is not None:
+            rows = []
+            for cam, n, mapped in zip([cam1, cam2], taken, maps):
+                if mapped is not None:
+                    paths = mapped.paths
+                elif store_index is not None:
+                    paths = [self.store.path] * 2
+                else:
+                    paths = cam.imagePaths(image_name, self.image_path)
+                stats = cam.getStats()
+                for channel, path in zip([cam.left_emission, cam.right_emission],
+                                         paths):
+                    row = dict(meta)
+                    row.update({'channel': str(channel),
+                                'frames_taken': min(n, n_frames),
+                                'rescans': rescans, 'scan_time': scan_time,
+                                'drain_time': stats['drain_time'],
+                                'save_time': stats['save_time'],
+                                'path': path, 'complete': n >= n_frames})
+                    rows.append(row)
+            self.catalog.add(rows)
+        # Print out info pulses = triggers, not sure with CLINES is
+        if image_complete:
+            response = f.command('TDICLINES')
+            response = f.command('TDIPULSES')
+        # Reset gains & velocity for ystage
+        y.set_gains(y.moving_gains)
+        y.set_velocity(1)
+
+        if meta_f is not None:
+            meta_f.close()
+
+        return image_complete
+
+
+    def scan_tile(self, y_pos, n_frames, bundle, maps):
+        """Scan a tile and rescan the frames that were dropped.
+
+           The ystage should already be at y_pos with the imaging gains and
+           velocity set, and the TDI encoder synced with it.
+
+           Parameters:
+           y_pos (int): Ystage and TDI encoder position of the first line.
+           n_frames (int): Number of frames to take.
+           bundle (int): Line bundle height of the frames.
+           maps (list): [cam1, cam2] MappedImage to copy the frames to, or
+                None to copy them to a new image.
+
+           Returns:
+           list: [cam1 image, cam2 image], None for a mapped image, its
+                frames are only in its files, so nothing maps them after
+                scan_tile returns.
+           list: [cam1, cam2] number of frames taken.
+           int: Number of rescans.
+        """
+
+        from . import dcam
+
+        y = self.y
+        f = self.f
+
+        # Scan the tile
+        images = self.tdi_scan(y_pos, n_frames, bundle,
+                               [None if m is None else m.channels for m in maps])
+        taken = [dcam.imageHeight(image)//bundle for image in images]
+
+        # Rescan only the frames that were dropped, starting from the first
+        # missing line of the TDI encoder, and merge them into the images
+        rescans = 0
+        if min(taken) < n_frames and self.rescan_attempts:
+            full = []
+            for image, n, mapped in zip(images, taken, maps):
+                if mapped is not None:
+                    full.append(mapped.channels)
+                    continue
+                merged = np.empty((n_frames*bundle, image.shape[1]),
+                                  dtype = image.dtype)
+                merged[0:n*bundle] = image[0:n*bundle]
+                full.append(merged)
+            images = full
+        while min(taken) < n_frames and rescans < self.rescan_attempts:
+            rescans += 1
+            first = min(taken)
+            # Lines are triggered every 75 encoder steps from y_pos, move
+            # to the first missing line and start the segment from where
+            # the TDI encoder reads the stage to be
+            y.set_gains(y.moving_gains)
+            y.set_velocity(1)
+            y.move(y_pos - first*bundle*75)
+            segment_y = f.read_position()
+            if abs(y.position - segment_y) > 10:
+                f.write_position(y.position)
+                segment_y = f.read_position()
+            self.message('Rescanning frames ' + str(first) + ' to ' +
+                         str(n_frames) + ' from TDI position ' +
+                         str(segment_y))
+            y.set_gains(y.imaging_gains)
+            y.set_velocity(0.154)
+            segments = self.tdi_scan(segment_y, n_frames - first, bundle,
+                                     [dcam.imageRows(image, first*bundle, None)
+                                      for image in images])
+            taken = [first + dcam.imageHeight(segment)//bundle
+                     for segment in segments]
+
+        images = [None if mapped is not None else image
+                  for image, mapped in zip(images, maps)]
+
+        return images, taken, rescans
+
+
+    def tdi_scan(self, y_pos, n_frames, bundle, images = None):
+        """Scan the ystage and read the frames from both cameras.
+
+           The ystage should already be at y_pos with the imaging gains and
+           velocity set, and the TDI encoder synced with it.
+
+           Parameters:
+           y_pos (int): Ystage and TDI encoder position of the first line.
+           n_frames (int): Number of frames to take.
+           bundle (int): Line bundle height of the frames.
+           images (list, optional): [cam1 image, cam2 image] arrays with a
+                row for every line to copy the frames to, the default is new
+                arrays or the camera buffers.
+
+           Returns:
+           list: [cam1 image, cam2 image] with the rows of the frames that
+                were taken.
+        """
+
+        y = self.y
+        f = self.f
+        cams = [self.cam1, self.cam2]
+        if images is None:
+            images = [None, None]
+
+        # Make sure cameras are not acquiring (status = 1 is busy), camera
+        # buffers from the last picture are kept and reused
+        for cam in cams:
+            while cam.get_status() == 1:
+                cam.stopAcquisition()
+            cam.configure(self.cam_config)
+            cam.allocFrame(n_frames)
+
+        # Arm stage triggers
         #TODO check trigger y values are reasonable
         n_triggers = n_frames * bundle
         end_y_pos = y_pos - n_triggers*75
         f.TDIYPOS(y_pos)
         f.TDIYARM3(n_triggers, y_pos)
-        #print('Trigger armed, Imaging starting')
-
-
 
-        meta_f = self.write_metadata(n_frames, bundle, image_name)
-
-        ################################
-        ### Start Imaging ##############
-        ################################
-
-        # Start cameras
-        cam1.startAcquisition()
-        cam2.startAcquisition()
+        # Start cameras, copy frames to host as they arrive
+        for cam in cams:
+            cam.startAcquisition()
+        if self.stream_frames:
+            streams = [cam.startStream(n_frames, image)
+                       for cam, image in zip(cams, images)]
         # Open laser shutter
         f.command('SWLSRSHUT 1')
         # move ystage (blocking)
         y.move(end_y_pos)
-
-
-
-        ################################
-        ### Stop Imaging ###############
-        ################################
-
-        # Stop Cameras
-        cam1.stopAcquisition()
-        cam2.stopAcquisition()
+        # Wait for the last frames, then stop the readers before the cameras
+        # are idled and their buffers released
+        if self.stream_frames:
+            for stream in streams:
+                stream.wait(self.stream_timeout)
+            for stream in streams:
+                stream.stop()
+
+        # Stop cameras
+        for cam in cams:
+            cam.stopAcquisition()
         # Close laser shutter
         f.command('SWLSRSHUT 0')
-        # Check if all frames were taken from camera 1 then save images
-        if cam1.getFrameCount() != n_frames:
-            print('Cam1 image not taken')
-            image_complete = False
-        else:
-            cam1.saveImage(image_name, self.image_path)
-            image_complete = True
-        # Check if all frames were taken from camera 2 then save images
-        if cam2.getFrameCount() != n_frames:
-            print('Cam2 image not taken')
-            image_complete = False
-        else:
-            cam2.saveImage(image_name, self.image_path)
-            image_complete = True
-        # Print out info pulses = triggers, not sure with CLINES is
-        if image_complete:
-            response = f.command('TDICLINES')
-            response = f.command('TDIPULSES')
-        # Free up frames/memory
-        cam1.freeFrames()
-        cam2.freeFrames()
-
-        # Reset gains & velocity for ystage
-        y.command('GAINS(5,10,7,1.5,0)')
-        y.command('V1')
 
-        meta_f.close()
+        # Copy the last frames from the cameras
+        if not self.stream_frames:
+            streams = [None, None]
+        if self.parallel_cameras:
+            return motion.run_threads(*[functools.partial(cam.drainFrames, stream, image)
+                                        for cam, stream, image in zip(cams, streams, images)])
+        else:
+            return [cam.drainFrames(stream, image)
+                    for cam, stream, image in zip(cams, streams, images)]
 
-        return image_complete
 
 ##########################################
 #### AUTOFOCUS WORK IN PROGRESS ##########
@@ -491,6 +749,66 @@ class HiSeq():
 ##        cam2.captureSetup()
 
 
+    def gather_moves(self, x = None, y = None, z = None, obj = None,
+                     ex1 = None, ex2 = None, em_in = None,
+                     l1_power = None, l2_power = None):
+        """Move independent instruments at the same time.
+
+           Only the instruments given a position are moved. The x and y
+           stage still move one after the other, y first, like they did
+           before the moves were gathered, while the other instruments move.
+           The lasers each have their own port. The z stage, objective stage
+           and filters share the FPGA, their commands are interleaved and the
+           FPGA matches the responses to each command.
+
+           Parameters:
+           x (int, optional): Absolute step position of the x stage.
+           y (int, optional): Absolute step position of the y stage.
+           z ([int, int, int], optional): Absolute step positions of the tilt
+                motors.
+           obj (int, optional): Step position of the objective.
+           ex1 (str, optional): Excitation filter for the green laser.
+           ex2 (str, optional): Excitation filter for the red laser.
+           em_in (bool, optional): True to move the emission filter in to the
+                light path, False to move it out.
+           l1_power (int, optional): Power of the green laser in mW.
+           l2_power (int, optional): Power of the red laser in mW.
+
+           Returns:
+           dict: Return value of each move keyed by the argument name.
+        """
+
+        stage = {}
+        if y is not None:
+            stage['y'] = functools.partial(self.y.move, y)
+        if x is not None:
+            stage['x'] = functools.partial(self.x.move, x)
+        moves = {}
+        if stage:
+            moves['stage'] = lambda: {name: move() for name, move in stage.items()}
+        if z is not None:
+            moves['z'] = functools.partial(self.z.move, z)
+        if obj is not None:
+            moves['obj'] = functools.partial(self.obj.move, obj)
+        if ex1 is not None:
+            moves['ex1'] = functools.partial(self.optics.move_ex, 1, ex1)
+        if ex2 is not None:
+            moves['ex2'] = functools.partial(self.optics.move_ex, 2, ex2)
+        if em_in is not None:
+            moves['em_in'] = functools.partial(self.optics.move_em_in, em_in)
+        if l1_power is not None:
+            moves['l1_power'] = functools.partial(self.l1.set_power, l1_power)
+        if l2_power is not None:
+            moves['l2_power'] = functools.partial(self.l2.set_power, l2_power)
+
+        # Worker threads instead of an event loop, so gather_moves also
+        # works inside a running loop such as Jupyter
+        results = dict(zip(moves.keys(), motion.run_threads(*moves.values())))
+        results.update(results.pop('stage', {}))
+
+        return results
+
+
     def reset_stage(self):
         """Home ystage and sync with TDI through the FPGA."""
 
@@ -507,6 +825,28 @@ class HiSeq():
         self.y.move(self.y.min_y)
 
 
+    def move_obj(self, obj_pos):
+        """Move the objective and make sure it got there.
+
+           If the objective does not reach the position after its own
+           retries, it is initialized again and the move is tried once more.
+
+           Parameters:
+           obj_pos (int): Step position to move the objective to.
+
+           Raises:
+           RuntimeError: If the objective still can not reach the position,
+                so images and focus data are not taken at the wrong plane.
+        """
+
+        if self.obj.move(obj_pos):
+            return
+        self.message('Objective not at ' + str(obj_pos) + ', reinitializing')
+        self.obj.initialize()
+        if not self.obj.move(obj_pos):
+            raise RuntimeError('Objective could not reach ' + str(obj_pos))
+
+
     def zstack(self, obj_start, obj_stop, obj_step, n_frames, y_pos):
         """Take a zstack/tile of images.
 
@@ -530,17 +870,28 @@ class HiSeq():
                     self.y.move(y_pos)
 
 
-    def scan(self, x_pos, y_pos, obj_start, obj_stop, obj_step, n_scans, n_frames, image_name=None):
+    def scan(self, x_pos, y_pos, obj_start, obj_stop, obj_step, n_scans, n_frames, image_name=None,
+             section=None, cycle=None):
         """Image a volume.
 
            Images a zstack at incremental x positions.
            The length of the image (y dimension) remains constant.
+           If self.store is set and a section is given, the strips are
+           written side by side into the store, at the objective position
+           as the z plane.
 
            Parameters:
            WILL FILL IN AFTER SIMPLIFYING.
+           section (str, optional): Section label in self.store and
+                self.catalog.
+           cycle (int, optional): Cycle label in self.store and self.catalog.
 
            Returns:
            int: Time it took to do scan.
+
+           Raises:
+           RuntimeError: If the objective can not reach a z plane, see
+                move_obj().
         """
         if image_name is None:
             image_name = time.strftime('%Y%m%d_%H%M%S')
@@ -550,12 +901,19 @@ class HiSeq():
         for n in range(n_scans):
             self.x.move(x_pos)
             for obj_pos in range(obj_start, obj_stop+1, obj_step):
-                self.obj.move(obj_pos)
+                self.move_obj(obj_pos)
                 f_img_name = image_name + '_x' + str(x_pos) + '_o' + str(obj_pos)
+                store_index = None
+                if self.store is not None and section is not None:
+                    store_index = {'section': section, 'cycle': cycle,
+                                   'z': obj_pos,
+                                   'x': n*int(self.cam1.frame_x/2)}
                 image_complete = False
 
                 while not image_complete:
-                    image_complete = self.take_picture(n_frames, 128, f_img_name)
+                    image_complete = self.take_picture(n_frames, 128, f_img_name,
+                                                       store_index, section,
+                                                       cycle)
                     self.y.move(y_pos)
                     if not image_complete:
                         print('Image not taken')
@@ -603,6 +961,7 @@ class HiSeq():
                       self.cam2.left_emission,
                       self.cam2.right_emission]
 
+        self.writer.flush()                                                     # Wait for tiffs to be written
         C = 0
         for image in image_prefix:
             im_path = join(self.image_path, str(image)+'_'+filename+'.tiff')
@@ -641,7 +1000,7 @@ class HiSeq():
         # move stage to initial distance
         y_pos = self.y.position
         obj_pos = 17500
-        self.obj.move(obj_pos)
+        self.move_obj(obj_pos)
         z_pos = z_start
         self.z.move([z_pos, z_pos, z_pos])
 
@@ -681,11 +1040,13 @@ class HiSeq():
 
            Returns matrix of [obj position, focus value]
            Will be updated in future.
+           Raises RuntimeError if the objective can not reach a position,
+           see move_obj().
         """
         #Initialize
         y_pos = self.y.position
         obj_pos = obj_start
-        self.obj.move(obj_pos)
+        self.move_obj(obj_pos)
 
         # Sweep across objective positions
         Z = []                                                              # list of distance
@@ -701,9 +1062,10 @@ class HiSeq():
             C.append(self.jpeg(image_name))                                      # calculate compression
             Z.append(self.obj.position)
 
-            # Move stage for next step
+            # Move stage for next step, contrasts are paired with the
+            # position read back from the objective
             obj_pos = int(obj_pos + obj_interval)
-            self.obj.move(obj_pos)
+            self.move_obj(obj_pos)
 
         # find best obj stage position
         obj_pos = find_focus(Z, C)
@@ -728,7 +1090,7 @@ class HiSeq():
         # Home in on objective position for optimal contrast
         while abs(obj_pos-self.obj.position) >= self.obj.spum/2:
             self.message('Moving objective by ' + str((obj_pos-self.obj.position)/self.obj.spum) +  ' microns')
-            self.obj.move(obj_pos)                                                # move objective
+            self.move_obj(obj_pos)                                              # move objective
             i = i + 1
             image_name = 'AF_fine_'+str(i)
             image_complete = False
@@ -869,9 +1231,7 @@ class HiSeq():
         # Loop through filters until optimized
         for li in lasers:
             fi = 0
-            self.optics.move_ex(1, 'home')                                      # Home and block lasers
-            self.optics.move_ex(2, 'home')
-            self.optics.move_em_in(True)
+            self.gather_moves(ex1 = 'home', ex2 = 'home', em_in = True)         # Home and block lasers
             new_f_score = 0
             while opt_filter[li-1] is None:
                 self.optics.move_ex(li,f_order[li-1][fi])                       # Move excitation filter
@@ -884,6 +1244,7 @@ class HiSeq():
 
                 contrast = np.array([])
                 saturation = np.array([])
+                self.writer.flush()                                             # Wait for tiffs to be written
                 #read picture
                 for image in image_prefix:
                     im_name = self.image_path+str(image)+'_'+image_name+'.tiff'
@@ -1045,4 +1406,3 @@ def contrast2(filename, channel, path, nbins=256):
 def _1gaussian(x, amp1,cen1,sigma1):
     """Gaussian function for curve fitting."""
     return amp1*(1/(sigma1*(np.sqrt(2*np.pi))))*(np.exp((-1.0/2.0)*(((x-cen1)/sigma1)**2)))
->>>>>>> pip:pyseq/__init__.py
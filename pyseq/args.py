@@ -2,7 +2,7 @@
 """Arguments for Pyseq
 
 usage: pyseq [-h] [-config PATH] [-name NAME] [-output PATH] [-list]
-             [-method METHOD]
+             [-method METHOD] [-sim [SPEEDUP]]
 
 optional arguments:
   -h, --help      show this help message and exit
@@ -11,6 +11,8 @@ optional arguments:
   -output PATH    directory to save data, default = current directory
   -list           list installed methods
   -method METHOD  print method details
+  -sim [SPEEDUP]  run on simulated instruments, SPEEDUP x faster than real
+                  time, default = 1
 
 Kunal Pandit 3/15/2020
 """
@@ -52,6 +54,14 @@ parser.add_argument('-method',
                     choices = methods.get_methods(),
                     metavar = 'METHOD'
                     )
+# Optional simulated HiSeq
+parser.add_argument('-sim',
+                    help='run on simulated instruments, SPEEDUP x faster than real time',
+                    metavar = 'SPEEDUP',
+                    nargs = '?',
+                    const = 1.0,
+                    type = float,
+                    )
 
 def get_arguments():
     """Return arguments from command line"""
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Experiment Catalog
+
+Records every image of an experiment as a row in a SQLite database, usually
+in the log directory, instead of a metadata text file per image.
+
+Each row has the section, cycle, and channel of the image, the stage
+positions, optical settings, and laser powers it was taken with, the
+number of frames, timings, and where the image was saved. The rows are
+indexed on section, cycle, and channel, so what was already imaged can be
+found without opening the images.
+
+Examples:
+    #Create a catalog in the log directory
+    >>>import pyseq
+    >>>catalog = pyseq.catalog.Catalog('experiment/logs/catalog.db')
+    #Find the images of section A_1 in cycle 2
+    >>>catalog.find(section = 'A_1', cycle = 2)
+    [{'id': 5, 'time': '20201016_101500', 'name': 'A_1_c2_x12000_o30000', ...}]
+    #Count the complete images of each cycle
+    >>>catalog.query('SELECT cycle, COUNT(*) FROM images WHERE complete GROUP BY cycle')
+    [(1, 64), (2, 64)]
+"""
+
+
+import sqlite3
+import threading
+
+
+class Catalog():
+    """SQLite catalog of the images of an experiment.
+
+       Attributes:
+       path (path): File of the database.
+       columns (list): Names and SQL types of the columns of the images
+            table, besides the id.
+       connection (Connection): Connection to the database.
+    """
+
+    columns = [('time', 'TEXT'),
+               ('name', 'TEXT'),
+               ('section', 'TEXT'),
+               ('cycle', 'INTEGER'),
+               ('channel', 'TEXT'),
+               ('x', 'INTEGER'),
+               ('y', 'INTEGER'),
+               ('z', 'TEXT'),
+               ('obj', 'INTEGER'),
+               ('tdi_y', 'INTEGER'),
+               ('ex_filter1', 'TEXT'),
+               ('ex_filter2', 'TEXT'),
+               ('em_in', 'INTEGER'),
+               ('laser1', 'INTEGER'),
+               ('laser2', 'INTEGER'),
+               ('n_frames', 'INTEGER'),
+               ('bundle', 'INTEGER'),
+               ('frames_taken', 'INTEGER'),
+               ('rescans', 'INTEGER'),
+               ('scan_time', 'REAL'),
+               ('drain_time', 'REAL'),
+               ('save_time', 'REAL'),
+               ('path', 'TEXT'),
+               ('complete', 'INTEGER')]
+
+
+    def __init__(self, path):
+        """Constructor for the catalog.
+
+           The database and its table are created if they do not exist, so an
+           experiment can be continued.
+
+           Parameters:
+           path (path): File of the database.
+
+           Returns:
+           catalog object: An experiment catalog.
+        """
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        columns = ', '.join(name + ' ' + kind for name, kind in self.columns)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS images '
+                                    '(id INTEGER PRIMARY KEY, ' + columns + ')')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS images_index '
+                                    'ON images (section, cycle, channel)')
+
+
+    def add(self, rows):
+        """Add images to the catalog.
+
+           Parameters:
+           rows (list): A dictionary for each image with column name keys,
+                missing columns are NULL.
+
+           Returns:
+           int: Number of rows added.
+        """
+
+        names = [name for name, kind in self.columns]
+        sql = ('INSERT INTO images (' + ', '.join(names) + ') VALUES (' +
+               ', '.join('?' * len(names)) + ')')
+        values = [[row.get(name) for name in names] for row in rows]
+        with self.lock, self.connection:
+            self.connection.executemany(sql, values)
+
+        return len(values)
+
+
+    def find(self, **where):
+        """Return the images that match the keyword arguments.
+
+           Parameters:
+           where: Column names and values the images must have, for example
+                section = 'A_1', cycle = 2.
+
+           Returns:
+           list: A dictionary of the columns of each image, in the order they
+                were added.
+        """
+
+        names = ['id'] + [name for name, kind in self.columns]
+        sql = 'SELECT ' + ', '.join(names) + ' FROM images'
+        for name in where:
+            if name not in names:
+                raise ValueError('Unknown column ' + str(name))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(name + ' = ?' for name in where)
+        sql += ' ORDER BY id'
+        rows = self.query(sql, list(where.values()))
+
+        return [dict(zip(names, row)) for row in rows]
+
+
+    def query(self, sql, parameters = ()):
+        """Return the rows of an SQL query of the images table (list)."""
+
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+
+    def close(self):
+        """Close the connection to the database."""
+
+        with self.lock:
+            self.connection.close()
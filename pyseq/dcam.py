@@ -29,7 +29,10 @@ import ctypes
 import ctypes.util
 import numpy as np
 import imageio
+import threading
+import time
 import warnings
+from collections import deque
 
 # Hamamatsu constants.
 DCAMCAP_EVENT_FRAMEREADY = int("0x0002", 0)
@@ -113,6 +116,35 @@ def convertPropertyName(p_name):
     return p_name.lower().decode("utf-8").replace(" ", "_")
 
 
+## imageRows
+#
+# Rows of an image. An image is a numpy array, or a list of channel arrays
+# that split the frames by columns, see copyFrames().
+#
+# @param image The image.
+# @param start The first row.
+# @param stop The row after the last row, None for the last row.
+#
+# @return A view of the rows of the image, a list of views for channels.
+#
+def imageRows(image, start, stop):
+    if isinstance(image, (list, tuple)):
+        return [channel[start:stop] for channel in image]
+    return image[start:stop]
+
+
+## imageHeight
+#
+# @param image A numpy array, or a list of channel arrays.
+#
+# @return The number of rows in the image.
+#
+def imageHeight(image):
+    if isinstance(image, (list, tuple)):
+        return image[0].shape[0]
+    return image.shape[0]
+
+
 ## DCAMException
 #
 # Camera exceptions.
@@ -132,9 +164,26 @@ try:
         raise DCAMException("DCAM initialization failed.")
     n_cameras = temp.value
 except:
+    n_cameras = 0
     warnings.warn('DCAM is not installed')
 
 
+## setLibrary
+#
+# Replace the DCAM library, e.g. with the simulated library
+# pyseq.sim.dcam.DCAMAPI().
+#
+# @param library An object with the same functions as dcamapi.
+#
+def setLibrary(library):
+    global dcam, n_cameras
+    temp = ctypes.c_int32(0)
+    if (library.dcam_init(None, ctypes.byref(temp), None) != DCAMERR_NOERROR):
+        raise DCAMException("DCAM initialization failed.")
+    dcam = library
+    n_cameras = temp.value
+
+
 
 
 ## HCamData
@@ -155,7 +204,7 @@ class HCamData():
     # @param size The size of the data object in bytes.
     #
     def __init__(self, size):
-        self.np_array = np.ascontiguousarray(np.empty(np.int(size/2), dtype=np.uint16))
+        self.np_array = np.ascontiguousarray(np.empty(int(size/2), dtype=np.uint16))
         self.size = size
 
     ## __getitem__
@@ -190,6 +239,228 @@ class HCamData():
         return self.np_array.ctypes.data
 
 
+## FrameStream
+#
+# Copies frames from a camera into an image while the camera is acquiring.
+#
+# A reader thread waits for new frames with dcam_wait and copies them to
+# their rows in the image as they arrive, so the frames are already on the
+# host when the acquisition stops. Each block of new rows can also be
+# forwarded to a sink function.
+#
+# KP 10/20
+#
+class FrameStream():
+
+    ## __init__
+    #
+    # @param camera The camera to read frames from.
+    # @param image A C contiguous uint16 numpy array to copy the frames to,
+    #    frame_x px wide with frame_y rows for every frame, or a list of
+    #    channel arrays, see copyFrames().
+    # @param sink (Optional) Function called from the reader thread with each
+    #    block of new rows as a view of the image.
+    # @param wait_ms (Optional) Milliseconds dcam_wait blocks for a new frame
+    #    before the reader checks if it should stop.
+    #
+    def __init__(self, camera, image, sink = None, wait_ms = 100):
+        self.camera = camera
+        self.image = image
+        self.sink = sink
+        self.wait_ms = wait_ms
+        self.n_frames = imageHeight(image) // camera.frame_y                    # frames expected
+        self.frames = 0                                                         # frames copied
+        self.error = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target = self.run,
+                                       name = 'Cam' + str(camera.camera_id) + 'Stream',
+                                       daemon = True)
+
+    ## start
+    #
+    # Start the reader thread.
+    #
+    def start(self):
+        self.thread.start()
+        return self
+
+    ## run
+    #
+    # Reader thread, copies new frames until all the frames are copied or the
+    # stream is stopped.
+    #
+    def run(self):
+        dwait = ctypes.c_int(DCAMCAP_EVENT_FRAMEREADY)
+        try:
+            while not self.done.is_set() and not self.stopping.is_set():
+                dcam.dcam_wait(self.camera.camera_handle,
+                               ctypes.byref(dwait),
+                               ctypes.c_int(self.wait_ms),
+                               None)                                            # Errors are timeouts or aborts
+                self.read()
+        except Exception as error:
+            self.error = error
+            self.done.set()
+
+    ## read
+    #
+    # Copy the new frames to the image and forward them to the sink.
+    #
+    # @return The number of frames copied.
+    #
+    def read(self):
+        with self.lock:
+            frames = self.camera.newFrames()
+            if not frames:
+                return 0
+            row = self.frames*self.camera.frame_y
+            n = self.camera.copyFrames(frames, self.image, row)
+            self.frames += n
+            if self.frames >= self.n_frames:
+                self.done.set()
+        if n and self.sink is not None:
+            self.sink(imageRows(self.image, row, row + n*self.camera.frame_y))
+        return n
+
+    ## wait
+    #
+    # Wait until all of the frames are copied.
+    #
+    # @param timeout (Optional) Seconds to wait, None waits forever.
+    #
+    # @return True if all of the frames were copied.
+    #
+    def wait(self, timeout = None):
+        return self.done.wait(timeout) and self.frames >= self.n_frames
+
+    ## stop
+    #
+    # Stop the reader thread and wait for it to exit. Call before the
+    # acquisition is stopped, so the thread is not using the camera handle
+    # while the camera is idled and its buffers are released.
+    #
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    ## finish
+    #
+    # Copy any frames the reader thread did not get to. Call after the
+    # stream is stopped and the acquisition is stopped.
+    #
+    # @return A view of the image with the rows of the copied frames.
+    #
+    def finish(self):
+        self.stop()
+        if self.frames < self.n_frames:
+            self.read()
+        return imageRows(self.image, 0, self.frames*self.camera.frame_y)
+
+
+## CameraConfig
+#
+# The desired settings of a camera.
+#
+# Applying the configuration to a camera compares each setting to the value
+# the camera last read back and only sets the properties that changed. The
+# settings are applied in the order of the order attribute, so the camera
+# mode is set before the properties that depend on it.
+#
+# KP 10/20
+#
+class CameraConfig():
+
+    # Order to apply settings in, the camera mode first since it can change
+    # the other properties. Other settings are applied last.
+    order = ["sensor_mode",
+             "binning",
+             "readout_speed",
+             "trigger_mode",
+             "trigger_source",
+             "subarray_mode",
+             "trigger_polarity",
+             "trigger_connector",
+             "subarray_hpos",
+             "subarray_hsize",
+             "subarray_vpos",
+             "subarray_vsize",
+             "sensor_mode_line_bundle_height",
+             "exposure_time",
+             "contrast_gain"]
+
+    ## __init__
+    #
+    # @param settings Property name and value keyword arguments, for example
+    #    exposure_time = 40.0, sensor_mode = 4.
+    #
+    def __init__(self, **settings):
+        self.settings = dict(settings)
+
+    ## set
+    #
+    # Change settings of the configuration.
+    #
+    # @param settings Property name and value keyword arguments.
+    #
+    def set(self, **settings):
+        self.settings.update(settings)
+        return self
+
+    ## copy
+    #
+    # @param settings Property name and value keyword arguments to change in
+    #    the copy.
+    #
+    # @return A new CameraConfig with the same settings and the changes.
+    #
+    def copy(self, **settings):
+        return CameraConfig(**self.settings).set(**settings)
+
+    ## apply
+    #
+    # Set the properties of a camera that are different from the
+    # configuration.
+    #
+    # @param camera A HamamatsuCamera.
+    #
+    # @return {property name : value, ..} of the properties that were set.
+    #
+    def apply(self, camera):
+        changed = {}
+        for name in self.names():
+            value = self.settings[name]
+            if not camera.isPropertySet(name, value):                           # checked as it is set, the mode can change
+                changed[name] = camera.setPropertyValue(name, value)
+        return changed
+
+    ## changes
+    #
+    # @param camera A HamamatsuCamera.
+    #
+    # @return [property name, ..] of the settings that are different on the
+    #    camera.
+    #
+    def changes(self, camera):
+        return [n for n in self.names()
+                if not camera.isPropertySet(n, self.settings[n])]
+
+    ## names
+    #
+    # @return [property name, ..] of the settings in the order to apply them.
+    #
+    def names(self):
+        def rank(name):
+            if name in self.order:
+                return self.order.index(name)
+            return len(self.order)
+
+        return sorted(self.settings, key = rank)
+
+
 ## HamamatsuCamera
 #
 # Basic camera interface class.
@@ -200,6 +471,14 @@ class HCamData():
 #
 class HamamatsuCamera():
 
+    # Properties that change the camera mode, setting them clears the
+    # attribute cache.
+    mode_properties = {"binning",
+                       "readout_speed",
+                       "sensor_mode",
+                       "subarray_mode",
+                       "trigger_mode",
+                       "trigger_source"}
 
     ## __init__
     #
@@ -212,7 +491,7 @@ class HamamatsuCamera():
         self.buffer_index = 0
         self.camera_id = camera_id
         self.camera_model = self.getModelInfo(camera_id)
-        self.debug = False
+        self.debug = False                                                      # log every call to the camera
         self.frame_bytes = 0
         self.frame_x = 0
         self.frame_y = 0
@@ -233,6 +512,25 @@ class HamamatsuCamera():
                          "dcam_open")
         # Get camera properties.
         self.properties = self.getCameraProperties()
+        # Cache property attributes & text values.
+        self.cache_attributes = True
+        self.attributes = {}
+        self.text_values = {}
+        self.cacheAttributes()
+        # Readback of the properties that were set, see CameraConfig.
+        self.values = {}
+        self.requested = {}
+        self.geometry_changed = True
+        # Camera buffers kept between acquisitions, see allocFrame.
+        self.buffer_key = None
+        self.buffer_allocations = 0
+        self.buffer_reuses = 0
+        # Telemetry counters, see resetStats.
+        self.stats = None
+        self.total_stats = None
+        self.stats_history = deque(maxlen = 1000)
+        self.resetStats()
+        self.total_stats = dict(self.stats)
         # Get camera max width, height.
         self.max_width = self.getPropertyValue("image_width")[0]
         self.max_height = self.getPropertyValue("image_height")[0]
@@ -248,6 +546,61 @@ class HamamatsuCamera():
         else:
             print(text)
 
+    ## resetStats
+    #
+    # Start the telemetry counters of a new acquisition. The counters of the
+    # last acquisition are added to total_stats and stats_history.
+    #
+    # Counters are:
+    #    frames - frames transferred to the host.
+    #    transfer_checks - times the camera was asked for new frames.
+    #    overruns - times more frames arrived than there are buffers.
+    #    max_backlog - most frames that arrived between checks.
+    #    bytes_saved - image bytes saved or queued to save.
+    #    lock_time, copy_time, unlock_time - seconds spent locking, copying
+    #       and unlocking frames.
+    #    status_polls - times the camera status was read.
+    #    drain_time - seconds copying the last frames after the acquisition.
+    #    save_time - seconds writing images, or queueing them to a writer.
+    #
+    def resetStats(self):
+        if self.stats is not None:
+            self.stats_history.append(self.stats)
+            if self.total_stats is not None:
+                for key, value in self.stats.items():
+                    if key == 'max_backlog':
+                        self.total_stats[key] = max(self.total_stats[key], value)
+                    else:
+                        self.total_stats[key] += value
+        self.stats = {'frames': 0,
+                      'transfer_checks': 0,
+                      'overruns': 0,
+                      'max_backlog': 0,
+                      'bytes_saved': 0,
+                      'lock_time': 0.0,
+                      'copy_time': 0.0,
+                      'unlock_time': 0.0,
+                      'status_polls': 0,
+                      'drain_time': 0.0,
+                      'save_time': 0.0}
+
+    ## getStats
+    #
+    # @param total (Optional) True for the totals of all the acquisitions,
+    #    False for the current or last acquisition.
+    #
+    # @return A copy of the telemetry counters, see resetStats().
+    #
+    def getStats(self, total = False):
+        stats = dict(self.stats)
+        if total:
+            for key, value in self.total_stats.items():
+                if key == 'max_backlog':
+                    stats[key] = max(stats[key], value)
+                else:
+                    stats[key] += value
+        return stats
+
     ## captureSetup
     #
     # Capture setup (internal use only). This is called at the start
@@ -261,10 +614,12 @@ class HamamatsuCamera():
         # Set sub array mode.
         self.setSubArrayMode()
 
-        # Get frame properties.
-        self.frame_x = self.getPropertyValue("image_width")[0]
-        self.frame_y = self.getPropertyValue("image_height")[0]
-        self.frame_bytes = self.getPropertyValue("image_framebytes")[0]
+        # Get frame properties, if a property was set since the last time.
+        if self.geometry_changed:
+            self.frame_x = self.getPropertyValue("image_width")[0]
+            self.frame_y = self.getPropertyValue("image_height")[0]
+            self.frame_bytes = self.getPropertyValue("image_framebytes")[0]
+            self.geometry_changed = False
 
         # Set capture mode.
         self.checkStatus(dcam.dcam_precapture(self.camera_handle,
@@ -351,21 +706,75 @@ class HamamatsuCamera():
     # KP 10/19
     #
     def getFrames(self):
-        frames = []
-        for n in self.newFrames():
+        image = self.readImage()
+        image = np.reshape(image, [-1, self.frame_x*self.frame_y])              # view, 1 row per frame
+        return [image, [self.frame_x, self.frame_y]]
+
+    ## copyFrames
+    #
+    # Copy frames from the camera buffers into consecutive rows of an image.
+    #
+    # Each frame is locked and copied straight to its final row offset in
+    # the image, there is no intermediate storage for each frame.
+    #
+    # The image can also be a list of channel arrays, for example memory
+    # mapped files. Then the columns of each frame are split between the
+    # channels in order, the first channel gets the first columns.
+    #
+    # @param frames The ids of the frames to copy, usually from newFrames().
+    # @param image A C contiguous uint16 numpy array frame_x px wide, or a
+    #    list of uint16 channel arrays that are frame_x px wide together.
+    # @param row (Optional) The row of the image to copy the first frame to.
+    #
+    # @return The number of frames copied.
+    #
+    def copyFrames(self, frames, image, row = 0):
+        frame_y = self.frame_y
+        image_bytes = self.frame_x*2                                            # bytes in an image row
+        n_frames = min(len(frames), (imageHeight(image) - row) // frame_y)
+        channels = None
+        if isinstance(image, (list, tuple)):
+            channels = image
+        else:
+            base_address = image.ctypes.data
+        data_address = ctypes.c_void_p(0)
+        row_bytes = ctypes.c_int32(0)
+        stats = self.stats
+        for n in frames[:n_frames]:
 
             # Lock the frame in the camera buffer & get address.
-            data_address = ctypes.c_void_p(0)
-            row_bytes = ctypes.c_int32(0)
+            t0 = time.perf_counter()
             self.checkStatus(dcam.dcam_lockdata(self.camera_handle,
                                                 ctypes.byref(data_address),
                                                 ctypes.byref(row_bytes),
                                                 ctypes.c_int32(n)),
                              "dcam_lockdata")
-
-            # Create storage for the frame & copy into this storage.
-            hc_data = HCamData(self.frame_bytes)
-            hc_data.copyData(data_address)
+            t1 = time.perf_counter()
+
+            # Copy the frame to its rows in the image, row by row if the
+            # camera buffer rows are padded.
+            if channels is not None:
+                frame_x = (row_bytes.value or image_bytes)//2
+                frame = np.ctypeslib.as_array(
+                    ctypes.cast(data_address.value,
+                                ctypes.POINTER(ctypes.c_uint16)),
+                    shape = (frame_y, frame_x))
+                x = 0
+                for channel in channels:
+                    width = channel.shape[1]
+                    channel[row:row + frame_y] = frame[:, x:x + width]
+                    x += width
+            elif row_bytes.value in (0, image_bytes):
+                ctypes.memmove(base_address + row*image_bytes,
+                               data_address.value, image_bytes*frame_y)
+            else:
+                address = base_address + row*image_bytes
+                for r in range(frame_y):
+                    ctypes.memmove(address + r*image_bytes,
+                                   data_address.value + r*row_bytes.value,
+                                   image_bytes)
+            row += frame_y
+            t2 = time.perf_counter()
 
             # Unlock the frame.
             #
@@ -373,73 +782,201 @@ class HamamatsuCamera():
             # on the next call to lockdata, but we do this anyway.
             self.checkStatus(dcam.dcam_unlockdata(self.camera_handle),
                              "dcam_unlockdata")
-            #
-            #KP 10/19Status
-            frames.append(hc_data.getData())
-            #frames.append(hc_data)
+            t3 = time.perf_counter()
+            stats['lock_time'] += t1 - t0
+            stats['copy_time'] += t2 - t1
+            stats['unlock_time'] += t3 - t2
 
-        image = np.vstack(frames)
-        return [image, [self.frame_x, self.frame_y]]
+        stats['frames'] += n_frames
+        return n_frames
+
+    ## readImage
+    #
+    # Read all of the new frames into one image.
+    #
+    # @param image (Optional) Preallocated C contiguous uint16 numpy array
+    #    frame_x px wide with a row for every line of the new frames, or a
+    #    list of channel arrays, see copyFrames(). If None, the array is
+    #    allocated.
+    #
+    # @return A n_frames*frame_y x frame_x numpy array view of the image.
+    #
+    # KP 10/19
+    #
+    def readImage(self, image = None):
+        frames = self.newFrames()
+        if image is None:
+            image = np.empty((len(frames)*self.frame_y, self.frame_x),
+                             dtype = np.uint16)
+        n_frames = self.copyFrames(frames, image)
+        return imageRows(image, 0, n_frames*self.frame_y)
+
+    ## drainFrames
+    #
+    # Copy the frames that are left after the acquisition is stopped. The
+    # time it takes is added to the drain_time counter.
+    #
+    # @param stream (Optional) The stopped FrameStream of the acquisition.
+    #    If None, the frames are read with readImage().
+    # @param image (Optional) Preallocated image for readImage().
+    #
+    # @return A numpy array view of the image with the rows of the frames.
+    #
+    def drainFrames(self, stream = None, image = None):
+        t0 = time.perf_counter()
+        if stream is not None:
+            image = stream.finish()
+        else:
+            image = self.readImage(image)
+        self.stats['drain_time'] += time.perf_counter() - t0
+        return image
+
+    ## splitImage
+    #
+    # Split an image into the left and right emission channels.
+    #
+    # @param image A numpy array frame_x px wide.
+    #
+    # @return [left image, right image], both are views of image.
+    #
+    def splitImage(self, image):
+        half_x = int(self.frame_x/2)
+        return [image[:,0:half_x], image[:,half_x:self.frame_x]]
 
     ## saveImage
     #
     # Gets all of the available frames as numpy array and saves TIFF
     #
+    # The frames are copied once, from the camera buffers into a single
+    # image, and the left and right channels are written from views of it.
     #
+    # @param image_name The common name of the images.
+    # @param image_path The directory to save the images in.
+    # @param image (Optional) Preallocated image to copy the frames to, see
+    #    readImage().
+    # @param writer (Optional) ImageWriter to write the images in the
+    #    background, see writeImage().
     #
+    # @return [left future, right future] if there is a writer.
     #
     # KP 10/19
     #
-    def saveImage(self, image_name, image_path):
-        frames = []
-        for n in self.newFrames():
+    def saveImage(self, image_name, image_path, image = None, writer = None):
+        image = self.readImage(image)
+        return self.writeImage(image, image_name, image_path, writer)
 
-            # Lock the frame in the camera buffer & get address.
-            data_address = ctypes.c_void_p(0)
-            row_bytes = ctypes.c_int32(0)
-            self.checkStatus(dcam.dcam_lockdata(self.camera_handle,
-                                                ctypes.byref(data_address),
-                                                ctypes.byref(row_bytes),
-                                                ctypes.c_int32(n)),
-                             "dcam_lockdata")
+    ## imagePaths
+    #
+    # @param image_name The common name of the images.
+    # @param image_path The directory to save the images in.
+    #
+    # @return [left path, right path] of the TIFFs of the left and right
+    #    channels.
+    #
+    def imagePaths(self, image_name, image_path):
+        if self.left_emission is None:
+            self.left_emission = 'Left'
+        if self.right_emission is None:
+            self.right_emission = 'Right'
 
-            # Create storage for the frame & copy into this storage.
-            hc_data = HCamData(self.frame_bytes)
-            hc_data.copyData(data_address)
+        left_path = image_path+str(self.left_emission)+'_'+image_name+'.tiff'
+        right_path = image_path+str(self.right_emission)+'_'+image_name+'.tiff'
+        return [left_path, right_path]
 
-            # Unlock the frame.
-            #
-            # According to the documentation, this would be done automatically
-            # on the next call to lockdata, but we do this anyway.
-            self.checkStatus(dcam.dcam_unlockdata(self.camera_handle),
-                             "dcam_unlockdata")
-            #
-            #KP 10/19
-            frames.append(hc_data.getData())
-            #frames.append(hc_data)
-
-        image = np.vstack(frames)
-        # f = number of frames, BxX = bundle line height * frame_x
-        [f, BxX] = image.shape
-        # Correct shape of numpy array
-        image = np.reshape(image, [int(f*self.frame_y), self.frame_x])
+    ## writeImage
+    #
+    # Saves the left and right channels of an image as TIFFs.
+    #
+    # @param image A n_frames*frame_y x frame_x numpy array, see readImage().
+    # @param image_name The common name of the images.
+    # @param image_path The directory to save the images in.
+    # @param writer (Optional) pyseq.writer.ImageWriter to write the images
+    #    in the background. The image must not be changed until they are
+    #    written. If None, the images are written before returning.
+    #
+    # @return [left future, right future] if there is a writer.
+    #
+    def writeImage(self, image, image_name, image_path, writer = None):
+        f = int(image.shape[0]/self.frame_y)
 
-        half_x = int(self.frame_x/2)
-        # Get left image
-        left_image = image[:,0:half_x]
-        # Get right image
-        right_image = image[:,half_x:self.frame_x]
+        # Get left and right image
+        left_image, right_image = self.splitImage(image)
 
         # Save Left and Right images
+        stats = self.stats
+        stats['bytes_saved'] += left_image.nbytes + right_image.nbytes
+        left_path, right_path = self.imagePaths(image_name, image_path)
+        t0 = time.perf_counter()
+        if writer is None:
+            imageio.imwrite(left_path, left_image)
+            imageio.imwrite(right_path, right_image)
+            stats['save_time'] += time.perf_counter() - t0
+            if self.debug:
+                self.message(str(self.frame_bytes*f) + ' bytes saved from camera ' + str(self.camera_id))
+        else:
+            futures = [writer.submit(left_path, left_image),
+                       writer.submit(right_path, right_image)]
+            stats['save_time'] += time.perf_counter() - t0
+            if self.debug:
+                self.message(str(self.frame_bytes*f) + ' bytes queued from camera ' + str(self.camera_id))
+            return futures
+
+    ## storeImage
+    #
+    # Writes the left and right channels of an image into an experiment
+    # store, see pyseq.store.ExperimentStore. The channels are labelled with
+    # the left and right emission wavelengths.
+    #
+    # @param image A n_frames*frame_y x frame_x numpy array, see readImage().
+    # @param store The ExperimentStore to write to.
+    # @param writer (Optional) pyseq.writer.ImageWriter to write the channels
+    #    in the background. If None, they are written before returning.
+    # @param index Keyword arguments with the section, cycle, z, and
+    #    optionally the y and x position of the image in the store.
+    #
+    # @return [left future, right future] if there is a writer.
+    #
+    def storeImage(self, image, store, writer = None, **index):
         if self.left_emission is None:
             self.left_emission = 'Left'
         if self.right_emission is None:
             self.right_emission = 'Right'
 
-        imageio.imwrite(image_path+str(self.left_emission)+'_'+image_name+'.tiff', left_image)
-        imageio.imwrite(image_path+str(self.right_emission)+'_'+image_name+'.tiff', right_image)
+        stats = self.stats
+        stats['bytes_saved'] += image.nbytes
+        t0 = time.perf_counter()
+        futures = []
+        for emission, channel in zip([self.left_emission, self.right_emission],
+                                     self.splitImage(image)):
+            if writer is None:
+                store.write(channel, channel = emission, **index)
+            else:
+                futures.append(writer.submit(str(emission),
+                                             channel,
+                                             store.writer(channel = emission, **index)))
+        stats['save_time'] += time.perf_counter() - t0
+        if writer is not None:
+            return futures
 
-        self.message(str(self.frame_bytes*f) + ' bytes saved from camera ' + str(self.camera_id))
+    ## startStream
+    #
+    # Start copying frames to the host while the camera is acquiring, see
+    # FrameStream. Call after startAcquisition().
+    #
+    # @param n_frames The number of frames in the acquisition.
+    # @param image (Optional) Preallocated image to copy the frames to, see
+    #    readImage().
+    # @param sink (Optional) Function called with each block of new rows.
+    #
+    # @return The started FrameStream.
+    #
+    # KP 10/20
+    #
+    def startStream(self, n_frames, image = None, sink = None):
+        if image is None:
+            image = np.empty((int(n_frames)*self.frame_y, self.frame_x),
+                             dtype = np.uint16)
+        return FrameStream(self, image, sink).start()
 
 
 
@@ -475,13 +1012,17 @@ class HamamatsuCamera():
     #
     # Return the attribute structure of a particular property.
     #
-    # FIXME (OPTIMIZATION): Keep track of known attributes?
+    # Attributes are cached, they are only read from the camera the first
+    # time or after the camera mode changes, see clearAttributes(). The
+    # returned structure is shared, don't change it.
     #
     # @param property_name The name of the property to get the attributes of.
     #
     # @return A DCAM_PARAM_PROPERTYATTR object.
     #
     def getPropertyAttribute(self, property_name):
+        if self.cache_attributes and property_name in self.attributes:
+            return self.attributes[property_name]
         p_attr = DCAM_PARAM_PROPERTYATTR()
         p_attr.cbSize = ctypes.sizeof(p_attr)
         p_attr.iProp = self.properties[property_name]
@@ -489,23 +1030,53 @@ class HamamatsuCamera():
                                                          ctypes.byref(p_attr)),
                                "dcam_getpropertyattr")
         if (ret == 0):
-            print(" property", property_id, "is not supported")
+            print(" property", property_name, "is not supported")
             return False
         else:
+            if self.cache_attributes:
+                self.attributes[property_name] = p_attr
             return p_attr
 
+    ## cacheAttributes
+    #
+    # Read the attributes and text values of all the properties into the
+    # cache.
+    #
+    def cacheAttributes(self):
+        for property_name in self.properties:
+            try:
+                self.getPropertyAttribute(property_name)
+                self.getPropertyText(property_name)
+            except DCAMException:
+                pass                                                            # read again when accessed
+
+    ## clearAttributes
+    #
+    # Empty the attribute and text value cache. It is refilled as properties
+    # are accessed. Called when a property in mode_properties is set, since
+    # the camera mode can change the range of other properties.
+    #
+    def clearAttributes(self):
+        self.attributes = {}
+        self.text_values = {}
+
     ## getPropertyText
     #
     # Return the text options of a property (if any).
     #
+    # Text options are cached with the attributes. The returned dictionary
+    # is shared, don't change it.
+    #
     # @param property_name The name of the property to get the text values of.
     #
     # @return A dictionary of text properties (which may be empty).
     #
     def getPropertyText(self, property_name):
+        if self.cache_attributes and property_name in self.text_values:
+            return self.text_values[property_name]
         prop_attr = self.getPropertyAttribute(property_name)
         if not (prop_attr.attribute & DCAMPROP_ATTR_HASVALUETEXT):
-            return {}
+            text_options = {}
         else:
             # Create property text structure.
             prop_id = self.properties[property_name]
@@ -540,7 +1111,9 @@ class HamamatsuCamera():
                 if (ret == 0):
                     done = True
 
-            return text_options
+        if self.cache_attributes:
+            self.text_values[property_name] = text_options
+        return text_options
 
     ## getPropertyRange
     #
@@ -668,12 +1241,18 @@ class HamamatsuCamera():
         # Check that we have not acquired more frames than we can store in our buffer.
         # Keep track of the maximum backlog.
         cur_frame_number = f_count.value
-        self.message('current frame number = ' + str(cur_frame_number))
+        if self.debug:
+            self.message('current frame number = ' + str(cur_frame_number))
         backlog = cur_frame_number - self.last_frame_number
+        stats = self.stats
+        stats['transfer_checks'] += 1
         if (backlog > self.number_image_buffers):
-            print("warning: hamamatsu camera frame buffer overrun detected!")
+            stats['overruns'] += 1
+            self.message("warning: hamamatsu camera frame buffer overrun detected!")
         if (backlog > self.max_backlog):
             self.max_backlog = backlog
+        if (backlog > stats['max_backlog']):
+            stats['max_backlog'] = backlog
         self.last_frame_number = cur_frame_number
 
         cur_buffer_index = b_index.value
@@ -691,7 +1270,7 @@ class HamamatsuCamera():
         self.buffer_index = cur_buffer_index
 
         if self.debug:
-            print(new_frames)
+            self.message(new_frames)
 
         return new_frames
 
@@ -713,7 +1292,9 @@ class HamamatsuCamera():
         # corresponding numerical property value is.
         if (type(property_value) == type("")):
             text_values = self.getPropertyText(property_name)
-            if (property_value in text_values):
+            if (property_value.encode() in text_values):
+                property_value = float(text_values[property_value.encode()])
+            elif (property_value in text_values):
                 property_value = float(text_values[property_value])
             else:
                 print(" unknown property text value:", property_value, "for", property_name)
@@ -728,6 +1309,10 @@ class HamamatsuCamera():
 ##            print(" set property value", property_value, "is greater than maximum of", pv_max, property_name, "setting to maximum")
 ##            property_value = pv_max
 
+        # Get the current camera mode.
+        if property_name in self.mode_properties:
+            old_value = self.getPropertyValue(property_name)[0]
+
         # Set the property value, return what it was set too.
         prop_id = self.properties[property_name]
         p_value = ctypes.c_double(property_value)
@@ -737,9 +1322,63 @@ class HamamatsuCamera():
                                                        ctypes.c_int32(DCAM_DEFAULT_ARG)),
                          "dcam_setgetpropertyvalue")
 
-        self.message(property_name + " set to " + str(p_value.value))
+        # A new camera mode can change the range and value of other
+        # properties.
+        if (property_name in self.mode_properties and
+                old_value != p_value.value):
+            self.clearAttributes()
+            for name in list(self.values):
+                if name not in self.mode_properties:
+                    del self.values[name]
+                    del self.requested[name]
+        self.values[property_name] = p_value.value
+        self.requested[property_name] = property_value
+        self.geometry_changed = True
+
+        if self.debug:
+            self.message(property_name + " set to " + str(p_value.value))
         return p_value.value
 
+    ## clearValues
+    #
+    # Forget the readback of the properties that were set, so the next
+    # CameraConfig.apply() sets all of them.
+    #
+    def clearValues(self):
+        self.values = {}
+        self.requested = {}
+        self.geometry_changed = True
+
+    ## isPropertySet
+    #
+    # Check if a property was last set to a value.
+    #
+    # @param property_name The name of the property.
+    # @param property_value The value to check.
+    #
+    # @return True if the property was set to property_value, or set and
+    #    read back as property_value.
+    #
+    def isPropertySet(self, property_name, property_value):
+        if property_name not in self.values:
+            return False
+        return (self.requested[property_name] == property_value or
+                self.values[property_name] == property_value)
+
+    ## configure
+    #
+    # Set only the properties of a configuration that changed. If any did,
+    # the camera buffers are freed first.
+    #
+    # @param config A CameraConfig.
+    #
+    # @return {property name : value, ..} of the properties that were set.
+    #
+    def configure(self, config):
+        if self.buffer_key is not None and config.changes(self):
+            self.freeFrames()                                                   # properties can't change with buffers allocated
+        return config.apply(self)
+
     ## setTriggerMode
     #
     # Sets trigger to internal, TDI, or TDIinternal
@@ -772,14 +1411,17 @@ class HamamatsuCamera():
                                               ctypes.c_int32(prop_id),
                                               ctypes.byref(p_value))
 
-        self.message(error)
+        if self.debug:
+            self.message(error)
 
         prop_id = self.properties["subarray_vsize"]
 
         error = dcam.dcam_setgetpropertyvalue(self.camera_handle,
                                               ctypes.c_int32(prop_id),
                                               ctypes.byref(p_value))
-        self.message(error)
+        if self.debug:
+            self.message(error)
+        self.clearValues()
 
 
     ## setSubArrayMode
@@ -794,28 +1436,54 @@ class HamamatsuCamera():
 
         # If the ROI is smaller than the entire frame turn on subarray mode
         if ((roi_w == self.max_width) and (roi_h == self.max_height)):
-            self.setPropertyValue("subarray_mode", 1) #OFF KP 9/19
+            mode = 1 #OFF KP 9/19
         else:
-            self.setPropertyValue("subarray_mode", 2) #ON KP 9/19
+            mode = 2 #ON KP 9/19
+        if not self.isPropertySet("subarray_mode", mode):
+            self.setPropertyValue("subarray_mode", mode)
 
 
     ## Allocate Frame
     #
     # Allocated memory for n frames
     #
+    # The camera buffers are kept after the acquisition and reused by the
+    # next acquisition with the same geometry, (n_frames, bundle height,
+    # frame bytes) in buffer_key. They are only reallocated when more
+    # frames are needed or a property changed the frame geometry.
+    #
+    # @return True if the buffers were (re)allocated, False if reused.
+    #
     # KP 9/19
     #
     def allocFrame(self, n_frames):
+        n_frames = int(n_frames)
+        if (self.buffer_key is not None and not self.geometry_changed and
+                self.buffer_key[0] >= n_frames):
+            # Reuse the buffers, start again from the first buffer.
+            self.buffer_index = -1
+            self.last_frame_number = 0
+            self.buffer_reuses += 1
+            return False
+
+        if self.buffer_key is not None:
+            self.freeFrames()
         self.captureSetup()
-        self.message('each frame is ' + str(self.frame_bytes) + ' bytes')
+        if self.debug:
+            self.message('each frame is ' + str(self.frame_bytes) + ' bytes')
         #
         # Allocate Hamamatsu image buffers.
         # We allocate enough for n_frames
         #
-        self.number_image_buffers = int(n_frames)
+        self.number_image_buffers = n_frames
         error = dcam.dcam_allocframe(self.camera_handle,
                                      ctypes.c_int32(self.number_image_buffers))
-        self.message(error)
+        if self.debug:
+            self.message(error)
+        if error == DCAMERR_NOERROR:
+            self.buffer_key = (n_frames, self.frame_y, self.frame_bytes)
+            self.buffer_allocations += 1
+        return True
 
 
     ## startAcquisition
@@ -835,8 +1503,10 @@ class HamamatsuCamera():
 ##                         "dcam_allocframe")
 
         # Start acquisition.
+        self.resetStats()
         error = dcam.dcam_capture(self.camera_handle) #KP 9/19
-        self.message(error)
+        if self.debug:
+            self.message(error)
 
     ## stopAcquisition
     #
@@ -862,8 +1532,10 @@ class HamamatsuCamera():
     #
     def freeFrames(self):
         self.number_image_buffers = 0
+        self.buffer_key = None
         error = dcam.dcam_freeframe(self.camera_handle)#KP 9/19
-        self.message(error)
+        if self.debug:
+            self.message(error)
 
 
 
@@ -910,8 +1582,10 @@ class HamamatsuCamera():
 
         error = dcam.dcam_getstatus(self.camera_handle, ctypes.byref(pStatus))
         self.status = pStatus.value
+        self.stats['status_polls'] += 1
 
-        self.message("camera status is : " + status_dict[self.status])
+        if self.debug:
+            self.message("camera status is : " + status_dict[self.status])
 
         return self.status
 
@@ -958,7 +1632,9 @@ class HamamatsuCamera():
                                               ctypes.c_int32(prop_id),
                                               ctypes.byref(p_value),
                                               ctypes.c_int32(DCAM_DEFAULT_ARG))
-        self.message(error)
+        if self.debug:
+            self.message(error)
+        self.clearValues()
 
 
     ## Wait
@@ -1009,107 +1685,188 @@ class HamamatsuCamera():
 
 
 
+## BufferSet
+#
+# Host memory the camera writes an acquisition into.
+#
+# The frames are consecutive rows of one image, so when the acquisition is
+# done the image is already assembled. Ownership is reference counted, the
+# camera holds a reference while the buffers are attached and anything
+# reading the image in place, such as the image writer, holds another. A
+# buffer set is only reused for a new acquisition when no one holds it.
+#
+# KP 10/20
+#
+class BufferSet():
+
+    ## __init__
+    #
+    # @param n_frames The number of frames.
+    # @param frame_x The frame width in px.
+    # @param frame_y The frame height in px.
+    #
+    def __init__(self, n_frames, frame_x, frame_y):
+        self.key = (n_frames, frame_y, frame_x*frame_y*2)
+        self.image = np.empty((n_frames*frame_y, frame_x), dtype = np.uint16)
+        ptr_array = ctypes.c_void_p * n_frames
+        self.ptr = ptr_array()
+        frame_bytes = frame_x*frame_y*2
+        for i in range(n_frames):
+            self.ptr[i] = self.image.ctypes.data + i*frame_bytes
+        self.refs = 0
+        self.lock = threading.Condition()
+
+    ## acquire
+    #
+    # Take a reference to the buffers.
+    #
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+
+    ## release
+    #
+    # Give back a reference to the buffers.
+    #
+    def release(self, *args):
+        with self.lock:
+            self.refs -= 1
+            if self.refs <= 0:
+                self.refs = 0
+                self.lock.notify_all()
+
+    ## isFree
+    #
+    # @return True if no one holds a reference to the buffers.
+    #
+    def isFree(self):
+        return self.refs == 0
+
+    ## owns
+    #
+    # @param image A numpy array.
+    #
+    # @return True if the array is a view of these buffers.
+    #
+    def owns(self, image):
+        return np.may_share_memory(image, self.image)
+
+
 ## HamamatsuCameraMR
 #
 # Memory recycling camera class.
 #
-# This version allocates "user memory" for the Hamamatsu camera
-# buffers. This memory is also the location of the storage for
-# the np_array element of a HCamData() class. The memory is
-# allocated once at the beginning, then recycled. This means
-# that there is a lot less memory allocation & shuffling compared
-# to the basic class, which performs one allocation and (I believe)
-# two copies for each frame that is acquired.
-#
-# WARNING: There is the potential here for chaos. Since the memory
-#   is now shared there is the possibility that downstream code
-#   will try and access the same bit of memory at the same time
-#   as the camera and this could end badly.
+# This version attaches "user memory" as the Hamamatsu camera buffers, so
+# the camera writes frames straight into host memory and there is no copy
+# out of the DCAM buffers. The buffers for an acquisition are a BufferSet,
+# the frames are the consecutive rows of one image.
 #
-# FIXME: Use lockbits (and unlockbits) to avoid memory clashes?
-#   This would probably also involve some kind of reference counting
-#   scheme.
+# Buffer sets are reference counted. The image of the last acquisition can
+# be read in place, for example written to disk in the background, while
+# the next acquisition is written into a different buffer set. At most
+# max_buffer_sets are kept for each geometry, if they are all held the next
+# acquisition waits for one to be released.
 #
 class HamamatsuCameraMR(HamamatsuCamera):
 
     ## __init__
     #
     # @param camera_id The id of the camera.
+    # @param logger (Optional) The log file to write messages to.
     #
-    def __init__(self, camera_id):
-        HamamatsuCamera.__init__(self, camera_id)
+    def __init__(self, camera_id, logger = None):
+        HamamatsuCamera.__init__(self, camera_id, logger = logger)
 
-        self.hcam_data = []
-        self.hcam_ptr = False
-        self.old_frame_bytes = -1
+        self.buffer_sets = []
+        self.buffer_set = None
+        self.max_buffer_sets = 2
+        self.attached = False
 
         self.setPropertyValue("output_trigger_kind[0]", 2)
 
-    ## getFrames
+    ## allocFrame
     #
-    # Gets all of the available frames.
-    #
-    # This will block waiting for new frames even if there new frames
-    # available when it is called.
+    # Choose a free buffer set for an acquisition of n frames, allocate a new
+    # one if none of the right size are free.
     #
-    # FIXME: It does not always seem to block? The length of frames can
-    #   be zero. Are frames getting dropped? Some sort of race condition?
+    # @param n_frames The number of frames.
     #
-    # @return [frames, [frame x size, frame y size]]
+    # @return True if a buffer set was allocated, False if reused.
     #
-    def getFrames(self):
-        frames = []
-        for n in self.newFrames():
-            frames.append(self.hcam_data[n])
+    def allocFrame(self, n_frames):
+        n_frames = int(n_frames)
+        self.captureSetup()
+        key = (n_frames, self.frame_y, self.frame_bytes)
+
+        # The last acquisition is done, let go of its buffer set.
+        if self.buffer_set is not None:
+            self.buffer_set.release()
+            self.buffer_set = None
+
+        # Drop free buffer sets of other sizes.
+        self.buffer_sets = [b for b in self.buffer_sets
+                            if b.key == key or not b.isFree()]
+
+        matches = [b for b in self.buffer_sets if b.key == key]
+        buffer_set = None
+        for b in matches:
+            if b.isFree():
+                buffer_set = b
+                break
+        if buffer_set is None and len(matches) >= self.max_buffer_sets:
+            # Wait for downstream processing to release the oldest one.
+            buffer_set = matches[0]
+            with buffer_set.lock:
+                while not buffer_set.isFree():
+                    buffer_set.lock.wait()
+
+        allocated = buffer_set is None
+        if allocated:
+            buffer_set = BufferSet(n_frames, self.frame_x, self.frame_y)
+            self.buffer_sets.append(buffer_set)
+            self.buffer_allocations += 1
+        else:
+            self.buffer_reuses += 1
 
-        return [frames, [self.frame_x, self.frame_y]]
+        buffer_set.acquire()                                                    # held by the camera until the next acquisition
+        self.buffer_set = buffer_set
+        self.number_image_buffers = n_frames
+        return allocated
 
     ## startAcquisition
     #
-    # Allocate as many frames as will fit in 2GB of memory and start data acquisition.
+    # Attach the buffer set and start data acquisition.
+    #
+    # @param n_frames (Optional) The number of frames, if the buffers were
+    #    not already chosen with allocFrame().
+    #
     # KP 9/19. Changed to allocate n frames
     #
-    def startAcquisition(self, n_Frames):
-        self.captureSetup()
-        print(self.frame_bytes)
-        #
-        # Allocate new image buffers if necessary.
-        # Allocate as many frames as can fit in 2GB of memory.
-        #
-        if (self.old_frame_bytes != self.frame_bytes):
-
-            #n_buffers = int((2.0 * 1024 * 1024 * 1024)/self.frame_bytes)
-            #self.number_image_buffers = n_buffers
-            self.number_image_buffers = int(n_Frames)
-
-            # Allocate new image buffers.
-            ptr_array = ctypes.c_void_p * self.number_image_buffers
-            self.hcam_ptr = ptr_array()
-            self.hcam_data = []
-            for i in range(self.number_image_buffers):
-                hc_data = HCamData(self.frame_bytes)
-                self.hcam_ptr[i] = hc_data.getDataPtr()
-                self.hcam_data.append(hc_data)
-
-            self.old_frame_bytes = self.frame_bytes
+    def startAcquisition(self, n_frames = None):
+        if n_frames is not None:
+            self.allocFrame(n_frames)
 
         # Attach image buffers.
         #
         # We need to attach & release for each acquisition otherwise
         # we'll get an error if we try to change the ROI in any way
         # between acquisitions.
+        buffer_set = self.buffer_set
         self.checkStatus(dcam.dcam_attachbuffer(self.camera_handle,
-                                                self.hcam_ptr,
-                                                ctypes.sizeof(self.hcam_ptr)),
+                                                buffer_set.ptr,
+                                                ctypes.sizeof(buffer_set.ptr)),
                          "dcam_attachbuffer")
+        self.attached = True
 
         # Start acquisition.
+        self.resetStats()
         self.checkStatus(dcam.dcam_capture(self.camera_handle),
                          "dcam_capture")
 
     ## stopAcquisition
     #
-    # Stop data acquisition and release the memory associates with the frames.
+    # Stop data acquisition and detach the buffer set. The frames stay in
+    # the buffer set.
     #
     def stopAcquisition(self):
 
@@ -1118,15 +1875,198 @@ class HamamatsuCameraMR(HamamatsuCamera):
                          "dcam_idle")
 
         # Release image buffers.
-        if (self.hcam_ptr):
+        if self.attached:
             self.checkStatus(dcam.dcam_releasebuffer(self.camera_handle),
                              "dcam_releasebuffer")
+            self.attached = False
 
-        print("max camera backlog was:", self.max_backlog)
+        if self.debug:
+            self.message("max camera backlog was: " + str(self.max_backlog))
 
         self.max_backlog = 0
 
+    ## freeFrames
+    #
+    # Forget the free buffer sets, held buffer sets are freed when they are
+    # released.
+    #
+    def freeFrames(self):
+        self.number_image_buffers = 0
+        if self.buffer_set is not None:
+            self.buffer_set.release()
+            self.buffer_set = None
+        self.buffer_sets = [b for b in self.buffer_sets if not b.isFree()]
 
+    ## newFrames
+    #
+    # The frames fill the buffer set in order without wrapping around, so
+    # the new frames follow from the frame count. Unlike the buffer index,
+    # the frame count is still known after the buffer set is released by
+    # stopAcquisition().
+    #
+    # @return A list of the new frames.
+    #
+    def newFrames(self):
+        last = self.last_frame_number
+        HamamatsuCamera.newFrames(self)
+        count = min(self.last_frame_number, self.number_image_buffers)
+        self.buffer_index = count - 1
+        return list(range(last, count))
+
+    ## copyFrames
+    #
+    # The frames are already in the buffer set. If image is the buffer set
+    # image, nothing is copied, otherwise the frames are copied to image.
+    #
+    def copyFrames(self, frames, image, row = 0):
+        frame_y = self.frame_y
+        n_frames = min(len(frames), (imageHeight(image) - row) // frame_y)
+        source = self.buffer_set.image
+        self.stats['frames'] += n_frames
+        channels = image if isinstance(image, (list, tuple)) else [image]
+        if channels[0].ctypes.data == source.ctypes.data:
+            return n_frames
+        t0 = time.perf_counter()
+        for i, n in enumerate(frames[:n_frames]):
+            r = row + i*frame_y
+            x = 0
+            for channel in channels:
+                width = channel.shape[1]
+                channel[r:r + frame_y] = source[n*frame_y:(n + 1)*frame_y,
+                                                x:x + width]
+                x += width
+        self.stats['copy_time'] += time.perf_counter() - t0
+        return n_frames
+
+    ## readImage
+    #
+    # @param image (Optional) Array to copy the frames to, if None the image
+    #    is a view of the buffer set.
+    #
+    # @return A n_frames*frame_y x frame_x numpy array of the new frames.
+    #
+    def readImage(self, image = None):
+        if image is None:
+            image = self.buffer_set.image
+        frames = self.newFrames()
+        n_frames = self.copyFrames(frames, image)
+        return imageRows(image, 0, n_frames*self.frame_y)
+
+    ## startStream
+    #
+    # Count frames as they arrive in the buffer set, see FrameStream. The
+    # stream image is the buffer set image unless another image is given.
+    #
+    def startStream(self, n_frames, image = None, sink = None):
+        if image is None:
+            image = self.buffer_set.image[0:int(n_frames)*self.frame_y]
+        return FrameStream(self, image, sink).start()
+
+    ## writeImage
+    #
+    # Saves the left and right channels of an image as TIFFs. If the image
+    # is in a buffer set, the buffer set is held until the images are
+    # written, so it is not reused by the next acquisition.
+    #
+    def writeImage(self, image, image_name, image_path, writer = None):
+        return self.holdImage(image, writer, HamamatsuCamera.writeImage,
+                              image_name, image_path, writer)
+
+    ## storeImage
+    #
+    # Writes the channels of an image into an experiment store, holding the
+    # buffer set like writeImage().
+    #
+    def storeImage(self, image, store, writer = None, **index):
+        return self.holdImage(image, writer, HamamatsuCamera.storeImage,
+                              store, writer, **index)
+
+    ## holdImage
+    #
+    # Hold the buffer set that owns an image until the background writes of
+    # its left and right channels are done.
+    #
+    # @param image The image to save.
+    # @param writer The ImageWriter, or None if the image is saved before
+    #    save returns.
+    # @param save Function that saves the image and returns [left future,
+    #    right future] if there is a writer.
+    # @param args, kwargs Arguments of save after the camera and the image.
+    #
+    # @return The return value of save.
+    #
+    # The buffer set is held once per channel before save runs. If save
+    # raises, or returns fewer futures than that, the holds without a future
+    # are released so the buffer set can be reused.
+    #
+    def holdImage(self, image, writer, save, *args, **kwargs):
+        buffer_set = None
+        for b in self.buffer_sets:
+            if b.owns(image):
+                buffer_set = b
+        held = 0
+        if writer is not None and buffer_set is not None:
+            held = 2
+            for i in range(held):
+                buffer_set.acquire()
+        try:
+            futures = save(self, image, *args, **kwargs)
+        except Exception:
+            for i in range(held):
+                buffer_set.release()
+            raise
+        if held:
+            futures_held = list(futures or [])[0:held]
+            for future in futures_held:
+                future.add_done_callback(buffer_set.release)
+            for i in range(held - len(futures_held)):
+                buffer_set.release()
+        return futures
+
+
+## benchmarkProperties
+#
+# Time property access with and without the attribute cache.
+#
+# Each access reads the value and range of the exposure time and sets the
+# trigger polarity by its text value, which is what happens for every
+# property when a camera is configured.
+#
+# @param hcam A HamamatsuCamera.
+# @param counts (Optional) The numbers of accesses to time.
+#
+# @return {count : [uncached seconds, cached seconds], ..}
+#
+def benchmarkProperties(hcam, counts = (1, 10, 100, 1000)):
+    polarity = hcam.getPropertyValue("trigger_polarity")[0]
+    text = None
+    for key, value in hcam.getPropertyText("trigger_polarity").items():
+        if value == polarity:
+            text = key.decode()
+
+    cache_attributes = hcam.cache_attributes
+    results = {}
+    for count in counts:
+        times = []
+        for cache in (False, True):
+            hcam.cache_attributes = cache
+            hcam.cacheAttributes()
+            start = time.perf_counter()
+            for i in range(count):
+                hcam.getPropertyValue("exposure_time")
+                hcam.getPropertyRange("exposure_time")
+                hcam.setPropertyValue("trigger_polarity", text)
+            times.append(time.perf_counter() - start)
+        results[count] = times
+    hcam.cache_attributes = cache_attributes
+
+    print("{:>8}{:>16}{:>16}{:>10}".format("accesses", "uncached (ms)",
+                                          "cached (ms)", "speedup"))
+    for count, [uncached, cached] in results.items():
+        print("{:>8}{:>16.2f}{:>16.2f}{:>10.1f}".format(count, uncached*1000,
+                                                       cached*1000,
+                                                       uncached/cached))
+    return results
 
 
 #
@@ -1135,7 +2075,10 @@ class HamamatsuCameraMR(HamamatsuCamera):
 
 if __name__ == "__main__":
 
-    import time
+    # Use the simulated cameras if DCAM is not installed.
+    if (n_cameras == 0):
+        from pyseq.sim import dcam as simdcam
+        setLibrary(simdcam.DCAMAPI())
 
     print("found:", n_cameras, "cameras")
     if (n_cameras > 0):
@@ -1197,6 +2140,10 @@ if __name__ == "__main__":
             for param in params:
                 print(param, hcam.getPropertyValue(param)[0])
 
+        # Benchmark property access.
+        if 1:
+            benchmarkProperties(hcam)
+
         # Test acquisition.
         if 0:
             hcam.startAcquisition()
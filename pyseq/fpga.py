@@ -18,20 +18,44 @@ Examples:
     # Arm y stage triggers for TDI imgaging.
     >>>fpga.TDIYPOS(3000000)
     >>>fpga.TDIYPOS3(4096,3000000)
+    # Queue commands without waiting, then get the responses.
+    >>>ex = fpga.submit('EX1HM')
+    >>>obj = fpga.submit('ZDACR')
+    >>>obj.result()
+    >>>'ZDACR 30000\n'
+
+The FPGA is shared by the zstage, the objective stage, and the optics, which
+may be used from different threads. Commands are written under a lock and
+every response is matched to the pending command it answers, by the command
+name the FPGA echoes, so responses can't be mixed up between callers. A
+late response to a command that timed out is dropped, any other response
+that echoes no pending command goes to the oldest pending command.
 
 Kunal Pandit 9/19
 """
 
 
-import serial
-import io
 import time
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+from . import motion
+from . import transport
 
 
 # FPGA object
 
 class FPGA():
-    """HiSeq 2500 System :: FPGA"""
+    """HiSeq 2500 System :: FPGA
+
+       Attributes:
+       timeout (float): Seconds to wait for a response from the FPGA.
+       pending (deque): Commands waiting for a response, in the order they
+            were sent, as [command name, Future, command, time sent] lists.
+       expired (deque): Names of the most recent commands that got no
+            response before the timeout.
+    """
 
     def __init__(self, com_port_command, com_port_response, baudrate = 115200, logger = None):
         """The constructor for the FPGA.
@@ -49,17 +73,27 @@ class FPGA():
            fpga object: A fpga object to control the FPGA.
         """
 
-        # Open Serial Port
-        s_command = serial.Serial(com_port_command, baudrate, timeout = 1)
-        s_response = serial.Serial(com_port_response, baudrate, timeout = 1)
-
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s_response,s_command),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
         self.suffix = '\n'
+
+        # Open Serial Port
+        self.serial_port = transport.Transport(com_port_command, baudrate,
+                                               name = 'FPGA',
+                                               suffix = self.suffix,
+                                               terminator = b'\n',
+                                               response_port = com_port_response,
+                                               logger = logger)
         self.y_offset = 7000000
         self.logger = logger
+        self.timeout = 30                                                       # s
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.expired = deque(maxlen = 16)
+
+        # Read responses in the background and hand them to the requesters
+        self.reading = True
+        self.reader = threading.Thread(target = self.read_responses,
+                                       name = 'FPGA', daemon = True)
+        self.reader.start()
 
 
     def initialize(self):
@@ -82,17 +116,117 @@ class FPGA():
            str: The response from the FPGA.
         """
 
-        text = text + self.suffix
-        self.serial_port.write(text)                                    # Write to serial port
-        self.serial_port.flush()                                        # Flush serial port
-        response = self.serial_port.readline()
+        response = self.result(self.submit(text))
         if self.logger is not None:
-            self.logger.info('FPGA::txmt::'+text)
-            self.logger.info('FPGA::rcvd::'+response)
+            self.logger.info('FPGA::txmt::%s%s', text, self.suffix)
+            self.logger.info('FPGA::rcvd::%s', response)
 
         return  response
 
 
+    def submit(self, text):
+        """Send a command to the FPGA without waiting for the response.
+
+           Parameters:
+           text (str): A command to send to the FPGA.
+
+           Returns:
+           Future: Future with the response from the FPGA as its result.
+        """
+
+        future = Future()
+        name = text.split(' ')[0]
+        with self.lock:
+            self.pending.append([name, future, text, motion.now()])
+            self.serial_port.send(text)                                         # Write to serial port
+
+        return future
+
+
+    def result(self, future):
+        """Wait for and return the response to a submitted command.
+
+           Parameters:
+           future (Future): Future returned by submit.
+
+           Returns:
+           str: The response from the FPGA, or '' if there was no response
+                before the timeout.
+        """
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self.lock:
+                for i, (name, f, text, t0) in enumerate(self.pending):
+                    if f is future:
+                        del self.pending[i]
+                        self.expired.append(name)
+                        break
+            if future.done():                                                   # Answered while giving up
+                return future.result()
+            if self.logger is not None:
+                self.logger.info('FPGA::error::no response')
+            return ''
+
+
+    def read_responses(self):
+        """Read responses from the FPGA and pass them to the requesters.
+
+           Runs in a background thread. Each response is given to the oldest
+           pending command with the same name. A response that arrives after
+           result() gave up on its command is logged and dropped, so it is
+           not given to another command. Any other response that matches no
+           pending command, for example a reply that does not echo the
+           command, is logged and given to the oldest pending command.
+        """
+
+        while self.reading:
+            try:
+                response = self.serial_port.readline()
+            except Exception:                                                   # Port closed
+                break
+            if not response:
+                continue
+            name = response.split(' ')[0].strip()
+
+            with self.lock:
+                request = None
+                late = False
+                for i, pending in enumerate(self.pending):
+                    if pending[0] == name:
+                        request = pending
+                        del self.pending[i]
+                        break
+                if request is None:
+                    if name in self.expired:                                    # Answer to a timed out command
+                        self.expired.remove(name)
+                        late = True
+                    elif self.pending:                                          # Reply without the command name
+                        request = self.pending.popleft()
+
+            if request is not None:
+                if request[0] != name and self.logger is not None:
+                    self.logger.info('FPGA::rcvd::unmatched, given to %s::%s',
+                                     request[2], response)
+                name, future, text, t0 = request
+                self.serial_port.histogram.record(text, motion.now() - t0, t0)
+                future.set_result(response)
+            elif self.logger is not None:
+                if late:
+                    self.logger.info('FPGA::rcvd::dropped late::%s', response)
+                else:
+                    self.logger.info('FPGA::rcvd::dropped unexpected::%s', response)
+
+
+    def close(self):
+        """Stop reading responses and close the serial ports."""
+
+        self.reading = False
+        self.reader.join()
+        self.serial_port.close()
+
+
     def read_position(self):
         """Read the y position of the encoder for TDI imaging.
 
@@ -19,9 +19,8 @@
 Kunal Pandit 11/19
 """
 
-import serial
-import io
-import time
+from . import motion
+from . import transport
 
 
 class Laser():
@@ -51,18 +50,22 @@ class Laser():
            laser object: A laser object to control the laser.
         """
 
-        # Open Serial Port
-        s = serial.Serial(com_port, baudrate, timeout = 1)
+        self.suffix = '\r'
 
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s,s,),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
+        # Open Serial Port, only queries are answered
+        self.serial_port = transport.Transport(com_port, baudrate,
+                                               name = str(color) + 'Laser',
+                                               suffix = self.suffix,
+                                               terminator = b'\n',
+                                               replies = {'VERSION?': 1,
+                                                          'STAT?': 1,
+                                                          'POWER?': 1},
+                                               default_lines = 0,
+                                               logger = logger)
         self.on = False
         self.power = 0
         self.max_power = 500
         self.min_power = 0
-        self.suffix = '\r'
         self.logger = logger
         self.color = color
         self.version = self.command('VERSION?')[0:-1]
@@ -84,15 +87,7 @@ class Laser():
            str: The response from the laser.
         """
 
-        text = text + self.suffix
-        self.serial_port.write(text)                                    # Write to serial port
-        self.serial_port.flush()                                        # Flush serial port
-        response = self.serial_port.readline()
-        if self.logger is not None:
-            self.logger.info(self.color+'Laser::txmt::'+text)
-            self.logger.info(self.color+'Laser::rcvd::'+response)
-
-        return  response
+        return self.serial_port.command(text)
 
 
     def turn_on(self, state):
@@ -147,6 +142,17 @@ class Laser():
         return self.get_status()
 
 
+    async def set_power_async(self, power):
+        """Set the power level of the laser without blocking the event loop,
+           see set_power.
+
+        Returns:
+        bool: True if the laser is on, False if the laser is off.
+        """
+
+        return await motion.run_async(self.set_power, power)
+
+
     def get_status(self):
         """Return the status of laser (bool), True if on, False if off."""
 
@@ -274,7 +274,12 @@ def initialize_hs():
 
     import pyseq
 
-    hs = pyseq.HiSeq(logger)
+    if args_['sim'] is not None:
+        from pyseq import sim
+        sim.reset(speedup = args_['sim'])
+        hs = pyseq.HiSeq(logger, backend = 'sim')
+    else:
+        hs = pyseq.HiSeq(logger)
     hs.initializeCams(logger)
     hs.initializeInstruments()
 
@@ -300,6 +305,23 @@ def initialize_hs():
     if not os.path.exists(log_path):
         os.mkdir(log_path)
     hs.log_path = log_path
+    # Assign image catalog
+    hs.catalog = pyseq.catalog.Catalog(join(log_path, experiment_name + '.db'))
+    # Assign TIFF compression (optional)
+    compression = experiment.get('tiff compression', fallback = None)
+    if compression is not None:
+        hs.writer.write = pyseq.writer.TiffFormat(compression)
+    # Assign image store (optional)
+    store_path = experiment.get('image store', fallback = None)
+    if store_path is not None:
+        hs.store = pyseq.store.ExperimentStore(join(save_path, store_path))
+    # Assign preview pyramid scales (optional)
+    scales = experiment.get('preview scales', fallback = None)
+    if scales is not None:
+        scales = [int(scale) for scale in scales.split(',')]
+        hs.writer.write = pyseq.writer.Pyramid(hs.writer.write, scales)
+        if hs.store is not None:
+            hs.store.scales = tuple(scales)
     
     return hs
 
@@ -659,76 +681,73 @@ def IMAG(fc, n_Zplanes):
 
 
     for section in fc.sections:
-        x_center = fc.stage[section]['x center']
-        y_center = fc.stage[section]['y center']
-        x_pos = fc.stage[section]['x initial']
-        y_pos = fc.stage[section]['y initial']
-        n_scans = fc.stage[section]['n scans']
-        n_frames = fc.stage[section]['n frames']
-
-        # Find/Move to focal z stage position
-        if fc.stage[section]['z pos'] is None:
-            logger.log(21, AorB+'::Finding rough focus of ' + str(section))
-
-            hs.y.move(y_center)
-            hs.x.move(x_center)
-            hs.optics.move_ex(1, 0.6)
-            hs.optics.move_ex(2, 0.9)
-            hs.optics.move_em_in(True)
-            Z,C = hs.rough_focus()
-            fc.stage[section]['z pos'] = hs.z.position[:]
-        else:
-            hs.z.move(fc.stage[section]['z pos'])
-
-        # Find/Move to focal obj stage position,
-        # Edited to find focus every cycle change -1 to None if only want initial cycle
-        if fc.stage[section]['obj pos'] is not -1:
-            logger.log(21, AorB+'::Finding fine focus of ' + str(section))
-
-            hs.y.move(y_center)
-            hs.x.move(x_center)
-            hs.optics.move_ex(1, 0.6)
-            hs.optics.move_ex(2, 0.9)
-            hs.optics.move_em_in(True)
-            Z,C = hs.fine_focus()
-            fc.stage[section]['obj pos'] = hs.obj.position
-        else:
-            hs.obj.move(fc.stage[section]['obj pos'])
+        try:
+            x_center = fc.stage[section]['x center']
+            y_center = fc.stage[section]['y center']
+            x_pos = fc.stage[section]['x initial']
+            y_pos = fc.stage[section]['y initial']
+            n_scans = fc.stage[section]['n scans']
+            n_frames = fc.stage[section]['n frames']
+
+            # Find/Move to focal z stage position
+            if fc.stage[section]['z pos'] is None:
+                logger.log(21, AorB+'::Finding rough focus of ' + str(section))
+
+                hs.gather_moves(x = x_center, y = y_center, ex1 = 0.6, ex2 = 0.9,
+                                em_in = True)
+                Z,C = hs.rough_focus()
+                fc.stage[section]['z pos'] = hs.z.position[:]
+            else:
+                hs.z.move(fc.stage[section]['z pos'])
 
-        # Optimize filter
-        logger.log(21, AorB+'::Finding optimal filter')
-        hs.y.move(y_pos)
-        hs.x.move(x_center)
-        opt_filter = hs.optimize_filter(32)                                     #Find optimal filter set on 32 frames on image
-        hs.optics.move_ex(1, opt_filter[0])
-        hs.optics.move_ex(2, opt_filter[1])
-        hs.optics.move_em_in(True)
-        fc.ex_filter1 = opt_filter[0]
-        fc.ex_filter2 = opt_filter[1]
+            # Find/Move to focal obj stage position,
+            # Edited to find focus every cycle change -1 to None if only want initial cycle
+            if fc.stage[section]['obj pos'] is not -1:
+                logger.log(21, AorB+'::Finding fine focus of ' + str(section))
 
+                hs.gather_moves(x = x_center, y = y_center, ex1 = 0.6, ex2 = 0.9,
+                                em_in = True)
+                Z,C = hs.fine_focus()
+                fc.stage[section]['obj pos'] = hs.obj.position
+            else:
+                hs.obj.move(fc.stage[section]['obj pos'])
+
+            # Optimize filter
+            logger.log(21, AorB+'::Finding optimal filter')
+            hs.gather_moves(x = x_center, y = y_pos)
+            opt_filter = hs.optimize_filter(32)                                     #Find optimal filter set on 32 frames on image
+            hs.gather_moves(ex1 = opt_filter[0], ex2 = opt_filter[1], em_in = True)
+            fc.ex_filter1 = opt_filter[0]
+            fc.ex_filter2 = opt_filter[1]
 
 
-        if n_Zplanes > 1:
-            obj_start = int(hs.obj.position - hs.nyquist_obj*n_Zplanes/2)
-            obj_step = hs.nyquist_obj
-            obj_stop = int(hs.obj.position + hs.nyquist_obj*n_Zplanes/2)
-        else:
-            obj_start = hs.obj.position
-            obj_step = 1000
-            obj_stop = hs.obj.position + 10
-
-        image_name = AorB
-        image_name = image_name + '_' + str(section)
-        image_name = image_name + '_' + 'c' + cycle
-
-        # Scan section on flowcell
-        logger.log(21, AorB + '::cycle'+cycle+'::Imaging ' + str(section))
-        scan_time = hs.scan(x_pos, y_pos,
-                            obj_start, obj_stop, obj_step,
-                            n_scans, n_frames, image_name)
-        scan_time = str(int(scan_time/60))
-        logger.log(21, AorB+'::cycle'+cycle+'::Took ' + scan_time +
-                       ' minutes ' + 'imaging ' + str(section))
+
+            if n_Zplanes > 1:
+                obj_start = int(hs.obj.position - hs.nyquist_obj*n_Zplanes/2)
+                obj_step = hs.nyquist_obj
+                obj_stop = int(hs.obj.position + hs.nyquist_obj*n_Zplanes/2)
+            else:
+                obj_start = hs.obj.position
+                obj_step = 1000
+                obj_stop = hs.obj.position + 10
+
+            image_name = AorB
+            image_name = image_name + '_' + str(section)
+            image_name = image_name + '_' + 'c' + cycle
+
+            # Scan section on flowcell
+            logger.log(21, AorB + '::cycle'+cycle+'::Imaging ' + str(section))
+            scan_time = hs.scan(x_pos, y_pos,
+                                obj_start, obj_stop, obj_step,
+                                n_scans, n_frames, image_name,
+                                section = AorB + '_' + str(section),
+                                cycle = cycle)
+            scan_time = str(int(scan_time/60))
+            logger.log(21, AorB+'::cycle'+cycle+'::Took ' + scan_time +
+                           ' minutes ' + 'imaging ' + str(section))
+        except RuntimeError as error:                                           # Objective could not reach a plane
+            logger.log(21, AorB+'::cycle'+cycle+'::Skipped imaging ' +
+                       str(section) + ', ' + str(error))
 
     fc.imaging = False
     stop = time.time()
@@ -770,6 +789,7 @@ def do_shutdown():
 
     hs.z.move([0, 0, 0])
     hs.move_stage_out()
+    hs.writer.close()                                                           # Finish writing images
     ##Flush all lines##
     flush_YorN = input("Flush lines? Y/N = ")
     if flush_YorN == 'Y':
@@ -803,6 +823,23 @@ def do_shutdown():
     # Turn off y stage motor
     hs.y.command('OFF')
 
+    # Summarize the latency of each instrument
+    from pyseq import transport
+    transport.report(logger)
+    logger.info('ImageWriter::' + str(hs.writer.summary()))
+    if hs.store is not None:
+        logger.info('ExperimentStore::' + str(hs.store.summary()))
+    if hs.catalog is not None:
+        hs.catalog.close()
+    for cam in (hs.cam1, hs.cam2):
+        if cam is not None:
+            cam.message(cam.getStats(total = True))
+
+    # Summarize where the time went on the simulated HiSeq
+    if hs.backend == 'sim':
+        from pyseq import sim
+        sim.report(logger)
+
 
 
 ##########################################################
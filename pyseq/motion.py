@@ -0,0 +1,334 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Motion
+
+Predict when a move will finish, wait for it without polling the instrument
+the whole time, and keep a record of how long moves take.
+
+A move is predicted from a trapezoid velocity profile. The host sleeps until
+shortly before the predicted arrival, then polls the instrument at a fine
+interval until it reports the move is done. If the move is still not done
+well after the prediction, the wait gives up with a TimeoutError, so a stalled
+instrument can not hang the run. The predicted and actual times of each move
+are stored in a MoveLog.
+
+Moves of independent instruments can overlap. Each driver has async
+counterparts of its moves that run the blocking move in a worker thread,
+and gather() runs a group of them concurrently. run_threads() runs blocking
+functions concurrently in the same worker threads without an event loop.
+
+Examples:
+    #Predict the time to move 3 mm at 1 mm/s with 10 mm/s**2 acceleration
+    >>>import pyseq
+    >>>pyseq.motion.trapezoid_time(3, 1, 10)
+    3.1
+    #Wait for a ystage move and see how long it took
+    >>>ystage.move(3000000)
+    >>>ystage.move_log.last
+    {'start': 0, 'target': 3000000, 'predicted': 3.3, 'actual': 3.31, 'polls': 7}
+    #Move the x and y stage at the same time
+    >>>pyseq.motion.gather(xstage.move_async(10000), ystage.move_async(0))
+    [True, True]
+"""
+
+
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+
+
+# A wait gives up after timeout_factor times the predicted time plus
+# timeout_margin seconds
+timeout_factor = 2.0
+timeout_margin = 10.0
+
+# Worker threads for the async moves, created on first use
+max_workers = 8
+_executor = None
+
+
+def now():
+    """Return the current instrument time in seconds (float).
+
+       pyseq.sim.reset() replaces now and sleep with its own clock, so
+       simulated instruments can run faster than real time.
+    """
+
+    return time.perf_counter()
+
+
+def sleep(seconds):
+    """Sleep for the specified instrument seconds (float)."""
+
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def trapezoid_time(distance, vmax, accel = None, decel = None, v0 = 0.0):
+    """Return the time in seconds to move a distance (float).
+
+       The axis accelerates from v0 to vmax, cruises, then decelerates back to
+       v0. If the distance is too short to reach vmax, the profile is
+       triangular.
+
+       Parameters:
+       distance (float): Distance to move.
+       vmax (float): Maximum velocity in distance units per second.
+       accel (float, optional): Acceleration in distance units per second**2,
+            if None the axis moves at vmax the whole time.
+       decel (float, optional): Deceleration, default is accel.
+       v0 (float, optional): Initial and final velocity.
+
+       Returns:
+       float: Time to move in seconds.
+    """
+
+    distance = abs(distance)
+    if distance == 0 or vmax <= 0:
+        return 0.0
+    if accel is None:
+        return distance / vmax
+    if decel is None:
+        decel = accel
+
+    v0 = min(v0, vmax)
+    s_ramp = (vmax**2 - v0**2) / (2 * accel) + (vmax**2 - v0**2) / (2 * decel)
+    if s_ramp <= distance:
+        vp = vmax
+    else:
+        vp = (v0**2 + 2 * distance * accel * decel / (accel + decel))**0.5
+        s_ramp = distance
+    t_ramp = (vp - v0) / accel + (vp - v0) / decel
+
+    return t_ramp + (distance - s_ramp) / vp
+
+
+def deadline(t_done, timeout = None):
+    """Return the instrument time to stop waiting for a move (float).
+
+       Parameters:
+       t_done (float): Predicted instrument time (see now()) the move is done.
+       timeout (float, optional): Seconds after t_done to give up, default is
+            timeout_factor times the predicted time from now plus
+            timeout_margin.
+    """
+
+    if timeout is None:
+        timeout = (timeout_factor - 1) * max(t_done - now(), 0) + timeout_margin
+
+    return t_done + timeout
+
+
+def wait(done, t_done, lead = 0.05, poll = 0.01, timeout = None):
+    """Wait until a move is done.
+
+       Sleep until lead seconds before the predicted completion, then call
+       done() every poll seconds until it returns True.
+
+       Parameters:
+       done (function): Returns True when the move is done.
+       t_done (float): Predicted instrument time (see now()) the move is done.
+       lead (float, optional): Seconds before t_done to start polling.
+       poll (float, optional): Seconds between polls.
+       timeout (float, optional): Seconds after t_done to give up, see
+            deadline().
+
+       Returns:
+       int: Number of times done() was called.
+
+       Raises:
+       TimeoutError: If the move is not done by the deadline.
+    """
+
+    t_stop = deadline(t_done, timeout)
+    sleep(t_done - lead - now())
+    polls = 1
+    while not done():
+        if now() > t_stop:
+            raise TimeoutError('Move not done after ' + str(polls) + ' polls')
+        sleep(poll)
+        polls += 1
+
+    return polls
+
+
+def executor():
+    """Return the thread pool the async moves run in (ThreadPoolExecutor)."""
+
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers = max_workers)
+
+    return _executor
+
+
+def run_threads(*calls):
+    """Run blocking functions concurrently and wait until they are all done.
+
+       The functions run in the worker threads of executor(), no event loop
+       is used, so run_threads can be called from anywhere, including a
+       running event loop. If a function raises an exception, the others are
+       still waited for and then the first exception is raised.
+
+       Parameters:
+       calls: The functions to run without arguments, for example
+            functools.partial(camera.drainFrames, stream).
+
+       Returns:
+       list: The return values of the functions in the same order.
+    """
+
+    futures = [executor().submit(call) for call in calls]
+    wait_futures(futures)
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+
+    return [future.result() for future in futures]
+
+
+async def run_async(function, *args, **kwargs):
+    """Run a blocking instrument function in a worker thread.
+
+       Parameters:
+       function (function): The blocking function, usually a move.
+       args, kwargs: Arguments for the function.
+
+       Returns:
+       The return value of the function.
+    """
+
+    loop = asyncio.get_running_loop()
+    call = functools.partial(function, *args, **kwargs)
+
+    return await loop.run_in_executor(executor(), call)
+
+
+async def _gather(coroutines):
+    return await asyncio.gather(*coroutines, return_exceptions = True)
+
+
+def _run_loop(coroutines):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_gather(coroutines))
+    finally:
+        loop.close()
+
+
+def gather(*coroutines):
+    """Run coroutines concurrently and wait until they are all done.
+
+       The coroutines run in a new event loop. If the calling thread is
+       already running an event loop, such as in Jupyter, the new loop runs
+       in its own thread and gather blocks until it is done. If a coroutine
+       raises an exception, the others are still waited for and then the
+       first exception is raised.
+
+       Parameters:
+       coroutines: The coroutines to run, for example move_async() calls.
+
+       Returns:
+       list: The results of the coroutines in the same order.
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        results = _run_loop(coroutines)
+    else:
+        with ThreadPoolExecutor(max_workers = 1) as loop_thread:
+            results = loop_thread.submit(_run_loop, coroutines).result()
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return results
+
+
+class MoveLog():
+    """Record of the predicted and actual time of moves.
+
+       Attributes:
+       name (str): Name of the instrument.
+       moves (deque): The most recent moves, each a dictionary with start,
+            target, predicted, actual, and polls keys. Times are in seconds.
+    """
+
+
+    def __init__(self, name, maxlen = 1000):
+        """Constructor for the move log.
+
+           Parameters:
+           name (str): Name of the instrument.
+           maxlen (int, optional): Maximum number of moves to keep.
+        """
+
+        self.name = name
+        self.moves = deque(maxlen = maxlen)
+
+
+    def __len__(self):
+        return len(self.moves)
+
+
+    @property
+    def last(self):
+        """Return the most recent move (dict), or None."""
+
+        if self.moves:
+            return self.moves[-1]
+
+
+    def record(self, start, target, predicted, actual, polls = None):
+        """Add a move to the log.
+
+           Parameters:
+           start: Position at the start of the move.
+           target: Position at the end of the move.
+           predicted (float): Predicted time of the move in seconds.
+           actual (float): Actual time of the move in seconds.
+           polls (int, optional): Number of times the instrument was polled,
+                None if not counted.
+
+           Returns:
+           dict: The recorded move.
+        """
+
+        move = {'start': start, 'target': target, 'predicted': predicted,
+                'actual': actual, 'polls': polls}
+        self.moves.append(move)
+
+        return move
+
+
+    def summary(self):
+        """Return statistics of the logged moves.
+
+           Returns:
+           dict: Number of moves (n), total, mean, and max actual time,
+                mean predicted time, mean error (actual - predicted), and
+                mean number of polls if polls were counted.
+        """
+
+        n = len(self.moves)
+        if n == 0:
+            return {'n': 0}
+        actual = [m['actual'] for m in self.moves]
+        predicted = [m['predicted'] for m in self.moves]
+
+        polls = [m['polls'] for m in self.moves if m['polls'] is not None]
+
+        summary = {'n': n,
+                   'total': sum(actual),
+                   'mean': sum(actual) / n,
+                   'max': max(actual),
+                   'predicted': sum(predicted) / n,
+                   'error': (sum(actual) - sum(predicted)) / n}
+        if polls:
+            summary['polls'] = sum(polls) / len(polls)
+
+        return summary
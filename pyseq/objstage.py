@@ -16,12 +16,15 @@ Examples:
     # Change objective velocity to 1 mm/s and move to step 5000
     >>>obj.set_velocity(1)
     >>>obj.move(5000)
+    # Predicted and actual time of the move
+    >>>obj.move_log.last
+    >>>{'start': 30000, 'target': 5000, 'predicted': 0.105, 'actual': 0.11, 'polls': 1}
 
 Kunal Pandit 9/19
 """
 
 
-import time
+from . import motion
 
 
 class OBJstage():
@@ -31,6 +34,12 @@ class OBJstage():
        spum (int): The number of objective steps per micron.
        v (float): The velocity the objective will move at in mm/s.
        position (int): The absolute position of the objective in steps.
+       tolerance (int): Steps from the target position that count as in
+            position.
+       max_retries (int): Number of times a move is resent if the objective
+            is not in position.
+       zstep_scale (int): ZSTEP velocity units per mm/s.
+       move_log (MoveLog): Predicted and actual time of recent moves.
     """
 
 
@@ -47,7 +56,7 @@ class OBJstage():
                 position of the objective.
         """
 
-        self.serial_port = fpga
+        self.fpga = fpga
         self.min_z = 0
         self.max_z = 65535
         self.spum = 262                                                         #steps per um
@@ -57,6 +66,11 @@ class OBJstage():
         self.suffix = '\n'
         self.position = None
         self.logger = logger
+        self.tolerance = 4                                                      # steps, about 15 nm of encoder jitter
+        self.max_retries = 3
+        self.settle = 0.01                                                      # s
+        self.zstep_scale = 1288471                                              # ZSTEP units per mm/s
+        self.move_log = motion.MoveLog('OBJstage')
 
 
     def initialize(self):
@@ -78,37 +92,74 @@ class OBJstage():
            str: The response from the objective stage.
         """
 
-        text = text + self.suffix
-        self.serial_port.write(text)
-        self.serial_port.flush()
-        response = self.serial_port.readline()
+        response = self.fpga.result(self.fpga.submit(text))                     # Send through the FPGA
         if self.logger is not None:
-            self.logger.info('OBJstage::txmt::'+text)
-            self.logger.info('OBJstage::rcvd::'+response)
+            self.logger.info('OBJstage::txmt::%s%s', text, self.suffix)
+            self.logger.info('OBJstage::rcvd::%s', response)
 
         return  response
 
 
-    def move(self, position):
+    def move(self, position, tolerance = None):
         """Move the objective to an absolute step position.
 
            The objective can move between steps 0 and 65535, where step 0 is
            the closest to the stage. If the position is out of range, the
            objective will not move and a warning message is printed.
 
+           The position is not checked until the objective should have
+           arrived at the set velocity. If the objective is not within the
+           tolerance of the position, the move is resent up to max_retries
+           times.
+
            Parameters:
            position (int): The step position to move the objective to.
+           tolerance (int, optional): Steps from position that count as in
+                position, default is the tolerance attribute.
+
+           Returns:
+           bool: True if the objective is in position, False if the position
+                is out of range, could not be reached, or could not be read.
         """
 
-        if position >= self.min_z and position <= self.max_z:
-            try:
-                while self.check_position() != position:
-                    self.command('ZMV ' + str(position))                        # Move Objective
+        if tolerance is None:
+            tolerance = self.tolerance
 
-            except:
-                print('Error moving objective stage')
-        else:
+        if position < self.min_z or position > self.max_z:
             print('Objective position out of range')
+            return False
+
+        in_position = False
+        start = self.position
+        predicted = self.move_time(position)
+        t0 = motion.now()
+        for attempt in range(self.max_retries + 1):
+            t_move = motion.now()
+            if not self.command('ZMV ' + str(position)):                        # Move Objective
+                print('Objective did not answer move to ' + str(position))      # FPGA timed out
+            motion.sleep(t_move + self.move_time(position) -                    # Wait till objective should arrive
+                         motion.now())
+            current = self.check_position()
+            if current is not None and abs(current - position) <= tolerance:
+                in_position = True
+                break
+        self.move_log.record(start, position, predicted,
+                             motion.now() - t0, attempt + 1)
+
+        if not in_position:
+            print('Objective did not reach position ' + str(position))
+
+        return in_position
+
+
+    async def move_async(self, position, tolerance = None):
+        """Move the objective without blocking the event loop, see move.
+
+           Returns:
+           bool: True if the objective is in position.
+        """
+
+        return await motion.run_async(self.move, position, tolerance)
 
 
     def check_position(self):
@@ -128,7 +179,7 @@ class OBJstage():
             position = int(position[0:-1])
             self.position = position
             return position
-        except:
+        except (ValueError, IndexError):                                        # No response ('') or not a number
             print('Error reading position of objective')
             return None
 
@@ -146,8 +197,27 @@ class OBJstage():
 
         if v > self.min_v and v <= self.max_v:
             self.v = v
-            # convert mm/s to steps/s
-            v = int(v * 1288471)                                                #steps/mm
+            # convert mm/s to ZSTEP velocity units
+            v = int(v * self.zstep_scale)
             self.command('ZSTEP ' + str(v))                                     # Set velocity
         else:
             print('Objective velocity out of range')
+
+
+    def move_time(self, position):
+        """Return the predicted time in seconds to move to position (float).
+
+           The velocity in mm/s is converted to position steps/s with spum.
+           The ZSTEP velocity units of set_velocity are not position steps,
+           so zstep_scale is not used here.
+
+           Parameters:
+           position (int): The step position to move the objective to.
+        """
+
+        if self.position is None or not self.v:
+            return self.settle
+
+        sps = self.v * self.spum * 1000                                         # mm/s to steps/s
+
+        return motion.trapezoid_time(position - self.position, sps) + self.settle
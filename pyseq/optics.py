@@ -40,6 +40,8 @@ Kunal Pandit 9/19
 
 import time
 
+from . import motion
+
 
 class Optics():
     """Illumina HiSeq 2500 System :: Optics
@@ -65,7 +67,7 @@ class Optics():
            optics object: An optics object to control the optical filters. 
         """
 
-        self.serial_port = fpga
+        self.fpga = fpga
         self.logger = logger
         self.ex = [None, None]
         self.em_in = None
@@ -118,13 +120,10 @@ class Optics():
            str: The response from the optics.
         """
 
-        text = text + self.suffix
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                # Flush serial port
-        response = self.serial_port.readline()
+        response = self.fpga.result(self.fpga.submit(text))                     # Send through the FPGA
         if self.logger is not None:
-            self.logger.info('optics::txmt::'+text)
-            self.logger.info('optics::rcvd::'+response)
+            self.logger.info('optics::txmt::%s%s', text, self.suffix)
+            self.logger.info('optics::rcvd::%s', response)
 
         return  response
 
@@ -165,6 +164,17 @@ class Optics():
                   str(wheel))
 
 
+    async def move_ex_async(self, wheel, position):
+        """Move the excitation wheel without blocking the event loop, see
+           move_ex.
+
+           Both wheels can move at the same time, the FPGA matches each
+           response to the wheel that sent the command.
+        """
+
+        return await motion.run_async(self.move_ex, wheel, position)
+
+
     def move_em_in(self, INorOUT):
         """Move the emission filter in to or out of the light path.
 
@@ -182,3 +192,11 @@ class Optics():
         else:
             self.command('EM2O')
             self.em_in = False
+
+
+    async def move_em_in_async(self, INorOUT):
+        """Move the emission filter without blocking the event loop, see
+           move_em_in.
+        """
+
+        return await motion.run_async(self.move_em_in, INorOUT)
@@ -10,14 +10,16 @@ Examples:
     >>>pumpA.initialize()
     #Pump 2000 uL at 4000 uL/min
     >>>pumpA.pump(2000,4000)
+    #Predicted and actual time of the last stroke (dispense)
+    >>>pumpA.move_log.last
+    {'start': 48000, 'target': 0, 'predicted': 6.86, 'actual': 6.9, 'polls': None}
 
 Kunal Pandit 9/19
 """
 
 
-import serial
-import io
-import time
+from . import motion
+from . import transport
 
 
 class Pump():
@@ -34,6 +36,8 @@ class Pump():
        prefix (str): The prefix for commands to the pump. It depends on the
             pump address.
        name (str): The name of the pump.
+       valve_time (float): Time in seconds to switch the pump valve.
+       move_log (MoveLog): Predicted and actual time of recent strokes.
     """
 
 
@@ -52,13 +56,15 @@ class Pump():
 
         baudrate = 9600
 
-        # Open Serial Port
-        s = serial.Serial(com_port, baudrate, timeout = 1)
+        self.prefix = '/1'
+        self.suffix = '\r'
 
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s,s,),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
+        # Open Serial Port
+        self.serial_port = transport.Transport(com_port, baudrate, name = name,
+                                               prefix = self.prefix,
+                                               suffix = self.suffix,
+                                               terminator = b'\n',
+                                               logger = logger)
         self.n_barrels = 8
         self.barrel_volume = 250.0 # uL
         self.steps = 48000.0
@@ -67,10 +73,12 @@ class Pump():
         self.min_speed = int(self.min_volume*40*60) # uL per min (upm)
         self.max_speed = int(self.min_volume*8000*60) # uL per min (upm)
         self.dispense_speed = 7000 # speed to dispense (sps)
-        self.prefix = '/1'
-        self.suffix = '\r'
         self.logger = logger
         self.name = name
+        self.valve_time = 0.25                                                  # s
+        self.poll_lead = 0.1                                                    # s, start checking before predicted end
+        self.poll_interval = 0.1                                                # s
+        self.move_log = motion.MoveLog(name)
 
 
     def initialize(self):
@@ -89,15 +97,7 @@ class Pump():
            str: The response from the pump.
         """
 
-        text = self.prefix + text + self.suffix                                 # Format text
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                # Flush serial port
-        response = self.serial_port.readline()                                  # Get the response
-        if self.logger is not None:                                             # Write command and response to log
-            self.logger.info(self.name+'::txmt::'+text)
-            self.logger.info(self.name+'::rcvd::'+response)
-
-        return  response
+        return self.serial_port.command(text)
 
 
     def pump(self, volume, speed = 0):
@@ -106,6 +106,10 @@ class Pump():
            Parameters:
            volume (float): The volume to be pumped in uL.
            speed (float): The flowrate to pump at in uL/min.
+
+           Returns:
+           bool: True when the volume was pumped, False if a stroke failed or
+                timed out.
         """
 
         if speed == 0:
@@ -117,38 +121,93 @@ class Pump():
         self.check_pump()                                                       # Make sure pump is ready
 
         #Aspirate
-        while position != self.check_position():
-            self.command('IV' + str(sps) + 'A' + str(position) + 'R')           # Pull syringe down to position
-            self.check_pump()
+        start = self.check_position()
+        while position != start:
+            if not self.stroke('IV' + str(sps) + 'A' + str(position) + 'R',     # Pull syringe down to position
+                               start, position, sps):
+                self.write_log('aspirate failed')
+                return False
+            start = self.check_position()
         self.command('OR')                                                      # Switch valve to waste
+        self.check_pump(motion.now() + self.valve_time)
 
         #Dispense
         position = 0
-        while position != self.check_position():
-            self.command('OV' + str(self.dispense_speed) + 'A0R')               # Dispense, Push syringe to top at dispense speed
-            self.check_pump()
+        while position != start:
+            if not self.stroke('OV' + str(self.dispense_speed) + 'A0R',         # Dispense, Push syringe to top at dispense speed
+                               start, position, self.dispense_speed):
+                self.write_log('dispense failed')
+                return False
+            start = self.check_position()
         self.command('IR')                                                      # Switch valve to input
 
+        return self.check_pump(motion.now() + self.valve_time)
 
-    def check_pump(self):
-        """Wait until pump is ready and then return True.
+
+    def stroke(self, text, start, position, sps):
+        """Move the syringe and wait until the stroke is done.
+
+           The pump status is not checked until just before the stroke is
+           predicted to finish. The predicted and actual stroke times are
+           recorded in the move_log.
+
+           Parameters:
+           text (str): Command that moves the syringe.
+           start (int): Step position of the syringe before the stroke.
+           position (int): Step position at the end of the stroke.
+           sps (int): Speed of the syringe in steps per second.
 
            Returns:
            bool: True when the pump is ready. False, if the pump has an error.
         """
 
+        predicted = motion.trapezoid_time(position - start, sps)
+        t0 = motion.now()
+        self.command(text)
+        ready = self.check_pump(t0 + predicted)
+        actual = motion.now() - t0
+        self.move_log.record(start, position, predicted, actual)
+        self.write_log('stroke ' + str(start) + ' to ' + str(position) +
+                       ', predicted ' + '{:.2f}'.format(predicted) +
+                       ' s, actual ' + '{:.2f}'.format(actual) + ' s')
+
+        return ready
+
+
+    def check_pump(self, t_done = None):
+        """Wait until pump is ready and then return True.
+
+           Parameters:
+           t_done (float, optional): Predicted time the pump is ready, see
+                pyseq.motion.now(). The pump is not pinged until just before
+                then.
+
+           Returns:
+           bool: True when the pump is ready. False, if the pump has an error
+                or is still busy long after t_done, see
+                pyseq.motion.deadline().
+        """
+
         busy = '@'
         ready = '`'
         status_code = ''
 
+        if t_done is None:
+            t_done = motion.now()
+        t_stop = motion.deadline(t_done)
+        motion.sleep(t_done - self.poll_lead - motion.now())
+
         while status_code != ready :
 
             while not status_code:
                 status_code = self.command('')                                  # Ping pump for status
 
                 if status_code.find(busy) > -1:
+                    if motion.now() > t_stop:
+                        self.write_log('pump timed out')
+                        return False
                     status_code = ''
-                    time.sleep(2)
+                    motion.sleep(self.poll_interval)
                 elif status_code.find(ready) > -1:
                     status_code = ready
                     return True
@@ -164,7 +223,7 @@ class Pump():
            int: The step position of the pump (0-48000).
         """
 
-        pump_position = self.command('?')
+        pump_position = None
 
         while not isinstance(pump_position, int):
             pump_position = self.command('?')
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Simulator
+
+Emulated instruments for running PySeq2500 without a HiSeq 2500. The serial
+instruments (xstage, ystage, FPGA, pumps, valves, and lasers) are opened
+through pyserial URLs such as ``sim://xstage``, so the drivers talk to them
+exactly like they talk to a COM port. The cameras are emulated by a fake DCAM
+library (see pyseq.sim.dcam).
+
+All simulated devices share one clock. The clock can run faster than real
+time, the motion, stroke, and readout times of the devices and the read
+timeouts of the simulated serial ports are all scaled by the speedup.
+reset() also replaces pyseq.motion.now and pyseq.motion.sleep with the
+clock, so the drivers wait for predicted moves in simulated time.
+
+Examples:
+    #Create a simulated HiSeq that runs 10x faster than real time
+    >>>import pyseq
+    >>>from pyseq import sim
+    >>>sim.reset(speedup = 10)
+    >>>hs = pyseq.HiSeq(backend = 'sim')
+    >>>hs.initializeCams()
+    >>>hs.initializeInstruments()
+    #Show where the time went
+    >>>sim.report()
+"""
+
+import time
+import threading
+import serial
+
+from . import devices
+from .. import motion
+
+
+# Let pyserial find pyseq.sim.protocol_sim for sim:// urls
+if __name__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__name__)
+
+
+class Clock():
+    """Simulation clock.
+
+       Attributes:
+       speedup (float): Number of simulated seconds per real second.
+    """
+
+    def __init__(self, speedup = 1.0):
+        """Constructor for the clock.
+
+           Parameters:
+           speedup (float, optional): Number of simulated seconds per real
+                second, the default is real time.
+        """
+
+        self.speedup = float(speedup)
+        self.t0 = time.perf_counter()
+
+
+    def time(self):
+        """Return the simulated time in seconds (float)."""
+
+        return (time.perf_counter() - self.t0) * self.speedup
+
+
+    def sleep(self, seconds):
+        """Sleep for the specified simulated seconds (float)."""
+
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+
+    def sleep_until(self, t):
+        """Sleep until the simulated time t (float)."""
+
+        self.sleep(t - self.time())
+
+
+clock = Clock()
+instruments = {}
+_lock = threading.Lock()
+
+
+def reset(speedup = 1.0):
+    """Remove all simulated instruments and restart the clock.
+
+       Parameters:
+       speedup (float, optional): Number of simulated seconds per real
+            second.
+
+       Returns:
+       Clock: The new simulation clock.
+    """
+
+    global clock
+
+    with _lock:
+        instruments.clear()
+        clock = Clock(speedup)
+        motion.now = clock.time                                                 # predicted move times use the simulated clock
+        motion.sleep = clock.sleep
+
+    return clock
+
+
+def get_instrument(name):
+    """Return the simulated instrument with the specified name.
+
+       The instrument is created the first time it is requested. The type of
+       instrument is taken from the name, ie xstage, ystage, fpga, pumpA,
+       valveA24, valveB10, laser1, ...
+
+       Parameters:
+       name (str): Name of the instrument.
+
+       Returns:
+       instrument: The simulated instrument.
+    """
+
+    with _lock:
+        if name not in instruments:
+            instruments[name] = devices.make_device(name, clock, instruments)
+
+    return instruments[name]
+
+
+def report(logger = None):
+    """Print or log a summary of where time was spent in the simulation.
+
+       For each simulated instrument the number of commands, the time the
+       host spent blocked reading responses, and how much of that time was
+       lost waiting for read timeouts is listed. Times are in simulated
+       seconds.
+
+       Parameters:
+       logger (log, optional): The log to write the summary to, if None the
+            summary is printed.
+
+       Returns:
+       dict: Dictionary of instrument name keys and dictionary values of the
+            instrument statistics.
+    """
+
+    summary = {}
+    lines = ['{:<12}{:>10}{:>12}{:>12}{:>10}'.format('instrument', 'commands',
+             'blocked(s)', 'timeout(s)', 'busy(s)')]
+    for name in sorted(instruments):
+        stats = dict(instruments[name].stats)
+        summary[name] = stats
+        lines.append('{:<12}{:>10}{:>12.1f}{:>12.1f}{:>10.1f}'.format(name,
+                     stats['commands'], stats['blocked'], stats['timeout'],
+                     stats['busy']))
+    lines.append('simulated time ' + '{:.1f}'.format(clock.time()) + ' s')
+
+    for line in lines:
+        if logger is None:
+            print(line)
+        else:
+            logger.info('sim::' + line)
+
+    return summary
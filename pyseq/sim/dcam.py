@@ -0,0 +1,523 @@
+#!/usr/bin/python
+"""Simulated DCAM library for the Hamamatsu TDI cameras.
+
+DCAMAPI has the same functions as the dcamapi dll that pyseq.dcam calls
+through ctypes, so it can replace the dll with pyseq.dcam.setLibrary.
+Arguments are the same ctypes objects the dll receives, values are returned
+through the byref() arguments.
+
+In TDI mode, frames are triggered by the simulated ystage through the
+simulated FPGA, 1 line every 75 ystage steps after the FPGA is armed. If
+there is no simulated ystage the camera runs at a fixed line rate. Each
+frame is bundle lines x 4096 px and is read out as it is completed.
+
+Examples:
+    #Use the simulated cameras
+    >>>from pyseq import dcam
+    >>>from pyseq.sim import dcam as simdcam
+    >>>dcam.setLibrary(simdcam.DCAMAPI())
+    >>>cam = dcam.HamamatsuCamera(0)
+"""
+
+import ctypes
+import random
+import numpy as np
+
+from .. import sim
+
+
+DCAMERR_ERROR = 0
+DCAMERR_NOERROR = 1
+
+DCAMPROP_ATTR_HASVALUETEXT = 0x10000000
+DCAMPROP_ATTR_READABLE = 0x00010000
+DCAMPROP_ATTR_WRITABLE = 0x00020000
+DCAMPROP_OPTION_NEXT = 0x01000000
+DCAMPROP_TYPE_MODE = 1
+DCAMPROP_TYPE_LONG = 2
+DCAMPROP_TYPE_REAL = 3
+
+STATUS_BUSY = 1
+STATUS_READY = 2
+STATUS_STABLE = 3
+
+# name, id, type, min, max, default, writable, text values
+PROPERTIES = [
+    ('EXPOSURE TIME', 0x001F0110, DCAMPROP_TYPE_REAL, 0.0, 100.0, 0.04, True, None),
+    ('BINNING', 0x00401110, DCAMPROP_TYPE_MODE, 1, 4, 1, True,
+     {b'1x1': 1, b'2x2': 2, b'4x4': 4}),
+    ('SENSOR MODE', 0x00400210, DCAMPROP_TYPE_MODE, 1, 6, 4, True,
+     {b'AREA': 1, b'LINE': 2, b'TDI': 4, b'PARTIAL AREA': 6}),
+    ('SENSOR MODE LINE BUNDLE HEIGHT', 0x00400250, DCAMPROP_TYPE_LONG, 1, 256, 128,
+     True, None),
+    ('TRIGGER MODE', 0x00100210, DCAMPROP_TYPE_MODE, 1, 8, 1, True,
+     {b'NORMAL': 1, b'PIV': 3, b'MULTIGATE': 7, b'MULTIFRAME': 8}),
+    ('TRIGGER POLARITY', 0x00100220, DCAMPROP_TYPE_MODE, 1, 2, 1, True,
+     {b'NEGATIVE': 1, b'POSITIVE': 2}),
+    ('TRIGGER CONNECTOR', 0x00100230, DCAMPROP_TYPE_MODE, 1, 2, 1, True,
+     {b'INTERFACE': 1, b'BNC': 2}),
+    ('TRIGGER SOURCE', 0x00100110, DCAMPROP_TYPE_MODE, 1, 4, 1, True,
+     {b'INTERNAL': 1, b'EXTERNAL': 2, b'SOFTWARE': 3}),
+    ('CONTRAST GAIN', 0x00402180, DCAMPROP_TYPE_LONG, 0, 10, 0, True, None),
+    ('DEFECT CORRECT MODE', 0x00470010, DCAMPROP_TYPE_MODE, 1, 2, 2, True,
+     {b'OFF': 1, b'ON': 2}),
+    ('READOUT SPEED', 0x00400110, DCAMPROP_TYPE_LONG, 1, 2, 2, True, None),
+    ('SUBARRAY HPOS', 0x00402110, DCAMPROP_TYPE_LONG, 0, 4095, 0, True, None),
+    ('SUBARRAY HSIZE', 0x00402120, DCAMPROP_TYPE_LONG, 1, 4096, 4096, True, None),
+    ('SUBARRAY VPOS', 0x00402130, DCAMPROP_TYPE_LONG, 0, 127, 0, True, None),
+    ('SUBARRAY VSIZE', 0x00402140, DCAMPROP_TYPE_LONG, 1, 256, 128, True, None),
+    ('SUBARRAY MODE', 0x00402150, DCAMPROP_TYPE_MODE, 1, 2, 1, True,
+     {b'OFF': 1, b'ON': 2}),
+    ('OUTPUT TRIGGER KIND[0]', 0x001C0260, DCAMPROP_TYPE_MODE, 1, 4, 1, True,
+     {b'LOW': 1, b'EXPOSURE': 2, b'PROGRAMABLE': 3, b'TRIGGER READY': 4}),
+    ('INTERNAL FRAME RATE', 0x00403810, DCAMPROP_TYPE_REAL, 0.0, 1000.0, 16.0,
+     False, None),
+    ('TIMING READOUT TIME', 0x00403010, DCAMPROP_TYPE_REAL, 0.0, 1.0, 0.0005,
+     False, None),
+    ('IMAGE WIDTH', 0x00420210, DCAMPROP_TYPE_LONG, 1, 4096, 4096, False, None),
+    ('IMAGE HEIGHT', 0x00420220, DCAMPROP_TYPE_LONG, 1, 4096, 128, False, None),
+    ('IMAGE FRAMEBYTES', 0x00420240, DCAMPROP_TYPE_LONG, 0, 2**31, 0, False, None),
+    ('BUFFER ROWBYTES', 0x00420050, DCAMPROP_TYPE_LONG, 0, 2**31, 8192, False, None),
+    ('BUFFER FRAMEBYTES', 0x00420040, DCAMPROP_TYPE_LONG, 0, 2**31, 0, False, None),
+    ]
+
+
+def _obj(arg):
+    """Return the ctypes object passed by byref."""
+
+    return getattr(arg, '_obj', arg)
+
+
+def _value(arg):
+    """Return the python value of a ctypes argument."""
+
+    return getattr(arg, 'value', arg)
+
+
+class SimCamera():
+    """A simulated Hamamatsu TDI camera.
+
+       Attributes:
+       drop_rate (float): Probability that an acquisition loses frames.
+       line_rate (float): Lines per second if the camera is not triggered by
+            the simulated ystage.
+    """
+
+    texture_rows = 1024
+    line_rate = 2000.0
+
+    def __init__(self, camera_id, clock, instruments):
+        self.camera_id = camera_id
+        self.clock = clock
+        self.instruments = instruments
+        self.properties = {}
+        for name, pid, ptype, pmin, pmax, default, writable, text in PROPERTIES:
+            self.properties[pid] = {'name': name, 'type': ptype, 'min': pmin,
+                                    'max': pmax, 'value': default,
+                                    'writable': writable, 'text': text}
+        self.ids = sorted(self.properties)
+        self.status = STATUS_STABLE
+        self.n_buffers = 0
+        self.user_buffers = None
+        self.capturing = False
+        self.t_start = 0.0
+        self.y_start = None
+        self.first_line = 0                                                     # texture row of the first frame
+        self.count = 0                                                          # frames at last stop
+        self.written = 0                                                        # frames written to user buffers
+        self.waited = 0                                                         # frames seen by dcam_wait
+        self.drop = 0
+        self.drop_rate = 0.0
+        self.last_error = b''
+        self.stats = {'commands': 0, 'blocked': 0.0, 'timeout': 0.0,
+                      'busy': 0.0}
+        self.texture = self.make_texture()
+        self.scratch = None
+        self.update()
+
+
+    def make_texture(self):
+        """Return a 12 bit image of beads on a dim background."""
+
+        rs = np.random.RandomState(self.camera_id)
+        shape = (self.texture_rows, 4096)
+        texture = rs.normal(110, 5, shape)
+        beads = np.zeros(shape)
+        n_beads = 4000
+        beads[rs.randint(0, shape[0], n_beads),
+              rs.randint(0, shape[1], n_beads)] = rs.uniform(200, 1000, n_beads)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                texture += np.roll(np.roll(beads, dy, 0), dx, 1)
+        return np.clip(texture, 0, 4095).astype(np.uint16)
+
+
+    def value(self, name):
+        for prop in self.properties.values():
+            if prop['name'] == name:
+                return prop['value']
+
+
+    def set_value(self, name, value):
+        for prop in self.properties.values():
+            if prop['name'] == name:
+                prop['value'] = value
+
+
+    def update(self):
+        """Update the read only properties that depend on other properties."""
+
+        if self.value('SENSOR MODE') == 4:
+            height = self.value('SENSOR MODE LINE BUNDLE HEIGHT')
+        else:
+            height = self.value('SUBARRAY VSIZE')
+        width = self.value('SUBARRAY HSIZE')
+        self.set_value('IMAGE HEIGHT', height)
+        self.set_value('IMAGE WIDTH', width)
+        self.set_value('IMAGE FRAMEBYTES', width * height * 2)
+        self.set_value('BUFFER ROWBYTES', width * 2)
+        self.set_value('BUFFER FRAMEBYTES', width * height * 2)
+        self.width = int(width)
+        self.height = int(height)
+        self.frame_bytes = self.width * self.height * 2
+
+
+    def frames(self, now = None):
+        """Return the number of frames transferred from the camera."""
+
+        if not self.capturing:
+            return self.count
+        if now is None:
+            now = self.clock.time()
+
+        fpga = self.instruments.get('fpga')
+        if fpga is not None and fpga.arm is not None and self.y_start is not None:
+            lines = fpga.tdi_lines(self.y_start, now)
+            limit = fpga.arm[0] // self.height - self.drop
+            n = min(lines // self.height, limit)
+        else:
+            n = int((now - self.t_start) * self.line_rate / self.height)
+
+        return max(0, n)
+
+
+    def frame(self, n):
+        """Return frame n of the acquisition as a contiguous array."""
+
+        start = (self.first_line + n * self.height) % self.texture_rows
+        stop = start + self.height
+        if stop <= self.texture_rows and self.width == 4096:
+            return self.texture[start:stop]
+        rows = np.arange(start, stop) % self.texture_rows
+        return np.ascontiguousarray(self.texture[rows, 0:self.width])
+
+
+    def write_user_buffers(self, now = None):
+        """Copy frames that arrived into the attached user buffers."""
+
+        if self.user_buffers is None:
+            return
+        count = self.frames(now)
+        pixels = self.width * self.height
+        for n in range(self.written, count):
+            address = self.user_buffers[n % self.n_buffers]
+            buffer = (ctypes.c_uint16 * pixels).from_address(address)
+            np.copyto(np.frombuffer(buffer, dtype = np.uint16).reshape(
+                          self.height, self.width),
+                      self.frame(n))                                            # frame(n) may be a temporary copy
+        self.written = count
+
+
+    def start(self):
+        now = self.clock.time()
+        self.capturing = True
+        self.status = STATUS_BUSY
+        self.t_start = now
+        self.written = 0
+        self.waited = 0
+        y = self.instruments.get('ystage')
+        self.y_start = None if y is None else y.axis.position(now)
+        fpga = self.instruments.get('fpga')
+        if self.y_start is not None and fpga is not None:
+            self.first_line = int(round(-self.y_start / fpga.line_steps))       # same stage position, same lines
+        if random.random() < self.drop_rate:
+            self.drop = random.randint(1, 3)
+        else:
+            self.drop = 0
+
+
+    def stop(self):
+        now = self.clock.time()
+        if self.capturing:
+            self.count = self.frames(now)
+            self.write_user_buffers(now)
+            self.capturing = False
+            self.stats['busy'] += now - self.t_start
+        if self.n_buffers:
+            self.status = STATUS_READY
+
+
+class DCAMAPI():
+    """Simulated DCAM library with the functions used by pyseq.dcam."""
+
+    def __init__(self, n_cameras = 2):
+        self.n_cameras = n_cameras
+        self.cameras = {}
+
+
+    def camera(self, handle):
+        camera = self.cameras[_value(handle)]
+        camera.stats['commands'] += 1
+        return camera
+
+
+    def dcam_init(self, instance, n_cameras, option):
+        _obj(n_cameras).value = self.n_cameras
+        return DCAMERR_NOERROR
+
+
+    def dcam_getmodelinfo(self, camera_id, string_id, c_buf, buf_len):
+        c_buf.value = b'C10633-SIM'
+        return DCAMERR_NOERROR
+
+
+    def dcam_open(self, handle, camera_id, option):
+        camera_id = _value(camera_id)
+        if camera_id >= self.n_cameras:
+            return DCAMERR_ERROR
+        camera = SimCamera(camera_id, sim.clock, sim.instruments)
+        sim.instruments['cam' + str(camera_id)] = camera
+        self.cameras[camera_id + 1] = camera
+        _obj(handle).value = camera_id + 1
+        return DCAMERR_NOERROR
+
+
+    def dcam_close(self, handle):
+        self.cameras.pop(_value(handle), None)
+        return DCAMERR_NOERROR
+
+
+    def dcam_getlasterror(self, handle, c_buf, buf_len):
+        camera = self.cameras.get(_value(handle))
+        c_buf.value = b'' if camera is None else camera.last_error
+        return DCAMERR_NOERROR
+
+
+    def dcam_getnextpropertyid(self, handle, prop_id, option):
+        camera = self.camera(handle)
+        prop_id = _obj(prop_id)
+        if _value(option) == DCAMPROP_OPTION_NEXT:
+            for pid in camera.ids:
+                if pid > prop_id.value:
+                    prop_id.value = pid
+                    return DCAMERR_NOERROR
+            return DCAMERR_ERROR
+        return DCAMERR_NOERROR
+
+
+    def dcam_getpropertyname(self, handle, prop_id, c_buf, buf_len):
+        camera = self.camera(handle)
+        c_buf.value = camera.properties[_value(prop_id)]['name'].encode()
+        return DCAMERR_NOERROR
+
+
+    def dcam_getpropertyattr(self, handle, p_attr):
+        camera = self.camera(handle)
+        p_attr = _obj(p_attr)
+        prop = camera.properties.get(p_attr.iProp)
+        if prop is None:
+            return DCAMERR_ERROR
+        attribute = prop['type'] | DCAMPROP_ATTR_READABLE
+        if prop['writable']:
+            attribute |= DCAMPROP_ATTR_WRITABLE
+        if prop['text'] is not None:
+            attribute |= DCAMPROP_ATTR_HASVALUETEXT
+        p_attr.attribute = attribute
+        p_attr.valuemin = prop['min']
+        p_attr.valuemax = prop['max']
+        p_attr.valuestep = 1
+        p_attr.valuedefault = prop['value']
+        return DCAMERR_NOERROR
+
+
+    def dcam_getpropertyvalue(self, handle, prop_id, value):
+        camera = self.camera(handle)
+        _obj(value).value = camera.properties[_value(prop_id)]['value']
+        return DCAMERR_NOERROR
+
+
+    def dcam_setgetpropertyvalue(self, handle, prop_id, value, option = 0):
+        camera = self.camera(handle)
+        prop = camera.properties[_value(prop_id)]
+        value = _obj(value)
+        if not prop['writable'] or camera.status == STATUS_BUSY:
+            camera.last_error = b'invalid property'
+            return DCAMERR_ERROR
+        v = min(max(value.value, prop['min']), prop['max'])
+        if prop['type'] != DCAMPROP_TYPE_REAL:
+            v = int(round(v))
+        prop['value'] = v
+        value.value = v
+        camera.update()
+        return DCAMERR_NOERROR
+
+
+    def dcam_getpropertyvaluetext(self, handle, prop_text):
+        camera = self.camera(handle)
+        prop_text = _obj(prop_text)
+        prop = camera.properties[prop_text.iProp]
+        text = b''
+        for key, v in (prop['text'] or {}).items():
+            if v == int(prop_text.value):
+                text = key
+        offset = type(prop_text).text.offset
+        address = ctypes.c_void_p.from_buffer(prop_text, offset).value
+        text = text[:prop_text.textbytes - 1] + b'\x00'
+        ctypes.memmove(address, text, len(text))
+        return DCAMERR_NOERROR
+
+
+    def dcam_querypropertyvalue(self, handle, prop_id, value, option):
+        camera = self.camera(handle)
+        prop = camera.properties[_value(prop_id)]
+        value = _obj(value)
+        values = sorted((prop['text'] or {}).values())
+        for v in values:
+            if v > value.value:
+                value.value = v
+                return DCAMERR_NOERROR
+        return DCAMERR_ERROR
+
+
+    def dcam_precapture(self, handle, mode):
+        self.camera(handle)
+        return DCAMERR_NOERROR
+
+
+    def dcam_allocframe(self, handle, n_frames):
+        camera = self.camera(handle)
+        if camera.status == STATUS_BUSY:
+            return DCAMERR_ERROR
+        camera.n_buffers = _value(n_frames)
+        camera.scratch = np.empty(camera.frame_bytes // 2, dtype = np.uint16)
+        camera.status = STATUS_READY
+        return DCAMERR_NOERROR
+
+
+    def dcam_attachbuffer(self, handle, buffers, size):
+        camera = self.camera(handle)
+        camera.n_buffers = _value(size) // ctypes.sizeof(ctypes.c_void_p)
+        camera.user_buffers = [buffers[i] for i in range(camera.n_buffers)]
+        camera.status = STATUS_READY
+        return DCAMERR_NOERROR
+
+
+    def dcam_releasebuffer(self, handle):
+        camera = self.camera(handle)
+        camera.stop()
+        camera.user_buffers = None
+        camera.n_buffers = 0
+        camera.status = STATUS_STABLE
+        return DCAMERR_NOERROR
+
+
+    def dcam_freeframe(self, handle):
+        camera = self.camera(handle)
+        camera.stop()
+        camera.n_buffers = 0
+        camera.scratch = None
+        camera.status = STATUS_STABLE
+        return DCAMERR_NOERROR
+
+
+    def dcam_capture(self, handle):
+        camera = self.camera(handle)
+        if camera.status != STATUS_READY:
+            camera.last_error = b'not ready'
+            return DCAMERR_ERROR
+        camera.start()
+        return DCAMERR_NOERROR
+
+
+    def dcam_idle(self, handle):
+        camera = self.camera(handle)
+        camera.stop()
+        return DCAMERR_NOERROR
+
+
+    def dcam_getstatus(self, handle, status):
+        camera = self.camera(handle)
+        _obj(status).value = camera.status
+        return DCAMERR_NOERROR
+
+
+    def dcam_gettransferinfo(self, handle, b_index, f_count):
+        camera = self.camera(handle)
+        count = camera.frames()
+        camera.write_user_buffers()
+        if camera.n_buffers and count:
+            _obj(b_index).value = (count - 1) % camera.n_buffers
+        else:
+            _obj(b_index).value = -1
+        _obj(f_count).value = count
+        return DCAMERR_NOERROR
+
+
+    def dcam_wait(self, handle, event, timeout, option):
+        camera = self.camera(handle)
+        clock = camera.clock
+        start = clock.time()
+        timeout = _value(timeout)
+        deadline = None if timeout < 0 else start + timeout / 1000.0
+        while True:
+            count = camera.frames()
+            if count > camera.waited:
+                camera.waited = count
+                camera.write_user_buffers()
+                result = DCAMERR_NOERROR
+                break
+            if not camera.capturing or (deadline is not None and
+                                         clock.time() >= deadline):
+                camera.last_error = b'timeout'
+                camera.stats['timeout'] += clock.time() - start
+                result = DCAMERR_ERROR
+                break
+            clock.sleep(0.005)
+        camera.stats['blocked'] += clock.time() - start
+        return result
+
+
+    def dcam_lockdata(self, handle, address, row_bytes, frame):
+        camera = self.camera(handle)
+        n = _value(frame)
+        count = camera.frames()
+        if n < 0 or n >= camera.n_buffers or camera.scratch is None:
+            camera.last_error = b'invalid frame index'
+            return DCAMERR_ERROR
+        frame_number = n + camera.n_buffers * max(0, (count - 1 - n) // camera.n_buffers)
+        camera.scratch[:] = camera.frame(frame_number).ravel()
+        _obj(address).value = camera.scratch.ctypes.data
+        _obj(row_bytes).value = camera.width * 2
+        return DCAMERR_NOERROR
+
+
+    def dcam_unlockdata(self, handle):
+        self.camera(handle)
+        return DCAMERR_NOERROR
+
+
+    def dcam_settriggermode(self, handle, mode):
+        self.camera(handle)
+        return DCAMERR_NOERROR
+
+
+    def dcam_getcapability(self, handle, capability, c):
+        self.camera(handle)
+        _obj(capability).value = 0
+        return DCAMERR_NOERROR
+
+
+    def dcam_getstring(self, handle, string_id, c_buf, buf_len):
+        self.camera(handle)
+        c_buf.value = b''
+        return DCAMERR_NOERROR
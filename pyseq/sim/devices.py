@@ -0,0 +1,722 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Simulated serial instruments
+
+Each simulated instrument parses the same command grammar as the real
+instrument and answers with the same response format. Responses become
+available after the time it takes to transmit the command and the response
+at the baudrate of the port, plus any time the real instrument takes before
+it answers. Moves, strokes, and filter changes take the time predicted by a
+motion model of the instrument.
+
+===========  ===================  =====================================
+instrument   command set          motion model
+===========  ===================  =====================================
+xstage       Schneider MCode      trapezoid, VI, VM, A, D
+ystage       Parker ViX           trapezoid, V, A (rev/s)
+fpga         HiSeq FPGA           tilt motors, objective, filter wheels
+pump         Kloehn VersaPump3    constant speed strokes
+valve        Vici                 rotation time per port
+laser        Laser                warm up time
+===========  ===================  =====================================
+"""
+
+import math
+import random
+import threading
+from collections import deque
+
+
+class Profile():
+    """Position of an axis moving between 2 positions.
+
+       The axis accelerates from v0 to vmax, cruises, then decelerates back
+       to v0. If the move is too short to reach vmax, the profile is
+       triangular. If accel is None, the axis moves at vmax the whole time.
+    """
+
+    def __init__(self, t0, start, end, vmax, accel = None, decel = None,
+                 v0 = 0.0, settle = 0.0):
+        """Constructor for the profile.
+
+           Parameters:
+           t0 (float): Time the move starts.
+           start (float): Initial position.
+           end (float): Final position.
+           vmax (float): Maximum velocity in units per second.
+           accel (float, optional): Acceleration in units per second**2.
+           decel (float, optional): Deceleration, default is accel.
+           v0 (float, optional): Initial and final velocity.
+           settle (float, optional): Time after the move until the axis is
+                in position.
+        """
+
+        self.t0 = t0
+        self.start = start
+        self.end = end
+        self.direction = 1 if end >= start else -1
+        self.settle = settle
+        distance = abs(end - start)
+
+        if accel is None or distance == 0:
+            self.v0 = self.vp = vmax
+            self.t1 = self.t3 = 0.0
+            self.t2 = distance / vmax if vmax > 0 else 0.0
+            self.a = self.d = 0.0
+        else:
+            if decel is None:
+                decel = accel
+            self.a = accel
+            self.d = decel
+            self.v0 = v0 = min(v0, vmax)
+            s_ramp = (vmax**2 - v0**2) / (2 * accel) + (vmax**2 - v0**2) / (2 * decel)
+            if s_ramp <= distance:
+                self.vp = vmax
+            else:
+                self.vp = math.sqrt(v0**2 + 2 * distance * accel * decel /
+                                    (accel + decel))
+            self.t1 = (self.vp - v0) / accel
+            self.t3 = (self.vp - v0) / decel
+            s1 = (self.vp**2 - v0**2) / (2 * accel)
+            s3 = (self.vp**2 - v0**2) / (2 * decel)
+            self.t2 = (distance - s1 - s3) / self.vp
+
+        self.duration = self.t1 + self.t2 + self.t3
+
+
+    def position(self, t):
+        """Return the position of the axis at time t (float)."""
+
+        t = t - self.t0
+        if t >= self.duration:
+            return self.end
+        if t <= 0:
+            return self.start
+
+        if t < self.t1:
+            s = self.v0 * t + self.a * t**2 / 2
+        elif t < self.t1 + self.t2:
+            s = (self.v0 + self.vp) / 2 * self.t1 + self.vp * (t - self.t1)
+        else:
+            tr = self.duration - t
+            s = abs(self.end - self.start) - (self.v0 * tr + self.d * tr**2 / 2)
+
+        return self.start + self.direction * s
+
+
+    def moving(self, t):
+        """Return True if the axis is moving at time t (float)."""
+
+        return t < self.t0 + self.duration
+
+
+    def in_position(self, t):
+        """Return True if the axis has settled at time t (float)."""
+
+        return t >= self.t0 + self.duration + self.settle
+
+
+class Axis():
+    """A simulated motor axis."""
+
+    def __init__(self, clock, position = 0):
+        self.clock = clock
+        self.profile = None
+        self._position = position
+
+
+    def move(self, target, vmax, accel = None, decel = None, v0 = 0.0,
+             settle = 0.0, t0 = None):
+        """Start a move to the target position and return its duration."""
+
+        if t0 is None:
+            t0 = self.clock.time()
+        start = self.position(t0)
+        self.profile = Profile(t0, start, target, vmax, accel, decel, v0,
+                               settle)
+        return self.profile.duration + settle
+
+
+    def position(self, t = None):
+        """Return the position of the axis."""
+
+        if t is None:
+            t = self.clock.time()
+        if self.profile is None:
+            return self._position
+        return self.profile.position(t)
+
+
+    def set_position(self, position):
+        """Redefine the current position of a stopped axis."""
+
+        self.profile = None
+        self._position = position
+
+
+    def moving(self, t = None):
+        if t is None:
+            t = self.clock.time()
+        return self.profile is not None and self.profile.moving(t)
+
+
+    def in_position(self, t = None):
+        if t is None:
+            t = self.clock.time()
+        return self.profile is None or self.profile.in_position(t)
+
+
+class SerialDevice():
+    """Base class of the simulated serial instruments.
+
+       Subclasses implement handle(), which is called with each command line
+       received from the host and returns the response text or None if the
+       instrument does not answer.
+
+       Attributes:
+       terminator (bytes): End of line character of commands.
+       latency (float): Time in seconds the instrument takes to answer.
+       stats (dict): Number of commands, time the host was blocked reading,
+            time lost to read timeouts, and time the instrument was busy.
+            Reads that time out without any data are not counted.
+    """
+
+    terminator = b'\r'
+    latency = 0.002
+
+    def __init__(self, name, clock, instruments):
+        self.name = name
+        self.clock = clock
+        self.instruments = instruments
+        self.baudrate = 9600
+        self.rx = bytearray()
+        self.tx = deque()                                                       # (time available, bytes)
+        self.tx_time = 0.0                                                      # time last response is sent
+        self.lock = threading.Condition()
+        self.stats = {'commands': 0, 'blocked': 0.0, 'timeout': 0.0,
+                      'busy': 0.0}
+
+
+    def byte_time(self, n_bytes):
+        """Return the time in seconds to transmit n_bytes (int)."""
+
+        return n_bytes * 10.0 / self.baudrate
+
+
+    def receive(self, data):
+        """Receive bytes written by the host."""
+
+        with self.lock:
+            self.rx += data
+            while self.terminator in self.rx:
+                line, _, rest = bytes(self.rx).partition(self.terminator)
+                self.rx = bytearray(rest)
+                now = self.clock.time() + self.byte_time(len(line) + 1)
+                self.stats['commands'] += 1
+                response = self.handle(line.decode('ascii', 'ignore'), now)
+                if response is not None:
+                    self.respond(response, now)
+
+
+    def respond(self, text, now, delay = 0.0):
+        """Queue a response, it is sent after the latency and delay.
+
+           Responses are sent in the order they were queued.
+        """
+
+        data = text.encode('ascii')
+        start = max(now + self.latency + delay, self.tx_time)
+        self.tx_time = start + self.byte_time(len(data))
+        self.tx.append([self.tx_time, data])
+        self.lock.notify_all()
+
+
+    def available(self, now):
+        """Return the number of bytes that have arrived at the host."""
+
+        return sum(len(d) for t, d in self.tx if t <= now)
+
+
+    def clear(self):
+        """Discard responses that have not been read."""
+
+        with self.lock:
+            self.tx.clear()
+
+
+    def read(self, size, timeout):
+        """Read size bytes like pyserial, block until size bytes or timeout.
+
+           Parameters:
+           size (int): Number of bytes to read.
+           timeout (float): Read timeout in seconds, None blocks until size
+                bytes are read, 0 returns immediately.
+
+           Returns:
+           bytes: The bytes read.
+        """
+
+        start = self.clock.time()
+        deadline = None if timeout is None else start + timeout
+        last = start                                                            # time last byte arrived
+        data = bytearray()
+        with self.lock:
+            while True:
+                now = self.clock.time()
+                while self.tx and self.tx[0][0] <= now and len(data) < size:
+                    t, chunk = self.tx[0]
+                    last = max(last, t)
+                    n = size - len(data)
+                    data += chunk[:n]
+                    if n >= len(chunk):
+                        self.tx.popleft()
+                    else:
+                        self.tx[0][1] = chunk[n:]
+                next_t = self.tx[0][0] if self.tx else None
+
+                if len(data) >= size or timeout == 0:
+                    break
+                if deadline is not None and now >= deadline:
+                    if data:                                                    # Idle reads are not counted
+                        self.stats['timeout'] += deadline - last
+                    break
+
+                # Wait for the next byte, the deadline, or a new response
+                wake = [t for t in (next_t, deadline) if t is not None]
+                if wake:
+                    self.lock.wait((min(wake) - now) / self.clock.speedup)
+                else:
+                    self.lock.wait()
+
+            if data:
+                self.stats['blocked'] += self.clock.time() - start
+
+        return bytes(data)
+
+
+    def handle(self, line, now):
+        raise NotImplementedError
+
+
+class XstageSim(SerialDevice):
+    """Simulated xstage, Schneider Electric MCode.
+
+       EM=0 echoes every command, EM=2 only answers print (PR) commands.
+       Lines between PG 1 and PG are stored as a program and executed with
+       EX 1. The only program the HiSeq uses homes the stage to 30000.
+    """
+
+    terminator = b'\r'
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.axis = Axis(clock, 0)
+        self.echo_mode = 0
+        self.params = {'VI': 1000, 'VM': 768000, 'A': 1000000, 'D': 1000000}
+        self.program = None
+        self.home_position = 30000
+
+
+    def start_move(self, target, now):
+        p = self.params
+        duration = self.axis.move(target, p['VM'], p['A'], p['D'], p['VI'],
+                                  t0 = now)
+        self.stats['busy'] += duration
+
+
+    def handle(self, line, now):
+        line = line.strip()
+        reply = None
+        if self.echo_mode == 0 and line != '\x03':
+            reply = line + '\r\n'
+
+        if line == '\x03':                                                      # Reset
+            self.echo_mode = 0
+            self.program = None
+            return 'Copyright 2001-2010 by Schneider Electric Motion USA\r\n'
+
+        if self.program is not None:                                            # Program mode
+            if line.replace(' ', '') == 'PG':
+                self.program = None
+            else:
+                self.program.append(line)
+            return None
+
+        cmd = line.replace(' ', '')
+        if cmd.startswith('PG'):
+            self.program = []
+            return None
+        elif cmd.startswith('EX'):
+            # Home to the flag, then redefine position
+            self.start_move(self.home_position, now)
+            return None
+        elif cmd.startswith('PR'):
+            arg = cmd[2:]
+            if arg == 'MV':
+                value = int(self.axis.moving(now))
+            elif arg == 'P':
+                value = int(round(self.axis.position(now)))
+            else:
+                value = self.params.get(arg, 0)
+            return str(value) + '\r\n'
+        elif cmd.startswith('MA'):
+            self.start_move(int(cmd[2:]), now)
+        elif cmd.startswith('MR'):
+            self.start_move(self.axis.position(now) + int(cmd[2:]), now)
+        elif cmd.startswith('EM='):
+            self.echo_mode = int(cmd[3:])
+        elif cmd.startswith('P='):
+            self.axis.set_position(int(cmd[2:]))
+        elif '=' in cmd:
+            key, value = cmd.split('=', 1)
+            try:
+                self.params[key] = int(value)
+            except ValueError:
+                self.params[key] = value
+
+        return reply
+
+
+class YstageSim(SerialDevice):
+    """Simulated ystage, Parker ViX 250IH.
+
+       Commands are prefixed with the axis address and terminated with CR LF.
+       With echo on, commands are echoed. With echo off (W(EX,0)), only
+       report commands R(...) are answered with *value.
+    """
+
+    terminator = b'\n'
+    counts_per_rev = 1000000                                                    # 10 nm steps, 10 mm lead
+    settle = {'imaging': 0.05, 'moving': 0.2}
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.axis = Axis(clock, 0)
+        self.echo = True
+        self.on = False
+        self.velocity = 1.0                                                     # rev/s
+        self.accel = 10.0                                                       # rev/s**2
+        self.gains = 'moving'
+        self.distance = 0
+
+
+    def handle(self, line, now):
+        line = line.strip()
+        cmd = line[1:]                                                          # Remove address
+        reply = line + '\r\n' if self.echo else None
+
+        if cmd == 'Z':
+            self.echo = True
+            self.on = False
+            reply = 'ViX250IH\r\n'
+        elif cmd.startswith('W(EX,'):
+            self.echo = cmd[5] != '0'
+        elif cmd.startswith('GAINS('):
+            gains = cmd[6:-1].split(',')
+            self.gains = 'imaging' if gains[2] == '5' else 'moving'
+        elif cmd == 'ON':
+            self.on = True
+        elif cmd == 'OFF':
+            self.on = False
+        elif cmd.startswith('V'):
+            self.velocity = float(cmd[1:])
+        elif cmd.startswith('A') and cmd[1:].replace('.', '').isdigit():
+            self.accel = float(cmd[1:])
+        elif cmd.startswith('D'):
+            self.distance = int(cmd[1:])
+        elif cmd == 'G' or cmd == 'GH':
+            if self.on:
+                target = 0 if cmd == 'GH' else self.distance
+                cpr = self.counts_per_rev
+                duration = self.axis.move(target, self.velocity * cpr,
+                                          self.accel * cpr,
+                                          settle = self.settle[self.gains],
+                                          t0 = now)
+                self.stats['busy'] += duration
+        elif cmd == 'R(IP)':
+            reply = '*' + str(int(self.axis.in_position(now))) + '\r\n'
+        elif cmd == 'R(PA)':
+            reply = '*' + str(int(round(self.axis.position(now)))) + '\r\n'
+
+        return reply
+
+
+class FPGASim(SerialDevice):
+    """Simulated FPGA with the zstage, objective stage, and optics.
+
+       Every command is answered with the command, queries are answered with
+       the command and the value. Filter wheel commands are answered after
+       the filter wheel stops.
+    """
+
+    terminator = b'\n'
+    y_offset = 7000000
+    line_steps = 75                                                             # ystage steps per TDI line
+    tilt_speed = 2000                                                           # tilt motor steps/s
+    obj_spmm = 262000                                                           # objective steps/mm
+    obj_units = 1288471                                                         # ZSTEP units per mm/s
+    wheel_speed = 400                                                           # filter wheel steps/s
+    wheel_home = 0.5                                                            # s
+    em_time = 0.3                                                               # s
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.latency = 0.001
+        self.encoder_shift = 0
+        self.tilt = [Axis(clock, 0) for i in range(3)]
+        self.tilt_error = [0, 0, 0]
+        self.obj = Axis(clock, 30000)
+        self.obj_v = 5.0                                                        # mm/s
+        self.ex = [0, 0]
+        self.em_in = True
+        self.shutter = False
+        self.tdi_pos = 0
+        self.arm = None                                                         # [n triggers, y position]
+
+
+    def ystage(self):
+        return self.instruments.get('ystage')
+
+
+    def encoder(self, now):
+        """Return the TDI encoder position."""
+
+        y = self.ystage()
+        y = 0 if y is None else y.axis.position(now)
+        return int(round(y)) + self.y_offset + self.encoder_shift
+
+
+    def tdi_lines(self, y_start, now):
+        """Return number of TDI lines triggered since the ystage was at
+           y_start (int).
+        """
+
+        if self.arm is None:
+            return 0
+        y = self.ystage()
+        if y is None:
+            return 0
+        lines = int((y_start - y.axis.position(now)) / self.line_steps)
+        return max(0, min(lines, self.arm[0]))
+
+
+    def handle(self, line, now):
+        line = line.strip()
+        words = line.split(' ')
+        cmd = words[0]
+        delay = 0.0
+        reply = line
+
+        if cmd == 'RESET':
+            self.arm = None
+            self.shutter = False
+        elif cmd == 'TDIYERD':
+            reply = cmd + ' ' + str(self.encoder(now))
+        elif cmd == 'TDIYEWR':
+            self.encoder_shift += int(words[1]) - self.encoder(now)
+        elif cmd == 'TDIYPOS':
+            self.tdi_pos = int(words[1])
+        elif cmd == 'TDIYARM3':
+            self.arm = [int(words[1]), int(words[2])]
+        elif cmd == 'TDICLINES' or cmd == 'TDIPULSES':
+            n = 0 if self.arm is None else self.arm[0]
+            reply = cmd + ' ' + str(n)
+        elif cmd == 'SWLSRSHUT':
+            self.shutter = words[1] == '1'
+        elif len(cmd) > 2 and cmd[0] == 'T' and cmd[1] in '123':
+            i = int(cmd[1]) - 1
+            action = cmd[2:]
+            if action == 'RD':
+                pos = int(round(self.tilt[i].position(now)))
+                if not self.tilt[i].moving(now):
+                    pos += self.tilt_error[i]
+                reply = cmd + ' ' + str(pos)
+            elif action == 'HM' or action == 'MOVETO':
+                target = 0 if action == 'HM' else int(words[1])
+                self.tilt_error[i] = random.randint(-2, 2)                      # Tilt motors are not precise
+                duration = self.tilt[i].move(target, self.tilt_speed, t0 = now)
+                self.stats['busy'] += duration
+            elif action == 'CR':
+                self.tilt[i].set_position(0)
+                self.tilt_error[i] = 0
+        elif cmd == 'ZMV':
+            duration = self.obj.move(int(words[1]), self.obj_v * self.obj_spmm,
+                                     settle = 0.01, t0 = now)
+            self.stats['busy'] += duration
+        elif cmd == 'ZDACR':
+            reply = cmd + ' ' + str(int(round(self.obj.position(now))))
+        elif cmd == 'ZSTEP':
+            self.obj_v = int(words[1]) / self.obj_units
+        elif cmd in ('EX1HM', 'EX2HM'):
+            self.ex[int(cmd[2]) - 1] = 0
+            delay = self.wheel_home
+        elif cmd in ('EX1MV', 'EX2MV'):
+            i = int(cmd[2]) - 1
+            steps = int(words[1])
+            self.ex[i] += steps
+            delay = abs(steps) / self.wheel_speed
+        elif cmd in ('EM2I', 'EM2O'):
+            self.em_in = cmd == 'EM2I'
+            delay = self.em_time
+
+        self.stats['busy'] += delay
+        self.respond(reply + '\n', now, delay)
+
+        return None
+
+
+class PumpSim(SerialDevice):
+    """Simulated Kloehn VersaPump3.
+
+       Responses are /0, a status byte (` ready, @ busy), data, ETX, CR LF.
+       Commands are only executed if the pump is ready and end with R.
+    """
+
+    terminator = b'\r'
+    steps = 48000
+    valve_time = 0.25                                                           # s
+    init_time = 1.5                                                             # s
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.axis = Axis(clock, 0)
+        self.busy_until = 0.0
+        self.speed = 1000                                                       # steps/s
+        self.valve = 'I'
+
+
+    def status(self, now):
+        return '@' if now < self.busy_until else '`'
+
+
+    def handle(self, line, now):
+        cmd = line.strip()[2:]                                                  # Remove /1
+        if cmd == '':
+            return '/0' + self.status(now) + '\x03\r\n'
+        if cmd == '?':
+            pos = int(round(self.axis.position(now)))
+            return '/0' + self.status(now) + str(pos) + '\x03\r\n'
+        if now < self.busy_until:
+            return '/0O\x03\r\n'                                                # Command overflow
+
+        # Parse commands, a letter followed by an optional number
+        t = now
+        i = 0
+        while i < len(cmd):
+            c = cmd[i]
+            j = i + 1
+            while j < len(cmd) and (cmd[j].isdigit()):
+                j += 1
+            arg = int(cmd[i+1:j]) if j > i + 1 else None
+            if c == 'W':
+                self.axis.move(0, self.steps / self.init_time, t0 = t)
+                t += self.init_time
+            elif c in 'IO':
+                if c != self.valve:
+                    t += self.valve_time
+                self.valve = c
+            elif c == 'V':
+                self.speed = arg
+            elif c == 'A':
+                t += self.axis.move(min(max(arg, 0), self.steps), self.speed,
+                                    t0 = t)
+            elif c == 'R':
+                pass
+            else:
+                return '/0B\x03\r\n'                                            # Invalid command
+            i = j
+
+        self.stats['busy'] += t - now
+        self.busy_until = t
+
+        return '/0' + self.status(now) + '\x03\r\n'
+
+
+class ValveSim(SerialDevice):
+    """Simulated Vici multiposition valve.
+
+       Responses are terminated with CR. GO commands are not answered. While
+       the valve is moving, CP answers with the port the rotor is passing.
+    """
+
+    terminator = b'\r'
+    port_time = 0.11                                                            # s per port
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.n_ports = 24 if '24' in name else 10
+        self.axis = Axis(clock, 1)
+
+
+    def handle(self, line, now):
+        cmd = line.strip()
+        if cmd == 'ID':
+            return 'ID = not used\r'
+        elif cmd == 'NP':
+            return 'NP = ' + str(self.n_ports) + '\r'
+        elif cmd == 'CP':
+            return 'Position is = ' + str(int(round(self.axis.position(now)))) + '\r'
+        elif cmd.startswith('GO'):
+            target = int(cmd[2:])
+            current = int(self.axis.position(now))
+            steps = abs(target - current)
+            steps = min(steps, self.n_ports - steps)                            # Shortest way around
+            duration = steps * self.port_time
+            if duration > 0:
+                self.axis.move(target, abs(target - current) / duration,
+                               t0 = now)
+            self.stats['busy'] += duration
+            return None
+        return 'Bad command\r'
+
+
+class LaserSim(SerialDevice):
+    """Simulated laser, responses are terminated with CR LF."""
+
+    terminator = b'\r'
+    warm_up = 0.5                                                               # s
+
+    def __init__(self, name, clock, instruments):
+        SerialDevice.__init__(self, name, clock, instruments)
+        self.on_time = None
+        self.power = 0
+
+
+    def handle(self, line, now):
+        cmd = line.strip()
+        if cmd == 'VERSION?':
+            return 'SIM-1.0\r\n'
+        elif cmd == 'STAT?':
+            enabled = self.on_time is not None and now >= self.on_time
+            return ('ENABLED' if enabled else 'DISABLED') + '\r\n'
+        elif cmd == 'POWER?':
+            return str(int(self.power)) + 'mW\r\n'
+        elif cmd == 'ON':
+            if self.on_time is None:
+                self.on_time = now + self.warm_up
+                self.stats['busy'] += self.warm_up
+        elif cmd == 'OFF':
+            self.on_time = None
+        elif cmd.startswith('POWER='):
+            self.power = float(cmd[6:])
+        else:
+            return 'ERROR\r\n'
+        return None
+
+
+def make_device(name, clock, instruments):
+    """Return a new simulated instrument for the instrument name (str)."""
+
+    if name == 'xstage':
+        return XstageSim(name, clock, instruments)
+    elif name == 'ystage':
+        return YstageSim(name, clock, instruments)
+    elif name == 'fpga':
+        return FPGASim(name, clock, instruments)
+    elif name.startswith('pump'):
+        return PumpSim(name, clock, instruments)
+    elif name.startswith('valve'):
+        return ValveSim(name, clock, instruments)
+    elif name.startswith('laser'):
+        return LaserSim(name, clock, instruments)
+    else:
+        raise ValueError('No simulated instrument named ' + str(name))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+"""pyserial protocol handler for simulated instruments.
+
+URL format: sim://<instrument>, for example sim://xstage or sim://pumpA.
+pyserial loads this module when pyseq.sim is imported and a sim:// url is
+opened with serial.serial_for_url.
+"""
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+from serial.serialutil import to_bytes
+
+from .. import sim
+
+
+class Serial(SerialBase):
+    """Serial port connected to a simulated instrument."""
+
+    def __init__(self, *args, **kwargs):
+        self.device = None
+        SerialBase.__init__(self, *args, **kwargs)
+
+
+    def open(self):
+        """Connect to the simulated instrument named in the port url."""
+
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException('Port must be configured before it can be used.')
+        if not self._port.lower().startswith('sim://'):
+            raise SerialException('expected a string in the form '
+                                  '"sim://<instrument>": ' + str(self._port))
+
+        self.device = sim.get_instrument(self._port[6:])
+        self._reconfigure_port()
+        self.is_open = True
+
+
+    def _reconfigure_port(self):
+        if self.device is not None:
+            self.device.baudrate = self._baudrate
+
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes that have arrived from the instrument."""
+
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.device.available(self.device.clock.time())
+
+
+    def read(self, size = 1):
+        """Read size bytes, block until size bytes are read or timeout."""
+
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.device.read(size, self._timeout)
+
+
+    def write(self, data):
+        """Send data to the instrument and return the number of bytes sent."""
+
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = to_bytes(data)
+        self.device.receive(data)
+        return len(data)
+
+
+    def reset_input_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        self.device.clear()
+
+
+    def reset_output_buffer(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+
+
+    def send_break(self, duration = 0.25):
+        pass
+
+
+    def _update_break_state(self):
+        pass
+
+
+    def _update_rts_state(self):
+        pass
+
+
+    def _update_dtr_state(self):
+        pass
+
+
+    @property
+    def cts(self):
+        return True
+
+
+    @property
+    def dsr(self):
+        return True
+
+
+    @property
+    def ri(self):
+        return False
+
+
+    @property
+    def cd(self):
+        return True
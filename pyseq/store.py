@@ -0,0 +1,450 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Experiment Store
+
+Stores all of the images of an experiment in one chunked array, indexed by
+section, cycle, channel, z, y, and x, instead of one TIFF per channel per
+strip per z plane.
+
+The array is a directory in the Zarr (v2) layout. The shape, chunk size,
+data type and compression are in the .zarray file, and each chunk is a
+separate zlib compressed file named by its chunk indices, for example
+0.1.2.0.3.1. The section, cycle, channel and z labels are kept in the order
+they were first written in the .zattrs file, so the store can be opened by
+zarr or xarray as well as by this module. Strips are placed side by side in
+x and the array grows as images are written.
+
+With scales, downsampled previews of each image are also written into
+stores next to the store, for example images_2x.zarr, images_4x.zarr and
+images_8x.zarr for images.zarr.
+
+Examples:
+    #Create a store in the experiment directory
+    >>>import pyseq
+    >>>store = pyseq.store.ExperimentStore('experiment/images.zarr')
+    #Write the 558 nm channel of a strip of section A_1 in cycle 1
+    >>>store.write(image, 'A_1', 1, 558, 30000, x = 2048)
+    #Read the top 1024 rows of the section
+    >>>store.read('A_1', 1, 558, 30000, y = slice(0, 1024))
+    #Read every 4th row and column of all channels of A_1 and B_1 in all cycles
+    >>>store.read(['A_1', 'B_1'], slice(None), slice(None), 30000,
+    ...           y = slice(0, None, 4), x = slice(0, None, 4)).shape
+    (2, 3, 4, 1024, 2048)
+"""
+
+
+import itertools
+import json
+import os
+import threading
+import zlib
+from os.path import exists
+from os.path import join
+from os.path import splitext
+
+import numpy as np
+
+from .writer import pyramid
+
+
+class ExperimentStore():
+    """Chunked image store of an experiment.
+
+       Attributes:
+       path (path): Directory of the store.
+       dims (tuple): Names of the dimensions of the array.
+       chunks (tuple): Rows and columns of each chunk.
+       level (int): zlib compression level, None to store chunks raw.
+       shape (list): Current shape of the array.
+       dtype (str): Data type of the array, set by the first image.
+       labels (dict): List of labels for the section, cycle, channel and z
+            dimensions, the position of a label is its index in the array.
+       n_images (int): Number of images written.
+       n_bytes (int): Number of image bytes written.
+       n_stored (int): Number of chunk bytes written.
+       scales (tuple): Downsampling factors of the preview stores.
+       previews (dict): The preview stores by scale.
+    """
+
+    dims = ('section', 'cycle', 'channel', 'z', 'y', 'x')
+    n_locks = 64
+
+
+    def __init__(self, path, chunks = (1024, 1024), level = 1, scales = ()):
+        """Constructor for the experiment store.
+
+           An existing store at the path is opened, so an experiment can be
+           continued.
+
+           Parameters:
+           path (path): Directory of the store.
+           chunks (tuple, optional): Rows and columns of each chunk.
+           level (int, optional): zlib compression level from 1 (fast) to
+                9 (small), None to store chunks raw.
+           scales (tuple, optional): Increasing downsampling factors of
+                previews, each a multiple of the one before, see
+                pyseq.writer.pyramid().
+
+           Returns:
+           store object: An experiment store.
+        """
+
+        self.path = path
+        self.chunks = tuple(chunks)
+        self.level = level
+        self.shape = [0] * len(self.dims)
+        self.dtype = None
+        self.labels = {dim: [] for dim in self.dims[0:4]}
+        self.lock = threading.Lock()
+        self.chunk_locks = [threading.Lock() for i in range(self.n_locks)]
+        self.n_images = 0
+        self.n_bytes = 0
+        self.n_stored = 0
+        self.scales = tuple(scales)
+        self.previews = {}
+
+        if exists(join(path, '.zarray')):
+            with open(join(path, '.zarray')) as f:
+                meta = json.load(f)
+            self.shape = meta['shape']
+            self.chunks = tuple(meta['chunks'][4:])
+            self.dtype = meta['dtype']
+            if meta['compressor'] is None:
+                self.level = None
+            else:
+                self.level = meta['compressor']['level']
+            with open(join(path, '.zattrs')) as f:
+                attrs = json.load(f)
+            for dim in self.labels:
+                self.labels[dim] = attrs[dim]
+        else:
+            os.makedirs(path, exist_ok = True)
+
+
+    def index(self, dim, label):
+        """Return the index of a label in a dimension, adding new labels.
+
+           Parameters:
+           dim (str): section, cycle, channel, or z.
+           label: The label, it is stored as a string.
+
+           Returns:
+           int: Index of the label.
+        """
+
+        label = str(label)
+        with self.lock:
+            labels = self.labels[dim]
+            if label not in labels:
+                labels.append(label)
+                self.save_attrs()
+            return labels.index(label)
+
+
+    def save_meta(self):
+        """Write the .zarray metadata of the array."""
+
+        if self.level is None:
+            compressor = None
+        else:
+            compressor = {'id': 'zlib', 'level': self.level}
+        meta = {'zarr_format': 2,
+                'shape': self.shape,
+                'chunks': [1, 1, 1, 1] + list(self.chunks),
+                'dtype': self.dtype,
+                'compressor': compressor,
+                'fill_value': 0,
+                'filters': None,
+                'order': 'C',
+                'dimension_separator': '.'}
+        self.dump(join(self.path, '.zarray'), meta)
+
+
+    def save_attrs(self):
+        """Write the .zattrs labels of the array."""
+
+        attrs = {'_ARRAY_DIMENSIONS': list(self.dims)}
+        attrs.update(self.labels)
+        self.dump(join(self.path, '.zattrs'), attrs)
+
+
+    def dump(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent = 2)
+        os.replace(tmp_path, path)
+
+
+    def write(self, image, section, cycle, channel, z, y = 0, x = 0):
+        """Write an image into the store.
+
+           Safe to call from several threads, for example as the write
+           function of an ImageWriter.
+
+           Parameters:
+           image (array): 2D image to write.
+           section: Label of the section.
+           cycle: Label of the cycle.
+           channel: Label of the channel, usually the emission wavelength.
+           z: Label of the z plane, usually the objective position.
+           y (int, optional): Row of the section the image starts at.
+           x (int, optional): Column of the section the image starts at.
+
+           Returns:
+           int: Number of chunk bytes written.
+        """
+
+        index = [self.index('section', section), self.index('cycle', cycle),
+                 self.index('channel', channel), self.index('z', z)]
+        rows, cols = image.shape
+        with self.lock:
+            if self.dtype is None:
+                self.dtype = np.dtype(image.dtype).str
+            shape = [max(s, i + 1) for s, i in zip(self.shape[0:4], index)]
+            shape += [max(self.shape[4], y + rows), max(self.shape[5], x + cols)]
+            if shape != self.shape:
+                self.shape = shape
+                self.save_meta()
+
+        cy, cx = self.chunks
+        stored = 0
+        for i in range(y // cy, (y + rows - 1) // cy + 1):
+            for j in range(x // cx, (x + cols - 1) // cx + 1):
+                # Part of the chunk covered by the image
+                y0 = max(y, i*cy)
+                y1 = min(y + rows, (i + 1)*cy)
+                x0 = max(x, j*cx)
+                x1 = min(x + cols, (j + 1)*cx)
+                key = '.'.join(str(k) for k in index + [i, j])
+                lock = self.chunk_locks[hash(key) % self.n_locks]
+                with lock:
+                    if y1 - y0 == cy and x1 - x0 == cx:
+                        chunk = image[y0 - y:y1 - y, x0 - x:x1 - x]
+                    else:
+                        chunk = self.read_chunk(key)
+                        chunk[y0 - i*cy:y1 - i*cy, x0 - j*cx:x1 - j*cx] = \
+                            image[y0 - y:y1 - y, x0 - x:x1 - x]
+                    stored += self.write_chunk(key, chunk)
+
+        with self.lock:
+            self.n_images += 1
+            self.n_bytes += image.nbytes
+            self.n_stored += stored
+
+        if self.scales:
+            for scale, preview in zip(self.scales, pyramid(image, self.scales)):
+                stored += self.preview(scale).write(preview, section, cycle,
+                                                    channel, z, y // scale,
+                                                    x // scale)
+
+        return stored
+
+
+    def preview(self, scale):
+        """Return the preview store of a scale (ExperimentStore)."""
+
+        with self.lock:
+            if scale not in self.previews:
+                root, ext = splitext(self.path.rstrip('/\\'))
+                path = root + '_' + str(scale) + 'x' + ext
+                self.previews[scale] = ExperimentStore(path, self.chunks,
+                                                       self.level)
+            return self.previews[scale]
+
+
+    def read_chunk(self, key):
+        """Return a chunk as a writable array, zeros if it is not stored."""
+
+        chunk_path = join(self.path, key)
+        if not exists(chunk_path):
+            return np.zeros(self.chunks, dtype = self.dtype)
+        with open(chunk_path, 'rb') as f:
+            data = f.read()
+        if self.level is not None:
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype = self.dtype).reshape(self.chunks).copy()
+
+
+    def write_chunk(self, key, chunk):
+        """Compress and write a chunk, return the number of bytes written."""
+
+        data = np.ascontiguousarray(chunk, dtype = self.dtype).tobytes()
+        if self.level is not None:
+            data = zlib.compress(data, self.level)
+        chunk_path = join(self.path, key)
+        tmp_path = chunk_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, chunk_path)
+
+        return len(data)
+
+
+    def read(self, section, cycle, channel, z, y = None, x = None):
+        """Read part of the store.
+
+           Each of section, cycle, channel, and z is a single label, a list
+           of labels, or a slice of the labels in the order they were first
+           written. A dimension given a single label is left out of the
+           returned array. Only the chunks that overlap the part are read.
+
+           Parameters:
+           section: Label(s) of the sections.
+           cycle: Label(s) of the cycles.
+           channel: Label(s) of the channels.
+           z: Label(s) of the z planes.
+           y (slice, optional): Rows to read, default is all rows.
+           x (slice, optional): Columns to read, default is all columns.
+
+           Returns:
+           array: The images, zeros where nothing was written. The
+                dimensions are the section, cycle, channel, and z dimensions
+                that were not given a single label, then y and x.
+        """
+
+        indices = []
+        shape = []
+        for dim, labels in zip(self.dims[0:4], (section, cycle, channel, z)):
+            index, keep = self.label_indices(dim, labels)
+            indices.append(index)
+            if keep:
+                shape.append(len(index))
+        rows = range(*(y or slice(None)).indices(self.shape[4]))
+        cols = range(*(x or slice(None)).indices(self.shape[5]))
+        image = np.zeros(shape + [len(rows), len(cols)], dtype = self.dtype)
+        if len(rows) == 0 or len(cols) == 0:
+            return image
+
+        planes = image.reshape((-1, len(rows), len(cols)))
+        for i, index in enumerate(itertools.product(*indices)):
+            planes[i] = self.read_plane(list(index), rows, cols)
+
+        return image
+
+
+    def label_indices(self, dim, labels):
+        """Return the indices of labels in a dimension.
+
+           Parameters:
+           dim (str): section, cycle, channel, or z.
+           labels: A single label, a list of labels, or a slice of the labels.
+
+           Returns:
+           (list, bool): The indices, and False if a single label was given.
+        """
+
+        names = self.labels[dim]
+        if isinstance(labels, slice):
+            return list(range(len(names)))[labels], True
+        keep = isinstance(labels, (list, tuple))
+        if not keep:
+            labels = [labels]
+        index = []
+        for label in labels:
+            if str(label) not in names:
+                raise ValueError('No ' + dim + ' ' + str(label) + ' in store')
+            index.append(names.index(str(label)))
+
+        return index, keep
+
+
+    def read_plane(self, index, rows, cols):
+        """Read rows and columns of one plane of the array.
+
+           Parameters:
+           index (list): Section, cycle, channel, and z index of the plane.
+           rows (range): Rows to read, not empty.
+           cols (range): Columns to read, not empty.
+
+           Returns:
+           array: The plane, zeros where nothing was written.
+        """
+
+        y0 = min(rows[0], rows[-1])
+        y1 = max(rows[0], rows[-1]) + 1
+        x0 = min(cols[0], cols[-1])
+        x1 = max(cols[0], cols[-1]) + 1
+        image = np.zeros((y1 - y0, x1 - x0), dtype = self.dtype)
+
+        cy, cx = self.chunks
+        for i in range(y0 // cy, (y1 - 1) // cy + 1):
+            for j in range(x0 // cx, (x1 - 1) // cx + 1):
+                key = '.'.join(str(k) for k in index + [i, j])
+                if not exists(join(self.path, key)):
+                    continue
+                chunk = self.read_chunk(key)
+                r0 = max(y0, i*cy)
+                r1 = min(y1, (i + 1)*cy)
+                c0 = max(x0, j*cx)
+                c1 = min(x1, (j + 1)*cx)
+                image[r0 - y0:r1 - y0, c0 - x0:c1 - x0] = \
+                    chunk[r0 - i*cy:r1 - i*cy, c0 - j*cx:c1 - j*cx]
+
+        return image[rows.start - y0::rows.step, cols.start - x0::cols.step]
+
+
+    def writer(self, section, cycle, channel, z, y = 0, x = 0):
+        """Return a write function for an ImageWriter.
+
+           The function writes the image it is called with to the given
+           position in the store, the path is ignored.
+
+           Returns:
+           function: Function of a path and an image.
+        """
+
+        def write(path, image):
+            return self.write(image, section, cycle, channel, z, y, x)
+
+        return write
+
+
+    def summary(self):
+        """Return statistics of the written images.
+
+           Returns:
+           dict: Number of images, image bytes and stored bytes written,
+                and the compression ratio.
+        """
+
+        with self.lock:
+            ratio = self.n_bytes / self.n_stored if self.n_stored else 0.0
+            return {'images': self.n_images, 'bytes': self.n_bytes,
+                    'stored': self.n_stored, 'ratio': ratio}
+
+
+if __name__ == "__main__":
+
+    # Round trip check, write strips of 2 sections in 3 cycles and read
+    # them back across sections and cycles.
+    import tempfile
+
+    path = join(tempfile.mkdtemp(), 'images.zarr')
+    store = ExperimentStore(path, chunks = (64, 64))
+    rng = np.random.default_rng(0)
+    sections = ['A_1', 'B_1']
+    cycles = [1, 2, 3]
+    channels = [558, 687]
+    expected = np.zeros((2, 3, 2, 200, 2*96), dtype = np.uint16)
+    for s, section in enumerate(sections):
+        for c, cycle in enumerate(cycles):
+            for h, channel in enumerate(channels):
+                for strip in range(2):
+                    image = rng.integers(0, 4096, (200, 96), dtype = np.uint16)
+                    store.write(image, section, cycle, channel, 30000,
+                                x = strip*96)
+                    expected[s, c, h, :, strip*96:(strip + 1)*96] = image
+
+    store = ExperimentStore(path)
+    checks = [(store.read('A_1', 2, 687, 30000), expected[0, 1, 1]),
+              (store.read(sections, slice(None), 558, 30000),
+               expected[:, :, 0]),
+              (store.read(['B_1', 'A_1'], [3, 1], slice(None), [30000],
+                          y = slice(10, 150, 3), x = slice(None, None, -5)),
+               expected[::-1, ::-2, :, np.newaxis, 10:150:3, ::-5]),
+              (store.read(slice(1, None), slice(0, 2), channels, 30000,
+                          y = slice(100, 100)),
+               expected[1:, 0:2, :, 100:100])]
+    for i, (image, reference) in enumerate(checks):
+        assert image.shape == reference.shape, (i, image.shape, reference.shape)
+        assert (image == reference).all(), i
+    print('round trip of', len(checks), 'reads ok')
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Transport
+
+Byte level serial communication shared by all the instruments.
+
+Commands are formatted into bytes once and cached as templates, each template
+knows how many lines the instrument answers the command with. Only the most
+recently used templates are kept, so commands with position arguments that
+are sent once do not fill the cache. Responses are
+read line by line and returned as soon as the expected lines arrive, instead
+of waiting for the serial port to time out. The time from each request to
+its response is recorded in a latency histogram for the instrument.
+
+Examples:
+    #Create a transport for a pump
+    >>>import pyseq
+    >>>pump = pyseq.transport.Transport('COM20', name = 'pumpA',
+    ...                                 prefix = '/1', terminator = b'\\n')
+    >>>pump.command('?')
+    '/0`0\\x03\\n'
+    #See which instruments are the slowest
+    >>>pyseq.transport.report()
+    instrument    commands  total(s)   mean(ms)    p90(ms)    max(ms)
+    pumpA                1     0.003        3.0        3.0        3.0
+"""
+
+
+import logging
+import serial
+import threading
+import weakref
+from collections import OrderedDict
+from collections import deque
+
+from . import motion
+
+
+# Open transports, a transport is forgotten when it is garbage collected
+transports = weakref.WeakSet()
+
+
+class LatencyHistogram():
+    """Histogram of request to response latencies of an instrument.
+
+       Latencies are counted in bins that double in width from 1 ms to 16 s.
+       The most recent requests are also kept with their timestamps.
+
+       Attributes:
+       name (str): Name of the instrument.
+       edges (list): Upper edge of each bin in seconds.
+       counts (list): Number of requests in each bin, the last bin counts
+            latencies longer than the last edge.
+       records (deque): Most recent requests as (timestamp, command,
+            latency) tuples, times in seconds.
+    """
+
+    edges = [0.001 * 2**i for i in range(15)]
+
+    def __init__(self, name, maxlen = 10000):
+        """Constructor for the latency histogram.
+
+           Parameters:
+           name (str): Name of the instrument.
+           maxlen (int, optional): Number of recent requests to keep.
+        """
+
+        self.name = name
+        self.counts = [0] * (len(self.edges) + 1)
+        self.records = deque(maxlen = maxlen)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+
+    def record(self, command, latency, timestamp = None):
+        """Add the latency of a request.
+
+           Parameters:
+           command (str): The command that was sent.
+           latency (float): Seconds from the request to the response.
+           timestamp (float, optional): Time of the request, see
+                pyseq.motion.now(), default is now.
+        """
+
+        if timestamp is None:
+            timestamp = motion.now() - latency
+        i = 0
+        while i < len(self.edges) and latency > self.edges[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.records.append((timestamp, command, latency))
+            self.n += 1
+            self.total += latency
+            self.max = max(self.max, latency)
+
+
+    def percentile(self, p):
+        """Return the pth percentile latency in seconds (float).
+
+           The latency is interpolated linearly within the bin of the pth
+           percentile, and is never more than the max latency.
+        """
+
+        if self.n == 0:
+            return 0.0
+        target = self.n * p / 100.0
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= target:
+                break
+            cumulative += count
+        lower = self.edges[i - 1] if i > 0 else 0.0
+        upper = self.edges[i] if i < len(self.edges) else self.max
+        latency = lower + (upper - lower) * (target - cumulative) / count
+
+        return min(latency, self.max)
+
+
+    def summary(self):
+        """Return statistics of the latencies.
+
+           Returns:
+           dict: Number of requests (n), total, mean, 50th and 90th
+                percentile, and max latency in seconds.
+        """
+
+        mean = self.total / self.n if self.n else 0.0
+
+        return {'n': self.n, 'total': self.total, 'mean': mean,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'max': self.max}
+
+
+class Transport():
+    """Byte level serial connection to an instrument.
+
+       Attributes:
+       name (str): Name of the instrument.
+       serial_port (serial): The serial port commands are written to.
+       response_port (serial): The serial port responses are read from,
+            usually the same as serial_port.
+       prefix (str): Text sent before every command.
+       suffix (str): Text sent after every command.
+       terminator (bytes): Last byte of every response line.
+       replies (dict): Number of response lines for commands that start
+            with the keys.
+       default_lines (int): Number of response lines for other commands.
+       templates (OrderedDict): Cached templates of the most recently used
+            commands, from least to most recent.
+       max_templates (int): Maximum number of cached templates.
+       histogram (LatencyHistogram): Latencies of the requests.
+       logger (log): The log file to write communication with the
+            instrument to.
+    """
+
+    max_templates = 256
+
+
+    def __init__(self, com_port, baudrate = 9600, name = None, prefix = '',
+                 suffix = '\r', terminator = b'\r', replies = None,
+                 default_lines = 1, timeout = 1, response_port = None,
+                 logger = None):
+        """Constructor for the transport.
+
+           Parameters:
+           com_port (str): Communication port for the instrument.
+           baudrate (int, optional): The communication speed in symbols per
+                second.
+           name (str, optional): Name of the instrument.
+           prefix (str, optional): Text sent before every command.
+           suffix (str, optional): Text sent after every command.
+           terminator (bytes, optional): Last byte of every response line.
+           replies (dict, optional): Number of response lines for commands
+                that start with the keys.
+           default_lines (int, optional): Number of response lines for other
+                commands.
+           timeout (float, optional): Seconds to wait for each response line.
+           response_port (str, optional): Communication port for the
+                responses, if different from com_port.
+           logger (log, optional): The log file to write communication with
+                the instrument to.
+
+           Returns:
+           transport object: A transport to communicate with the instrument.
+        """
+
+        self.serial_port = serial.serial_for_url(com_port, baudrate,
+                                                 timeout = timeout)
+        if response_port is None:
+            self.response_port = self.serial_port
+        else:
+            self.response_port = serial.serial_for_url(response_port, baudrate,
+                                                       timeout = timeout)
+        self.name = name
+        self.prefix = prefix
+        self.suffix = suffix
+        self.terminator = terminator
+        self.replies = {}
+        self.default_lines = default_lines
+        self.template_lock = threading.Lock()
+        self.set_replies(replies or {}, default_lines)
+        self.histogram = LatencyHistogram(name)
+        self.logger = logger
+        self.lock = threading.Lock()
+        transports.add(self)
+
+
+    def set_replies(self, replies, default_lines = None):
+        """Set the number of response lines to expect for commands.
+
+           Parameters:
+           replies (dict): Number of response lines for commands that start
+                with the keys.
+           default_lines (int, optional): Number of response lines for other
+                commands.
+        """
+
+        self.replies = dict(replies)
+        if default_lines is not None:
+            self.default_lines = default_lines
+        self.templates = OrderedDict()
+
+
+    def set_prefix(self, prefix):
+        """Set the text sent before every command (str)."""
+
+        self.prefix = prefix
+        self.templates = OrderedDict()
+
+
+    def template(self, text):
+        """Return the bytes to send and number of response lines for a command.
+
+           Templates of the max_templates most recently used commands are
+           cached, so repeated commands are only formatted once.
+
+           Parameters:
+           text (str): The command.
+
+           Returns:
+           (bytes, int): The formatted command and the number of lines in the
+                response.
+        """
+
+        with self.template_lock:
+            if text in self.templates:
+                self.templates.move_to_end(text)
+                return self.templates[text]
+
+        n_lines = self.default_lines
+        match = ''
+        for key, lines in self.replies.items():                                 # Longest matching command
+            if text.startswith(key) and len(key) >= len(match):
+                match = key
+                n_lines = lines
+        data = (self.prefix + text + self.suffix).encode('ascii')
+        with self.template_lock:
+            self.templates[text] = (data, n_lines)
+            if len(self.templates) > self.max_templates:
+                self.templates.popitem(last = False)                            # Forget least recently used
+
+        return data, n_lines
+
+
+    def write(self, text):
+        """Send text to the instrument without reading a response.
+
+           Parameters:
+           text (str): Text to send, it is sent as is.
+        """
+
+        self.serial_port.write(text.encode('ascii'))
+        if self.logger is not None and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s::txmt::%s', self.name, text)
+
+
+    def send(self, text):
+        """Send a command from its template without reading a response.
+
+           Parameters:
+           text (str): A command to send to the instrument.
+        """
+
+        self.serial_port.write(self.template(text)[0])
+
+
+    def readline(self):
+        """Read one response line.
+
+           The terminator is replaced by a newline. If the port times out, the
+           partial line is returned without a newline.
+
+           Returns:
+           str: The response line, or '' if nothing was received.
+        """
+
+        line = self.response_port.read_until(self.terminator)
+        line = line.decode('ascii', errors = 'ignore')
+        if line.endswith(self.terminator.decode('ascii')):
+            line = line[:-len(self.terminator)].rstrip('\r') + '\n'
+
+        return line
+
+
+    def command(self, text, n_lines = None):
+        """Send a command to the instrument and return the response.
+
+           Returns as soon as the expected number of response lines arrive,
+           or when the serial port times out. Stale responses are discarded
+           before the command is sent.
+
+           Parameters:
+           text (str): A command to send to the instrument.
+           n_lines (int, optional): Number of response lines, default is
+                from the command template.
+
+           Returns:
+           str: The response from the instrument, '' if there is none.
+        """
+
+        data, lines = self.template(text)
+        if n_lines is None:
+            n_lines = lines
+
+        with self.lock:
+            t0 = motion.now()
+            if self.response_port.in_waiting:
+                self.response_port.reset_input_buffer()                         # Discard stale responses
+            self.serial_port.write(data)
+            response = ''
+            for i in range(n_lines):
+                line = self.readline()
+                response += line
+                if not line.endswith('\n'):                                     # Timed out
+                    break
+            latency = motion.now() - t0
+
+        self.histogram.record(text, latency, t0)
+        if self.logger is not None and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s::txmt::%s', self.name, data.decode('ascii'))
+            self.logger.info('%s::rcvd::%s', self.name, response)
+
+        return response
+
+
+    def close(self):
+        """Close the serial ports."""
+
+        self.serial_port.close()
+        if self.response_port is not self.serial_port:
+            self.response_port.close()
+
+
+def report(logger = None):
+    """Print or log the latency of the requests to each instrument.
+
+       Instruments are listed from the most to the least total time spent
+       waiting for responses.
+
+       Parameters:
+       logger (log, optional): The log to write the report to, if None the
+            report is printed.
+
+       Returns:
+       dict: Dictionary of instrument name keys and dictionary values of the
+            latency statistics.
+    """
+
+    summary = {}
+    for transport in list(transports):
+        name = transport.name
+        n = 2
+        while name in summary:                                                  # Instrument opened more than once
+            name = transport.name + '#' + str(n)
+            n += 1
+        summary[name] = transport.histogram.summary()
+
+    lines = ['{:<12}{:>10}{:>10}{:>11}{:>11}{:>11}'.format('instrument',
+             'commands', 'total(s)', 'mean(ms)', 'p90(ms)', 'max(ms)')]
+    for name in sorted(summary, key = lambda n: -summary[n]['total']):
+        s = summary[name]
+        lines.append('{:<12}{:>10}{:>10.3f}{:>11.1f}{:>11.1f}{:>11.1f}'.format(
+                     str(name), s['n'], s['total'], s['mean'] * 1000,
+                     s['p90'] * 1000, s['max'] * 1000))
+
+    for line in lines:
+        if logger is None:
+            print(line)
+        else:
+            logger.info('transport::' + line)
+
+    return summary
@@ -17,9 +17,8 @@ Kunal Pandit 9/19
 """
 
 
-import serial
-import io
-import time
+from . import motion
+from . import transport
 
 # Valve object
 
@@ -52,18 +51,23 @@ class Valve():
 
         baudrate = 9600
 
+        self.prefix = ''
+        self.suffix = '\r'
+
         # Open Serial Port
-        s = serial.Serial(com_port, baudrate, timeout = 1)
+        self.serial_port = transport.Transport(com_port, baudrate, name = name,
+                                               prefix = self.prefix,
+                                               suffix = self.suffix,
+                                               terminator = b'\r',
+                                               replies = {'ID': 1, 'NP': 1,
+                                                          'CP': 1, 'GO': 0},
+                                               logger = logger)
 
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s,s,),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
         self.n_ports = 10
         self.port_dict = port_dict
         self.variable_ports = []
-        self.prefix = ''
-        self.suffix = '\r'
+        self.poll_interval = 0.05                                               # s
+        self.move_timeout = 5                                                   # s, resend GO if valve not in position
         self.logger = logger
         self.log_flag = False
         self.name = name
@@ -84,6 +88,7 @@ class Valve():
                 if prefix == 'notused':
                     prefix = ''
                 self.prefix = prefix
+                self.serial_port.set_prefix(prefix)
 
             except:
                 self.write_log('error: could not parse ID')           		    # Write error to log
@@ -111,41 +116,31 @@ class Valve():
     def command(self, text):
         """Send a serial command to the valve and return the response.
 
+           Returns as soon as the response lines expected for the command
+           arrive. ID, NP, and CP are answered with 1 line, GO is not
+           answered.
+
            Parameters:
            text (str): A command to send to the valve.
 
            Returns:
-           str: The response from the valve.
+           str: The response from the valve, or '' if there is no response.
         """
 
-        text = self.prefix + text + self.suffix                                 # Format the command
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                #Flush serial port
-        response = self.serial_port.readline()
-
-        if self.logger is not None:                                             # Log sent command
-            self.logger.info(self.name + '::txmt::'+text)
-        else:
-            print(text)
-
-        blank = response
-        while blank is not '':                                                  # Log received commands
-            if self.logger is not None:
-                self.logger.info(self.name + '::rcvd::'+blank)
-            else:
-                print(blank)
-            blank = self.serial_port.readline()
-
-        return  response
+        return self.serial_port.command(text)
 
 
     def move(self, port_name):
         """Move valve to the specified port_name (str)."""
 
         position = self.port_dict[port_name]
+        response = self.command('GO' + str(position))
+        start = motion.now()
         while position != self.check_valve():
-            response = self.command('GO' + str(position))
-            time.sleep(1)
+            motion.sleep(self.poll_interval)
+            if motion.now() - start > self.move_timeout:                        # Resend GO if the valve did not move
+                response = self.command('GO' + str(position))
+                start = motion.now()
 
 
     def check_valve(self):
@@ -0,0 +1,519 @@
+#!/usr/bin/python
+"""Illumina HiSeq 2500 System :: Image Writer
+
+Writes images to disk in background threads, so the instruments can move to
+the next tile or z plane while the previous images are encoded and written.
+
+Images are submitted to a bounded queue. When depth images are waiting or
+being written, submit blocks until a write finishes, so images can not pile
+up in memory faster than the disk can take them. Each submit returns a
+future, and flush() waits for all of the submitted writes.
+
+Images are written with imageio by default. With a TiffFormat, they are
+written as tiled and losslessly compressed (Big)TIFFs instead, the tiles of
+each image are compressed by a pool of threads. This needs the tifffile
+package, a TiffFormat can not be created without it.
+
+For long strips, a MappedImage creates the channel files at their full size
+and memory maps them, so the camera frames can be copied straight to disk.
+This also needs the tifffile package.
+
+A Pyramid writes 2x, 4x, and 8x block mean downsampled previews next to each
+image, in the writer threads, so large scans can be checked quickly.
+
+Examples:
+    #Create a writer with 2 threads that holds at most 8 images
+    >>>import pyseq
+    >>>writer = pyseq.writer.ImageWriter(workers = 2, depth = 8)
+    #Write an image in the background
+    >>>future = writer.submit('images/558_test.tiff', image)
+    #Wait for the image to be written
+    >>>future.result()
+    #Wait for all of the images to be written
+    >>>writer.flush()
+    #Write zlib compressed tiled BigTIFFs
+    >>>writer = pyseq.writer.ImageWriter(write = pyseq.writer.TiffFormat('zlib'))
+    #See the size and write rate of the last file
+    >>>writer.files[-1]
+    {'path': 'images/558_test.tiff', 'bytes': 16777216, 'file bytes': 9175040, 'seconds': 0.05, 'MB/s': 335.5}
+    #Also write images/558_test_2x.tiff, _4x.tiff, and _8x.tiff previews
+    >>>writer.write = pyseq.writer.Pyramid(writer.write)
+"""
+
+
+import imageio
+import numpy as np
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from os.path import exists
+from os.path import getsize
+from os.path import splitext
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+# Lossless TIFF compressions and the package each needs besides tifffile
+compressions = {None: None, 'zlib': None, 'zstd': 'imagecodecs',
+                'lzw': 'imagecodecs'}
+
+
+class TiffFormat():
+    """Tiled and compressed TIFF output.
+
+       Call with a path and an image to write the image, so it can be used
+       as the write function of an ImageWriter.
+
+       Attributes:
+       compression (str): Lossless compression, 'zlib', 'zstd', 'lzw', or
+            None for uncompressed. zstd and lzw need the imagecodecs package.
+       level (int): Compression level, None for the default.
+       tile (tuple): Rows and columns of each tile, None to write strips.
+       bigtiff (bool): True to write BigTIFFs, which can be larger than
+            4 GB.
+       threads (int): Number of threads compressing the tiles of an image.
+    """
+
+
+    def __init__(self, compression = 'zlib', level = None, tile = (512, 512),
+                 bigtiff = True, threads = 4):
+        """Constructor for the TIFF format.
+
+           Parameters:
+           compression (str, optional): 'zlib', 'zstd', 'lzw', or None.
+           level (int, optional): Compression level, None for the default.
+           tile (tuple, optional): Rows and columns of each tile, multiples
+                of 16, None to write strips.
+           bigtiff (bool, optional): True to write BigTIFFs.
+           threads (int, optional): Threads compressing the tiles of an
+                image.
+
+           Returns:
+           format object: A TIFF format.
+
+           Raises:
+           ImportError: If tifffile, or imagecodecs for zstd and lzw, is not
+                installed.
+           ValueError: If the compression is unknown.
+        """
+
+        if tifffile is None:
+            raise ImportError('tifffile is needed to write ' +
+                              str(compression) + ' compressed TIFFs')
+        if compression not in compressions:
+            raise ValueError('Unknown TIFF compression ' + str(compression))
+        if compressions[compression] is not None:
+            try:
+                __import__(compressions[compression])
+            except ImportError:
+                raise ImportError(compressions[compression] + ' is needed ' +
+                                  'to write ' + compression + ' compressed TIFFs')
+        self.compression = compression
+        self.level = level
+        self.tile = tile
+        self.bigtiff = bigtiff
+        self.threads = threads
+
+
+    def __call__(self, path, image):
+        """Write an image to a TIFF file.
+
+           Parameters:
+           path (str): File path of the image.
+           image (array): The image to write.
+
+           Returns:
+           int: Size of the file in bytes.
+        """
+
+        if self.compression is None or self.level is None:
+            compressionargs = None
+        else:
+            compressionargs = {'level': self.level}
+        tifffile.imwrite(path, image, bigtiff = self.bigtiff,
+                         tile = self.tile,
+                         compression = self.compression,
+                         compressionargs = compressionargs,
+                         maxworkers = self.threads)
+
+        return getsize(path)
+
+
+def pyramid(image, scales = (2, 4, 8)):
+    """Return downsampled copies of an image.
+
+       Each pixel of a downsampled image is the rounded mean of a block of
+       scale x scale pixels of the image. The block sums of each level are
+       added up from the sums of the previous level with strided slices, so
+       the image is only read once. Leftover rows and columns at the edges
+       are dropped.
+
+       Parameters:
+       image (array): 2D integer image, for example 12 bit uint16 data.
+       scales (tuple, optional): Increasing downsampling factors, each a
+            multiple of the one before.
+
+       Returns:
+       list: The downsampled images in the order of scales.
+    """
+
+    previews = []
+    total = image
+    factor = 1
+    for scale in scales:
+        f = scale // factor
+        rows = total.shape[0] // f
+        cols = total.shape[1] // f
+        blocks = total[0:rows*f, 0:cols*f].astype(np.uint32, copy = False)
+        sums = blocks[0::f]
+        for i in range(1, f):
+            sums = sums + blocks[i::f]                                          # Sum rows of the blocks
+        total = sums[:, 0::f]
+        for i in range(1, f):
+            total = total + sums[:, i::f]                                       # Sum columns of the blocks
+        n = scale * scale
+        previews.append(((total + n//2) // n).astype(image.dtype))
+        factor = scale
+
+    return previews
+
+
+class Pyramid():
+    """Writes downsampled previews with each image.
+
+       Call with a path and an image to write the image and its previews, so
+       it can be used as the write function of an ImageWriter. The previews
+       are written next to the image, named with the scale, for example
+       558_test_2x.tiff.
+
+       Attributes:
+       write (function): Function that writes the image and the previews.
+       scales (tuple): Downsampling factors of the previews.
+    """
+
+
+    def __init__(self, write = None, scales = (2, 4, 8)):
+        """Constructor for the pyramid.
+
+           Parameters:
+           write (function, optional): Function called with a path and an
+                image to write it, the default is imageio.imwrite.
+           scales (tuple, optional): Increasing downsampling factors, each a
+                multiple of the one before.
+
+           Returns:
+           pyramid object: A pyramid write function.
+        """
+
+        if write is None:
+            write = imageio.imwrite
+        self.write = write
+        self.scales = tuple(scales)
+
+
+    def paths(self, path):
+        """Return the file paths of the previews of an image (list)."""
+
+        root, ext = splitext(path)
+        return [root + '_' + str(scale) + 'x' + ext for scale in self.scales]
+
+
+    def __call__(self, path, image):
+        """Write an image and its previews.
+
+           Returns:
+           int: Number of bytes written.
+        """
+
+        written = self.write(path, image)
+        if written is None:
+            written = getsize(path) if exists(path) else 0
+
+        return written + self.previews(path, image)
+
+
+    def previews(self, path, image):
+        """Write only the previews of an image.
+
+           Returns:
+           int: Number of bytes written.
+        """
+
+        written = 0
+        for preview_path, preview in zip(self.paths(path),
+                                         pyramid(image, self.scales)):
+            size = self.write(preview_path, preview)
+            if size is None:
+                size = getsize(preview_path) if exists(preview_path) else 0
+            written += size
+
+        return written
+
+
+class MappedImage():
+    """Channel images memory mapped to their files.
+
+       The files are created at their full size before the picture is taken,
+       and the camera frames are copied straight to their rows, so a whole
+       image never has to be held in memory. The files are uncompressed
+       TIFFs at the given paths, so they can be read like the other images.
+
+       Attributes:
+       paths (list): File paths of the channels.
+       channels (list): Writable arrays mapped to the files, None after the
+            image is closed.
+       nbytes (int): Size of the channel images in bytes.
+       logger (log): The log file to write messages to.
+    """
+
+
+    def __init__(self, paths, shape, dtype = np.uint16, logger = None):
+        """Constructor for the mapped image.
+
+           Parameters:
+           paths (list): File path of each channel.
+           shape (tuple): Rows and columns of each channel.
+           dtype (dtype, optional): Data type of the images.
+           logger (log, optional): The log file to write messages to.
+
+           Returns:
+           mapped image object: The channel images mapped to the files.
+
+           Raises:
+           ImportError: If tifffile is not installed.
+        """
+
+        if tifffile is None:
+            raise ImportError('tifffile is needed to memory map images')
+        self.logger = logger
+        self.paths = list(paths)
+        self.channels = [tifffile.memmap(path, shape = shape, dtype = dtype)
+                         for path in self.paths]
+        self.nbytes = sum(channel.nbytes for channel in self.channels)
+
+
+    def close(self, keep = True):
+        """Flush the channel images to their files and unmap them.
+
+           Parameters:
+           keep (bool, optional): False to remove the files, for example if
+                the picture was not completed. Drop any other views of the
+                channels first, a file that is still mapped can not be
+                removed on Windows.
+
+           Returns:
+           list: Paths of the files that were kept.
+        """
+
+        if self.channels is not None:
+            for channel in self.channels:
+                channel.flush()
+            self.channels = None                                                # Unmap the channels
+        if keep:
+            return self.paths
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except OSError as error:                                            # Still mapped by another view
+                self.message('Could not remove ' + path + ', ' + str(error))
+        return []
+
+
+    def message(self, text):
+        """Log or print a message (str)."""
+
+        text = 'MappedImage::' + str(text)
+        if self.logger is not None:
+            self.logger.info(text)
+        else:
+            print(text)
+
+
+class ImageWriter():
+    """Background image writer.
+
+       Attributes:
+       workers (int): Number of threads writing images.
+       depth (int): Maximum number of images waiting or being written.
+       pending (set): Futures of the writes that are not done.
+       errors (list): Errors from writes since the last flush.
+       n_images (int): Number of images written.
+       n_bytes (int): Number of image bytes written.
+       n_file_bytes (int): Number of bytes written to disk.
+       write_time (float): Total seconds spent writing images.
+       blocked_time (float): Total seconds submit blocked waiting for room
+            in the queue.
+       files (deque): The most recent writes, each a dictionary with the
+            path, image bytes, file bytes, seconds, and MB/s of the image.
+       write (function): Default function called with the path and image to
+            write an image.
+       logger (log): The log file to write messages to.
+    """
+
+
+    def __init__(self, workers = 2, depth = 8, logger = None, write = None,
+                 maxlen = 1000):
+        """Constructor for the image writer.
+
+           Parameters:
+           workers (int, optional): Number of threads writing images.
+           depth (int, optional): Maximum number of images waiting or being
+                written before submit blocks.
+           logger (log, optional): The log file to write messages to.
+           write (function, optional): Default function to write images, for
+                example a TiffFormat, the default is imageio.imwrite.
+           maxlen (int, optional): Number of recent writes to keep in files.
+
+           Returns:
+           writer object: An image writer.
+        """
+
+        self.workers = workers
+        self.depth = depth
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.slots = threading.BoundedSemaphore(depth)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.errors = []
+        self.n_images = 0
+        self.n_bytes = 0
+        self.n_file_bytes = 0
+        self.write_time = 0.0
+        self.blocked_time = 0.0
+        self.files = deque(maxlen = maxlen)
+        if write is None:
+            write = imageio.imwrite
+        self.write = write
+
+
+    def submit(self, path, image, write = None):
+        """Write an image in the background.
+
+           Blocks while the queue is full. The image must not be changed
+           until its write is done.
+
+           Parameters:
+           path (str): File path of the image.
+           image (array): The image to write.
+           write (function, optional): Function called with the path and
+                image to write it, default is self.write. It can return the
+                number of bytes written, otherwise the size of the file at
+                the path is used.
+
+           Returns:
+           Future: Done when the image is written, result() raises any error
+                from writing the image.
+        """
+
+        if write is None:
+            write = self.write
+
+        t0 = time.perf_counter()
+        self.slots.acquire()
+        blocked = time.perf_counter() - t0
+        try:
+            future = self.executor.submit(self._write, write, path, image)
+        except:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.blocked_time += blocked
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+
+        return future
+
+
+    def _write(self, write, path, image):
+        t0 = time.perf_counter()
+        try:
+            written = write(path, image)
+            if written is None:
+                written = getsize(path) if exists(path) else 0
+        except Exception as error:
+            with self.lock:
+                self.errors.append(error)
+            self.message('Error writing ' + str(path) + ': ' + str(error))
+            raise
+        elapsed = time.perf_counter() - t0
+        rate = image.nbytes / elapsed / 1e6 if elapsed else 0.0
+        with self.lock:
+            self.n_images += 1
+            self.n_bytes += image.nbytes
+            self.n_file_bytes += written
+            self.write_time += elapsed
+            self.files.append({'path': path, 'bytes': image.nbytes,
+                               'file bytes': written, 'seconds': elapsed,
+                               'MB/s': rate})
+
+        return path
+
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+
+    def flush(self, timeout = None):
+        """Wait until all submitted images are written.
+
+           Parameters:
+           timeout (float, optional): Seconds to wait, None waits forever.
+
+           Returns:
+           bool: True if all images were written without errors since the
+                last flush, False if there was an error or the images were not
+                written in time.
+        """
+
+        with self.lock:
+            pending = list(self.pending)
+        done, not_done = wait(pending, timeout = timeout)
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+
+        return not not_done and not errors
+
+
+    def close(self):
+        """Write the remaining images and stop the writer threads."""
+
+        self.flush()
+        self.executor.shutdown(wait = True)
+
+
+    def summary(self):
+        """Return statistics of the written images.
+
+           Returns:
+           dict: Number of images, image bytes and file bytes written, the
+                compression ratio, total seconds spent writing and blocked
+                in submit, and the write rate of image bytes in MB/s.
+        """
+
+        with self.lock:
+            rate = self.n_bytes / self.write_time / 1e6 if self.write_time else 0.0
+            ratio = self.n_bytes / self.n_file_bytes if self.n_file_bytes else 0.0
+            return {'images': self.n_images, 'bytes': self.n_bytes,
+                    'file bytes': self.n_file_bytes, 'ratio': ratio,
+                    'write': self.write_time, 'blocked': self.blocked_time,
+                    'MB/s': rate}
+
+
+    def message(self, text):
+        """Log or print a message (str)."""
+
+        text = 'ImageWriter::' + str(text)
+        if self.logger is not None:
+            self.logger.info(text)
+        else:
+            print(text)
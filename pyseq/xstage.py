@@ -16,6 +16,9 @@ xstage.initialize()
 #Move xstage to step position 10000
 xstage.move(10000)
 10000
+#Predicted and actual time of the move
+xstage.move_log.last
+{'start': 30000, 'target': 10000, 'predicted': 20.24, 'actual': 20.28, 'polls': 2}
 
 TODO:
     * Change initialization to be aware position of flags.
@@ -24,9 +27,8 @@ Kunal Pandit 9/19
 """
 
 
-import serial
-import io
-import time
+from . import motion
+from . import transport
 
 
 class Xstage():
@@ -35,6 +37,12 @@ class Xstage():
     Attributes:
     spum (float): Number of xstage steps per micron.
     position (int): The absolution position of the xstage in steps.
+    vi (int): Initial velocity in steps/s.
+    vm (int): Maximum velocity in steps/s.
+    accel (int): Acceleration in steps/s**2.
+    decel (int): Deceleration in steps/s**2.
+    home_timeout (float): Seconds to wait for the xstage to home.
+    move_log (MoveLog): Predicted and actual time of recent moves.
     """
 
     # Make Xstage object
@@ -52,41 +60,51 @@ class Xstage():
            xstage object: A xstage object to control the xstage.
         """
 
-        # Open Serial Port
-        s = serial.Serial(com_port, baudrate, timeout = 1)
+        self.suffix = '\r'
 
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s,s,),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
+        # Open Serial Port
+        self.serial_port = transport.Transport(com_port, baudrate,
+                                               name = 'Xstage',
+                                               suffix = self.suffix,
+                                               terminator = b'\n',
+                                               logger = logger)
         self.min_x = 1000
         self.max_x = 50000
         self.home = 30000
         self.spum = 100/244     #steps per um
-        self.suffix = '\r'
         self.position = 0
         self.logger = logger
+        self.vi = 40                                                            # steps/s
+        self.vm = 1000                                                          # steps/s
+        self.accel = 4000                                                       # steps/s**2
+        self.decel = 4000                                                       # steps/s**2
+        self.poll_lead = 0.02                                                   # s, start polling before predicted arrival
+        self.poll_interval = 0.05                                               # s
+        self.home_timeout = 120                                                 # s, longest homing from max_x
+        self.move_log = motion.MoveLog('Xstage')
 
 
     def initialize(self):
         """Initialize the xstage."""
 
         # Initialize Stage
+        self.serial_port.set_replies({}, 1)                                     # Every command is echoed
         response = self.command('\x03')
 
         #Change echo mode to respond only to print and list commands
         response = self.command('EM=2')
+        self.serial_port.set_replies({'PR': 1}, 0)
 
         #Enable Encoder
         response = self.command('EE=1')
         #Set Initial Velocity
-        response = self.command('VI=40')
+        response = self.command('VI=' + str(self.vi))
         #Set Max Velocity
-        response = self.command('VM=1000')
+        response = self.command('VM=' + str(self.vm))
         #Set Acceleration
-        response = self.command('A=4000')
+        response = self.command('A=' + str(self.accel))
         #Set Deceleration
-        response = self.command('D=4000')
+        response = self.command('D=' + str(self.decel))
         #Set Home
         response = self.command('S1=1,0,0')
         #Set Neg. Limit
@@ -114,11 +132,9 @@ class Xstage():
         self.serial_port.write('P = 30000\r')
         self.serial_port.write('E\r')
         self.serial_port.write('PG\r')
-        self.serial_port.flush()
         self.serial_port.write('EX 1\r')
-        self.serial_port.flush()
         self.position = 30000
-        self.check_position(self.position)
+        self.check_position(self.position, timeout = self.home_timeout)
 
 
     def command(self, text):
@@ -130,15 +146,8 @@ class Xstage():
            Returns:
            str: The response from the xstage.
         """
-        text = text + self.suffix
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                # Flush serial port
-        response = self.serial_port.readline()
-        if self.logger is not None:
-            self.logger.info('Xstage::txmt::'+text)
-            self.logger.info('Xstage::rcvd::'+response)
 
-        return  response
+        return self.serial_port.command(text)
 
 
 
@@ -153,28 +162,77 @@ class Xstage():
            int: Absolute step position after move.
         """
         if position <= self.max_x and position >= self.min_x:
+            start = self.position
+            predicted = self.move_time(position)
+            t0 = motion.now()
             self.command('MA ' + str(position))                                 # Move Absolute
-            return self.check_position(position)                                # Check position
+            try:
+                polls = motion.wait(self.stopped, t0 + predicted,               # Wait till xstage stops moving
+                                    lead = self.poll_lead,
+                                    poll = self.poll_interval)
+            except TimeoutError:
+                print('XSTAGE did not stop moving')
+                polls = None
+            self.position = int(self.command('PR P'))                           # Set position
+            self.move_log.record(start, position, predicted,
+                                 motion.now() - t0, polls)
+            return position == self.position                                    # Return TRUE if in position or False if not
         else:
             print('XSTAGE can only move between ' + str(self.min_x) +
                   ' and ' + str(self.max_x))
 
 
+    async def move_async(self, position):
+        """Move xstage to absolute step position without blocking the event
+           loop, see move.
+
+           Returns:
+           bool: True if xstage is in position, False if it is not.
+        """
+
+        return await motion.run_async(self.move, position)
+
+
     # Check if Xstage is at a positio
-    def check_position(self, position):
+    def check_position(self, position, timeout = None):
         """Check if xstage is in positions.
 
            Parameters:
            position (int): Absolute step position must be between 1000 - 50000.
+           timeout (float, optional): Seconds to wait for the xstage to stop,
+                default is pyseq.motion.timeout_margin.
 
            Returns:
            bool: True if xstage is in position, False if it is not in position.
         """
-        moving = 1
-        while moving != 0:
-            moving = int(self.command('PR MV'))                                 # Check if moving, 1 = yes, 0 = no
-            time.sleep(1)
+        try:
+            motion.wait(self.stopped, motion.now(),                             # Wait till xstage stops moving
+                        lead = 0, poll = self.poll_interval,
+                        timeout = timeout)
+        except TimeoutError:
+            print('XSTAGE did not stop moving')
+            return False
 
         self.position = int(self.command('PR P'))                               # Set position
 
         return position == self.position                                        # Return TRUE if in position or False if not
+
+
+    def stopped(self):
+        """Return True if the xstage is not moving (bool)."""
+
+        return int(self.command('PR MV')) == 0                                  # Check if moving, 1 = yes, 0 = no
+
+
+    def move_time(self, position):
+        """Return the predicted time in seconds to move to position (float).
+
+           The time is calculated from the trapezoidal velocity profile set
+           by VI, VM, A, and D.
+
+           Parameters:
+           position (int): Absolute step position to move to.
+        """
+
+        return motion.trapezoid_time(position - self.position, self.vm,
+                                     self.accel, self.decel, self.vi)
@@ -15,18 +15,16 @@ Examples:
     #Move ystage to step position 3000000
     >>>ystage.move(3000000)
     >>>True
-
-TODO:
-    * Set gains function
-    * Set velocity function
+    #Predicted and actual time of the move
+    >>>ystage.move_log.last
+    {'start': 0, 'target': 3000000, 'predicted': 3.3, 'actual': 3.31, 'polls': 7}
 
 Kunal Pandit 9/19
 """
 
 
-import serial
-import io
-import time
+from . import motion
+from . import transport
 
 
 class Ystage():
@@ -35,6 +33,20 @@ class Ystage():
        Attributes:
        spum (float): Number of ystage steps per micron.
        position (int): The absolution position of the ystage in steps.
+       velocity (float): Velocity of the ystage in revolutions/s, as last
+            sent with set_velocity.
+       gains (str): Gains of the ystage servo, as last sent with set_gains.
+       spr (int): Estimated ystage steps per motor revolution.
+       acceleration (float): Estimated acceleration of the ystage in
+            revolutions/s**2, it is not sent to the drive.
+       settle (dict): Estimated seconds to settle in position for each gains.
+       move_log (MoveLog): Predicted and actual time of recent moves.
+
+       The steps per revolution, acceleration, and settle times are not read
+       from the drive. They are estimates that only decide when move starts
+       polling the position. Calibrate them on an instrument from the mean
+       error of move_log.summary(), a positive error means the moves take
+       longer than predicted.
     """
 
 
@@ -52,30 +64,44 @@ class Ystage():
            ystage object: A ystage object to control the ystage.
         """
 
-        # Open Serial Port
-        s = serial.Serial(com_port, baudrate, timeout = 1)
+        self.prefix = '1'
+        self.suffix = '\r\n'
 
-        # Text wrapper around serial port
-        self.serial_port = io.TextIOWrapper(io.BufferedRWPair(s,s,),
-                                            encoding = 'ascii',
-                                            errors = 'ignore')
+        # Open Serial Port
+        self.serial_port = transport.Transport(com_port, baudrate,
+                                               name = 'Ystage',
+                                               prefix = self.prefix,
+                                               suffix = self.suffix,
+                                               terminator = b'\n',
+                                               logger = logger)
         self.min_y = -7000000
         self.max_y = 7500000
         self.spum = 100     # steps per um
-        self.prefix = '1'
-        self.suffix = '\r\n'
         self.on = False
         self.position = 0
         self.home = 0
         self.logger = None
+        self.spr = 1000000                                                      # steps per revolution, estimate
+        self.velocity = 1                                                       # rev/s
+        self.acceleration = 10                                                  # rev/s**2, estimate
+        self.moving_gains = '5,10,7,1.5,0'
+        self.imaging_gains = '5,10,5,2,0'
+        self.gains = self.moving_gains
+        self.settle = {self.moving_gains: 0.2,                                  # s, estimated time to settle in position
+                       self.imaging_gains: 0.05}
+        self.poll_lead = 0.05                                                   # s, start polling before predicted arrival
+        self.poll_interval = 0.01                                               # s
+        self.move_log = motion.MoveLog('Ystage')
 
 
     def initialize(self):
         """Initialize the ystage."""
 
+        self.serial_port.set_replies({}, 1)                                     # Every command is echoed
         response = self.command('Z')                                            # Initialize Stage
         response = self.command('W(EX,0)')                                      # Turn off echo
-        response = self.command('GAINS(5,10,7,1.5,0)')                          # Set gains
+        self.serial_port.set_replies({'R(': 1}, 0)                              # Only reports are answered
+        self.set_gains(self.moving_gains)                                       # Set gains
         response = self.command('MA')                                           # Set to absolute position mode
         response = self.command('ON')                                           # Turn Motor ON
         self.on = True
@@ -92,15 +118,7 @@ class Ystage():
            str: The response from the ystage.
         """
 
-        text = self.prefix + text + self.suffix
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                # Flush serial port
-        response = self.serial_port.readline()
-        if self.logger is not None:
-            self.logger.info('Ystage::txmt::'+text)
-            self.logger.info('Ystage::rcvd::'+response)
-
-        return  response
+        return self.serial_port.command(text)
 
 
     def move(self, position):
@@ -111,21 +129,43 @@ class Ystage():
                 7500000.
 
            Returns:
-           bool: True when stage is in position.
+           bool: True when stage is in position, False if it did not get
+                there in time.
         """
 
         if position <= self.max_y and position >= self.min_y:
+            start = self.position
+            predicted = self.move_time(position)
+            t0 = motion.now()
             self.command('D' + str(position))                                   # Set distance
             self.command('G')                                                   # Go
-            while not self.check_position():                                    # Wait till y stage is in position
-                time.sleep(1)
+            try:
+                polls = motion.wait(self.check_position, t0 + predicted,        # Wait till y stage is in position
+                                    lead = self.poll_lead,
+                                    poll = self.poll_interval)
+            except TimeoutError:
+                print('YSTAGE did not reach position ' + str(position))
+                polls = None
             self.read_position()                                                # Update stage position
-            return True                                                         # Return True that stage is in position
+            self.move_log.record(start, position, predicted,
+                                 motion.now() - t0, polls)
+            return polls is not None                                            # Return True if stage is in position
         else:
             print("YSTAGE can only between " + str(self.min_y) + ' and ' +
                 str(self.max_y))
 
 
+    async def move_async(self, position):
+        """Move ystage to absolute step position without blocking the event
+           loop, see move.
+
+           Returns:
+           bool: True when stage is in position.
+        """
+
+        return await motion.run_async(self.move, position)
+
+
     def check_position(self):
         """Check if ystage is in position.
 
@@ -140,3 +180,44 @@ class Ystage():
         self.position = int(self.command('R(PA)')[1:])                          # Read and store position
 
         return self.position
+
+
+    def move_time(self, position):
+        """Return the predicted time in seconds to move to position (float).
+
+           The time is estimated from the distance, velocity, acceleration,
+           and the settle time of the current gains. Only the velocity and
+           gains are the ones sent to the drive, see the class attributes.
+
+           Parameters:
+           position (int): Absolute step position to move to.
+        """
+
+        revs = abs(position - self.position) / self.spr
+        travel = motion.trapezoid_time(revs, self.velocity, self.acceleration)
+        settle = self.settle.get(self.gains, max(self.settle.values()))
+
+        return travel + settle
+
+
+    def set_velocity(self, v):
+        """Set the velocity of the ystage.
+
+           Parameters:
+           v (float): Velocity in revolutions/s.
+        """
+
+        self.command('V' + str(v))
+        self.velocity = v
+
+
+    def set_gains(self, gains):
+        """Set the gains of the ystage servo.
+
+           Parameters:
+           gains (str): Comma separated gains, ie '5,10,7,1.5,0' for moving
+                and '5,10,5,2,0' for imaging.
+        """
+
+        self.command('GAINS(' + gains + ')')
+        self.gains = gains
@@ -13,18 +13,23 @@ expected to accurately go to the same position over and over again.
 Examples:
     #Create zstage
     >>>import pyseq
-    >>>xstage = pyseq.zstage.Zstage('COM10')
+    >>>fpga = pyseq.fpga.FPGA('COM12','COM15')
+    >>>fpga.initialize()
+    >>>zstage = pyseq.zstage.Zstage(fpga)
     #Initialize zstage
     >>>zstage.initialize()
     #Move all tilt motors on zstage to absolute step position 21000
     >>>zstage.move([21000, 21000, 21000])
     >>>[21000, 21000, 21000]
+    #Read all tilt motors at once
+    >>>zstage.read_positions()
+    >>>[21000, 21001, 20999]
 
 Kunal Pandit 9/19
 """
 
 
-import time
+from . import motion
 
 
 class Zstage():
@@ -34,6 +39,18 @@ class Zstage():
        spum (float): Number of zstage steps per micron.
        position ([int, int, int]): A list with absolute positions of each tilt
             motor in steps.
+       speed (float): Estimated speed of the tilt motors in steps/s. The
+            speed is not read from or sent to the motors, calibrate it on an
+            instrument from the mean error of move_log.summary(), a
+            positive error means the motors are slower than estimated.
+       settle_window (int): Number of consecutive reads the motors must not
+            move for to be stopped, 1 takes two matching reads like before.
+       tolerance (int): Change in steps between reads that counts as not
+            moving.
+       max_retries (int): Number of failed reads a position check allows
+            before it gives up.
+       polls (int): Number of reads in the last position check.
+       move_log (MoveLog): Predicted and actual time of recent moves.
     """
 
 
@@ -49,7 +66,7 @@ class Zstage():
            zstage object: A zstage object to control the zstage.
         """
 
-        self.serial_port = fpga
+        self.fpga = fpga
         self.min_z = 0
         self.max_z = 25000
         self.spum = 0.656           #steps per um
@@ -57,6 +74,14 @@ class Zstage():
         self.position = [0, 0, 0]
         self.motors = ['1','2','3']
         self.logger = logger
+        self.speed = 2000                                                       # steps/s, estimate
+        self.settle_window = 1                                                  # reads
+        self.tolerance = 0                                                      # steps
+        self.poll_lead = 0.05                                                   # s, start reading before predicted stop
+        self.poll_interval = 0.05                                               # s
+        self.max_retries = 3
+        self.polls = 0
+        self.move_log = motion.MoveLog('Zstage')
 
 
     def initialize(self):
@@ -74,9 +99,7 @@ class Zstage():
             response = self.command('T' + self.motors[i] + 'CR')
 
         # Update position
-        for i in range(3):
-            self.position[i] = int(self.command('T' + self.motors[i]
-                + 'RD')[5:])                                                    # Set position
+        self.check_position(window = 1)
 
 
     def command(self, text):
@@ -89,13 +112,10 @@ class Zstage():
            str: The response from the zstage.
         """
 
-        text = text + self.suffix
-        self.serial_port.write(text)                                            # Write to serial port
-        self.serial_port.flush()                                                # Flush serial port
-        response = self.serial_port.readline()
+        response = self.fpga.result(self.fpga.submit(text))                     # Send through the FPGA
         if self.logger is not None:
-            self.logger.info('Zstage::txmt::'+text)
-            self.logger.info('Zstage::rcvd::'+response)
+            self.logger.info('Zstage::txmt::%s%s', text, self.suffix)
+            self.logger.info('Zstage::rcvd::%s', response)
 
         return  response
 
@@ -109,8 +129,11 @@ class Zstage():
 
            Returns:
            [int, int, int]: List with absolute positions of each tilt motor
-                after the move.
+                after the move, None if the positions could not be read.
         """
+        start = list(self.position)
+        predicted = self.move_time(position)
+        t0 = motion.now()
         for i in range(3):
             if position[i] <= self.max_z and position[i] >= self.min_z:
                 self.command('T' + self.motors[i] + 'MOVETO ' +
@@ -119,44 +142,111 @@ class Zstage():
                 print("ZSTAGE can only move between " + str(self.min_z) +
                     ' and ' + str(self.max_z))
 
-        return self.check_position()                                            # Check position
+        motion.sleep(t0 + predicted - self.poll_lead - motion.now())            # Wait till motors should stop
+        current = self.check_position()                                         # Check position
+        self.move_log.record(start, list(position), predicted,
+                             motion.now() - t0, self.polls)
+
+        return current
+
+
+    async def move_async(self, position):
+        """Move all tilt motors without blocking the event loop, see move.
+
+           Returns:
+           [int, int, int]: List with absolute positions of each tilt motor
+                after the move.
+        """
+
+        return await motion.run_async(self.move, position)
 
 
     # Check if Zstage motors are stopped and return their position
-    def check_position(self):
+    def check_position(self, window = None):
         """Return a list with absolute positions of each tilt motor
-                [int, int ,int]."""
+                [int, int ,int].
 
-        # Get Current position
-        old_position = [0,0,0]
-        for i in range(3):
-            successful = True
-            while successful:
-                try:
-                    old_position[i] = int(self.command('T' + self.motors[i] +
-                        'RD')[5:])
-                    successful = False
-                except:
-                    time.sleep(2)
-
-
-        all_stopped = 0
-        while all_stopped != 3:
-            all_stopped = 0
-            for i in range(3):
-                successful = True
-                while successful:
-                    try:
-                        new_position = int(self.command('T' + self.motors[i] +
-                            'RD')[5:])                                          # Get current position
-                        stopped = new_position == old_position[i]               # Compare old position to new position
-                        all_stopped = all_stopped + stopped                     # all_stopped will = 3 if all 3 motors are in position
-                        old_position[i] = new_position                          # Save new position
-                        successful = False
-                    except:
-                        time.sleep(2)
+           The positions of all 3 tilt motors are read in one burst until
+           none of the motors move more than the tolerance for window
+           consecutive reads. If the motors can not be read more than
+           max_retries times, the check gives up and the position attribute
+           is not changed.
 
-        for i in range(3):
-            self.position[i] = old_position[i]                                  # Set position
+           Parameters:
+           window (int, optional): Number of consecutive reads without
+                movement, default is settle_window.
+
+           Returns:
+           [int, int, int]: The positions, None if they could not be read.
+        """
+
+        if window is None:
+            window = self.settle_window
+
+        old_position = self.read_positions()
+        self.polls = 1
+        stable = 0
+        failed = int(None in old_position)
+        while stable < window:
+            if failed > self.max_retries:
+                print('ZSTAGE could not read tilt motor positions')
+                return None
+            motion.sleep(self.poll_interval)
+            new_position = self.read_positions()
+            self.polls += 1
+            if None in new_position:
+                failed += 1                                                     # Couldn't read a motor
+                stable = 0
+                continue
+            if None in old_position:
+                stable = 0
+            elif all(abs(new - old) <= self.tolerance                           # Compare old position to new position
+                     for new, old in zip(new_position, old_position)):
+                stable += 1
+            else:
+                stable = 0
+            old_position = new_position                                         # Save new position
+
+        self.position = old_position                                            # Set position
 
         return self.position                                                    # Return position
+
+
+    def read_positions(self):
+        """Read the positions of all tilt motors in one burst.
+
+           Returns:
+           [int, int, int]: List with absolute positions of each tilt motor,
+                None for a motor whose position could not be read.
+        """
+
+        requests = [self.fpga.submit('T' + m + 'RD') for m in self.motors]     # Send all reads before waiting
+        positions = []
+        for m, request in zip(self.motors, requests):
+            response = self.fpga.result(request)
+            if self.logger is not None:
+                self.logger.info('Zstage::txmt::T%sRD%s', m, self.suffix)
+                self.logger.info('Zstage::rcvd::%s', response)
+            try:
+                positions.append(int(response[5:]))
+            except ValueError:
+                positions.append(None)
+
+        return positions
+
+
+    def move_time(self, position):
+        """Return the predicted time in seconds for the tilt motors to reach
+           position (float).
+
+           The time is estimated from the largest distance and the estimated
+           speed of the tilt motors.
+
+           Parameters:
+           position ([int, int, int]): List of absolute positions for each tilt
+                motor.
+        """
+
+        distance = max(abs(p - q) for p, q in zip(position, self.position))
+
+        return motion.trapezoid_time(distance, self.speed)
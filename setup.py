@@ -23,12 +23,13 @@ setup(
         'Operating System :: Microsoft :: Windows',
         ],
     keywords='sequencing, HiSeq, automation, biology',
-    packages=['pyseq'],
+    packages=['pyseq', 'pyseq.sim'],
     python_requires='>=3.5',
     install_requires=['pyserial>=3', #add version numbers
                       'numpy',
                       'scipy',
-                      'imageio'],
+                      'imageio',
+                      'tifffile>=2022.7.28'],
     package_data={
         'pyseq': ['recipes/*'] },
     #package_data={  # Optional
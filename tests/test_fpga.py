@@ -0,0 +1,64 @@
+"""Tests of matching FPGA responses to the commands they answer."""
+
+import queue
+
+import pytest
+
+from pyseq import fpga
+from pyseq import transport
+
+
+class FakePort():
+    """Serial transport that only answers with the queued responses."""
+
+    def __init__(self, *args, **kwargs):
+        self.responses = queue.Queue()
+        self.sent = []
+        self.histogram = transport.LatencyHistogram('FPGA')
+
+    def send(self, text):
+        self.sent.append(text)
+
+    def readline(self):
+        try:
+            return self.responses.get(timeout = 0.05)
+        except queue.Empty:
+            return ''
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def f(monkeypatch):
+    monkeypatch.setattr(transport, 'Transport', FakePort)
+    f = fpga.FPGA('command port', 'response port')
+    f.timeout = 1
+    yield f
+    f.close()
+
+
+def test_reply_without_name_goes_to_oldest_pending(f):
+    ex = f.submit('EX1HM')
+    obj = f.submit('ZDACR')
+    tilt = f.submit('T1RD')
+
+    f.serial_port.responses.put('T1RD 5\n')
+    f.serial_port.responses.put('ERROR 3\n')                                    # Does not echo the command
+    f.serial_port.responses.put('ZDACR 30000\n')
+
+    assert f.result(tilt) == 'T1RD 5\n'
+    assert f.result(ex) == 'ERROR 3\n'
+    assert f.result(obj) == 'ZDACR 30000\n'
+    assert not f.pending
+
+
+def test_late_reply_is_dropped(f):
+    f.timeout = 0.1
+    assert f.command('ZDACR') == ''
+
+    tilt = f.submit('T1RD')
+    f.serial_port.responses.put('ZDACR 30000\n')                                # Answer to the timed out command
+    f.serial_port.responses.put('T1RD 5\n')
+
+    assert f.result(tilt) == 'T1RD 5\n'
@@ -0,0 +1,64 @@
+"""Tests of PySeq2500 on the simulated HiSeq."""
+
+import asyncio
+import os
+
+import imageio
+import pytest
+
+import pyseq
+from pyseq import sim
+
+
+@pytest.fixture
+def hs(tmp_path):
+    sim.reset(speedup = 100)
+    hs = pyseq.HiSeq(backend = 'sim')
+    hs.image_path = str(tmp_path) + os.sep
+    yield hs
+    hs.writer.flush()
+
+
+@pytest.mark.parametrize('user_memory', [False, True])
+def test_take_picture(hs, user_memory):
+    hs.initializeCams(user_memory = user_memory)
+    hs.initializeInstruments()
+
+    assert hs.take_picture(4, 128, 'test')
+    hs.writer.flush()
+    for cam in [hs.cam1, hs.cam2]:
+        for path in cam.imagePaths('test', hs.image_path):
+            image = imageio.imread(path)
+            assert image.shape == (4*128, cam.frame_x//2)
+            assert image.any()
+
+
+def test_gather_moves_in_running_loop(hs):
+    hs.initializeCams()
+    hs.initializeInstruments()
+
+    async def move():
+        return hs.gather_moves(x = 12000, y = 7000000, ex1 = 'home',
+                               em_in = True)
+
+    moves = asyncio.run(move())
+    assert moves['x'] and moves['y']
+    assert hs.x.position == 12000
+
+
+@pytest.mark.parametrize('drop_rate', [0.0, 1.0])
+def test_mapped_images(hs, drop_rate):
+    hs.initializeCams()
+    hs.initializeInstruments()
+    hs.map_images = True
+    hs.rescan_attempts = 0
+    for name, instrument in sim.instruments.items():
+        if hasattr(instrument, 'drop_rate'):
+            instrument.drop_rate = drop_rate
+
+    complete = hs.take_picture(4, 128, 'mapped')
+    hs.writer.flush()
+    assert complete == (drop_rate == 0.0)
+    for cam in [hs.cam1, hs.cam2]:
+        for path in cam.imagePaths('mapped', hs.image_path):
+            assert os.path.exists(path) == complete
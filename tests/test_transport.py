@@ -0,0 +1,33 @@
+"""Tests of the serial transport."""
+
+import logging
+
+from pyseq import transport
+
+
+def test_command_over_loopback():
+    t = transport.Transport('loop://', name = 'loop', terminator = b'\r')
+    assert t.command('HELLO') == 'HELLO\n'
+    assert t.histogram.n == 1
+    t.close()
+
+
+def test_report_keeps_instruments_with_the_same_name():
+    first = transport.Transport('loop://', name = 'twice')
+    second = transport.Transport('loop://', name = 'twice')
+    first.command('A')
+    second.command('B')
+
+    summary = transport.report(logging.getLogger('test'))
+    assert summary['twice']['n'] == 1
+    assert summary['twice#2']['n'] == 1
+    first.close()
+    second.close()
+
+
+def test_percentile_is_not_above_max():
+    histogram = transport.LatencyHistogram('test')
+    for latency in [0.0005] * 9 + [0.6166]:
+        histogram.record('X', latency)
+    assert histogram.percentile(90) <= histogram.max
+    assert histogram.percentile(100) == histogram.max